@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from .config import settings
+
+class AdmissionRejected(Exception):
+    """En ny session släpps inte in. `reason` går till klienten i `error`."""
+
+    def __init__(self, reason: str, detail: str, retry_after_s: float = 0.0) -> None:
+        super().__init__(detail)
+        self.reason = reason
+        self.detail = detail
+        self.retry_after_s = retry_after_s
+
+
+class Ticket:
+    """En insläppt session. `release()` (idempotent) lämnar tillbaka platsen."""
+
+    __slots__ = ("_controller", "client", "released")
+
+    def __init__(self, controller: AdmissionController, client: str) -> None:
+        self._controller = controller
+        self.client = client
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+
+class AdmissionStats:
+    def __init__(self) -> None:
+        self.admitted = 0
+        self.queued = 0
+        self.rejected: Dict[str, int] = {}
+        self.wait_ms_max = 0.0
+
+    def reject(self, reason: str) -> None:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": dict(self.rejected),
+            "wait_ms_max": self.wait_ms_max,
+        }
+
+
+class AdmissionController:
+    """Begränsar samtidiga /ws/transcribe-sessioner i processen.
+
+    Högst `max_sessions` totalt och `max_per_client` per klient-IP (0 =
+    obegränsat). Gränsen per klient gäller även väntande: den kollas igen
+    när en plats blir ledig. Är det fullt får en ny session vänta i en FIFO-kö (högst
+    `queue_max` väntande) i upp till `queue_timeout_s`; sedan avvisas den.
+
+    Upstreams `rate_limits.updated` matas in med `note_rate_limits()`. När
+    någon gräns har mindre kvar än `slow_below` (andel av limit) släpps
+    inga nya sessioner in förrän gränsen återställs – de väntar i kön som
+    vid full server. Under `reject_below` avvisas de direkt.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int,
+        max_per_client: int = 0,
+        queue_max: int = 0,
+        queue_timeout_s: float = 5.0,
+        slow_below: float = 0.0,
+        reject_below: float = 0.0,
+    ) -> None:
+        self.max_sessions = max_sessions
+        self.max_per_client = max_per_client
+        self.queue_max = queue_max
+        self.queue_timeout_s = queue_timeout_s
+        self.slow_below = slow_below
+        self.reject_below = reject_below
+        self.active = 0
+        self._per_client: Dict[str, int] = {}
+        self._waiters: Deque[Tuple[str, asyncio.Future]] = deque()
+        # gränsens namn -> (kvar / limit, time.monotonic() när den återställs)
+        self._limits: Dict[str, Tuple[float, float]] = {}
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+        self.stats = AdmissionStats()
+
+    async def acquire(
+        self, client: str, on_queued: Optional[Callable[[int], Awaitable[None]]] = None
+    ) -> Ticket:
+        """Vänta på en plats. Kastar AdmissionRejected om ingen plats ges.
+
+        `on_queued(plats i kön)` anropas om sessionen måste vänta.
+        """
+        if self._client_full(client):
+            self.stats.reject("too_many_sessions")
+            raise self._too_many()
+        limited, reset_in = self._rate_limited(self.reject_below)
+        if limited:
+            self.stats.reject("upstream_rate_limited")
+            raise AdmissionRejected("upstream_rate_limited", "upstreams rate limit är nästan slut", reset_in)
+        if not self._waiters and self._has_room():
+            return self._admit(client)
+
+        if len(self._waiters) >= self.queue_max:
+            self.stats.reject("server_busy")
+            raise AdmissionRejected("server_busy", "servern är full", self.queue_timeout_s)
+        self.stats.queued += 1
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        entry = (client, fut)
+        self._waiters.append(entry)
+        t0 = time.monotonic()
+        try:
+            if on_queued is not None:
+                await on_queued(len(self._waiters))
+            ticket = await asyncio.wait_for(fut, max(0.0, self.queue_timeout_s - (time.monotonic() - t0)))
+        except asyncio.TimeoutError:
+            self.stats.reject("queue_timeout")
+            raise AdmissionRejected("server_busy", "ingen plats inom väntetiden", self.queue_timeout_s) from None
+        except BaseException:
+            # Avbruten (klienten försvann, nedstängning) precis när en plats gavs
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                fut.result().release()
+            raise
+        finally:
+            self._remove_waiter(entry)
+        wait_ms = (time.monotonic() - t0) * 1000.0
+        if wait_ms > self.stats.wait_ms_max:
+            self.stats.wait_ms_max = wait_ms
+        return ticket
+
+    def note_rate_limits(self, rate_limits: Any) -> None:
+        """Läs `rate_limits` ur ett `rate_limits.updated`-event."""
+        if not isinstance(rate_limits, list):
+            return
+        now = time.monotonic()
+        for rl in rate_limits:
+            if not isinstance(rl, dict):
+                continue
+            name, limit, remaining = rl.get("name"), rl.get("limit"), rl.get("remaining")
+            if not isinstance(name, str) or not isinstance(limit, (int, float)) or limit <= 0:
+                continue
+            if not isinstance(remaining, (int, float)):
+                continue
+            reset_s = rl.get("reset_seconds")
+            reset_s = float(reset_s) if isinstance(reset_s, (int, float)) else 0.0
+            self._limits[name] = (remaining / limit, now + reset_s)
+        self._schedule_wake()
+        self._wake()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "max_sessions": self.max_sessions,
+            "max_per_client": self.max_per_client,
+            "clients": len(self._per_client),
+            "rate_limits": {
+                name: {"remaining_frac": round(frac, 4), "reset_in_s": round(max(0.0, reset_at - now), 3)}
+                for name, (frac, reset_at) in self._limits.items()
+            },
+            **self.stats.as_dict(),
+        }
+
+    # ------------------------------------------------------------------
+
+    def _client_full(self, client: str) -> bool:
+        return self.max_per_client > 0 and self._per_client.get(client, 0) >= self.max_per_client
+
+    def _too_many(self) -> AdmissionRejected:
+        return AdmissionRejected("too_many_sessions", f"högst {self.max_per_client} samtidiga sessioner per klient")
+
+    def _has_room(self) -> bool:
+        if self.max_sessions > 0 and self.active >= self.max_sessions:
+            return False
+        return not self._rate_limited(self.slow_below)[0]
+
+    def _rate_limited(self, below: float) -> Tuple[bool, float]:
+        """(någon gräns under `below` och ännu inte återställd, sekunder kvar till återställning)"""
+        if below <= 0 or not self._limits:
+            return False, 0.0
+        now = time.monotonic()
+        reset_in = 0.0
+        for frac, reset_at in self._limits.values():
+            if frac < below and reset_at > now:
+                reset_in = max(reset_in, reset_at - now)
+        return reset_in > 0, reset_in
+
+    def _admit(self, client: str) -> Ticket:
+        self.active += 1
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        self.stats.admitted += 1
+        return Ticket(self, client)
+
+    def _release(self, ticket: Ticket) -> None:
+        self.active -= 1
+        n = self._per_client.get(ticket.client, 0) - 1
+        if n > 0:
+            self._per_client[ticket.client] = n
+        else:
+            self._per_client.pop(ticket.client, None)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_room():
+            client, fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            if self._client_full(client):
+                # Klienten fick fler platser medan den här väntade
+                self.stats.reject("too_many_sessions")
+                fut.set_exception(self._too_many())
+            else:
+                fut.set_result(self._admit(client))
+
+    def _remove_waiter(self, entry: Tuple[str, asyncio.Future]) -> None:
+        try:
+            self._waiters.remove(entry)
+        except ValueError:
+            pass
+
+    def _schedule_wake(self) -> None:
+        # Väntande sessioner ska släppas in när en låg gräns återställs,
+        # även om ingen session hinner avslutas innan dess
+        limited, reset_in = self._rate_limited(self.slow_below)
+        if self._wake_handle is not None:
+            self._wake_handle.cancel()
+            self._wake_handle = None
+        if limited:
+            self._wake_handle = asyncio.get_running_loop().call_later(reset_in + 0.01, self._wake)
+
+
+admission = AdmissionController(
+    max_sessions=settings.admission_max_sessions,
+    max_per_client=settings.admission_max_per_client,
+    queue_max=settings.admission_queue_max,
+    queue_timeout_s=settings.admission_queue_timeout_s,
+    slow_below=settings.admission_rate_limit_slow_below,
+    reject_below=settings.admission_rate_limit_reject_below,
+)
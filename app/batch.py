@@ -0,0 +1,403 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+import wave
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from .admission import admission
+from .config import settings
+from .realtime_client import OpenAIRealtimeClient
+from .realtime_codec import EventDispatcher
+from .realtime_pool import new_client
+from .stt.receive_audio_from_frontend import AudioFormat, FormatConverter
+from .stt.segmenter import FrameEnergy, split_at_silence
+
+log = logging.getLogger("stt")
+
+FRAME_MS = 10
+READ_BYTES = 256 * 1024        # läsbit vid konvertering från disk
+WRITE_BYTES = 1024 * 1024      # uppladdningen samlas till så här stora skrivningar (i en tråd)
+APPEND_BYTES = 256 * 1024      # PCM16 per input_audio_buffer.append (~5 s vid 24 kHz)
+MIN_SEGMENT_MS = 100           # Realtime vägrar commit med mindre ljud
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def _new_batch_client() -> OpenAIRealtimeClient:
+    """Replay-bufferten måste rymma ett helt segment, annars kan det inte
+    skickas om efter en återanslutning (ett segment är ett item)."""
+    replay_ms = settings.upstream_replay_max_ms
+    if replay_ms > 0:
+        replay_ms = max(replay_ms, int(settings.batch_segment_max_s * 1000))
+    return new_client(server_vad=False, replay_max_ms=replay_ms)
+
+
+class BatchJob:
+    def __init__(self, job_id: str, workdir: str) -> None:
+        self.id = job_id
+        self.workdir = workdir
+        self.status = "receiving"      # receiving | queued | running | done | partial | failed
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.upload_bytes = 0
+        self.audio_in: Optional[AudioFormat] = None
+        self.duration_ms = 0.0
+        # index, start_ms, end_ms, text, status (pending | done | failed | skipped)
+        self.segments: List[Dict[str, Any]] = []
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def src_path(self) -> str:
+        return os.path.join(self.workdir, "upload")
+
+    @property
+    def pcm_path(self) -> str:
+        return os.path.join(self.workdir, "audio.pcm")
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "partial", "failed")
+
+    def snapshot(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for seg in self.segments:
+            counts[seg["status"]] = counts.get(seg["status"], 0) + 1
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "upload_bytes": self.upload_bytes,
+            "audio_in": self.audio_in.as_dict() if self.audio_in else None,
+            "duration_ms": round(self.duration_ms),
+            "segments_total": len(self.segments),
+            "segments_done": counts.get("done", 0),
+            "segments_failed": counts.get("failed", 0),
+        }
+
+    def result(self) -> Dict[str, Any]:
+        segs = [
+            {"index": s["index"], "start_ms": s["start_ms"], "end_ms": s["end_ms"], "text": s["text"], "status": s["status"]}
+            for s in self.segments
+        ]
+        text = " ".join(s["text"].strip() for s in self.segments if s["text"])
+        return {"job_id": self.id, "status": self.status, "duration_ms": round(self.duration_ms), "text": text, "segments": segs}
+
+
+class BatchJobManager:
+    """Transkribering av inspelade filer i bakgrunden.
+
+    Uppladdningen skrivs till disk i bitar, konverteras (i en tråd) till
+    PCM16 mono i upstream-frekvensen och delas vid tystnader i segment på
+    högst `segment_max_s`. Segmenten körs genom egna Realtime-sessioner
+    (utan server-VAD, ett segment = en commit) så fort anslutningen
+    orkar: högst `job_concurrency` parallella per jobb och `max_sessions`
+    totalt i processen. Resultaten sätts ihop i ordning med tidsstämplar.
+    Avslutade jobb sparas i `ttl_s`, deras ljudfiler tas bort direkt.
+    """
+
+    def __init__(
+        self,
+        workdir: str,
+        job_concurrency: int = 4,
+        max_sessions: int = 8,
+        segment_min_s: float = 5.0,
+        segment_max_s: float = 30.0,
+        silence_dbfs: float = -45.0,
+        min_silence_ms: int = 300,
+        segment_timeout_s: float = 60.0,
+        ttl_s: float = 3600.0,
+        max_jobs: int = 100,
+        factory: Callable[[], OpenAIRealtimeClient] = _new_batch_client,
+    ) -> None:
+        self.workdir = workdir
+        self.job_concurrency = max(1, job_concurrency)
+        self.max_sessions = max(1, max_sessions)
+        self.segment_min_s = segment_min_s
+        self.segment_max_s = segment_max_s
+        self.silence_dbfs = silence_dbfs
+        self.min_silence_ms = min_silence_ms
+        self.segment_timeout_s = segment_timeout_s
+        self.ttl_s = ttl_s
+        self.max_jobs = max_jobs
+        self.factory = factory
+        self._jobs: Dict[str, BatchJob] = {}
+        self._sessions: Optional[asyncio.Semaphore] = None
+
+    # --- API -----------------------------------------------------------------
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        self._sweep()
+        return self._jobs.get(job_id)
+
+    def can_accept(self) -> bool:
+        self._sweep()
+        return sum(1 for j in self._jobs.values() if not j.finished) < self.max_jobs
+
+    async def receive(self, body: AsyncIterator[bytes], max_bytes: int) -> BatchJob:
+        """Skriv en uppladdning till disk utan att hålla den i minnet.
+
+        Diskskrivningarna görs i en worker-tråd, så att en långsam disk inte
+        stoppar event-loopen (och alla strömmande sessioner) under uppladdningen.
+        """
+        job = BatchJob(uuid.uuid4().hex, os.path.join(self.workdir, uuid.uuid4().hex))
+        os.makedirs(job.workdir, exist_ok=True)
+        self._jobs[job.id] = job
+        try:
+            f = await asyncio.to_thread(open, job.src_path, "wb")
+            try:
+                pending: List[bytes] = []
+                pending_bytes = 0
+                async for chunk in body:
+                    job.upload_bytes += len(chunk)
+                    if job.upload_bytes > max_bytes:
+                        raise UploadTooLarge(job.upload_bytes)
+                    pending.append(chunk)
+                    pending_bytes += len(chunk)
+                    if pending_bytes >= WRITE_BYTES:
+                        await asyncio.to_thread(f.writelines, pending)
+                        pending = []
+                        pending_bytes = 0
+                if pending:
+                    await asyncio.to_thread(f.writelines, pending)
+            finally:
+                await asyncio.to_thread(f.close)
+        except BaseException:
+            self.delete(job.id)
+            raise
+        return job
+
+    def start(self, job: BatchJob, raw_format: Optional[AudioFormat]) -> None:
+        """Starta jobbet. `raw_format` = None betyder att filen är WAV."""
+        job.status = "queued"
+        job.task = asyncio.create_task(self._run(job, raw_format))
+
+    def delete(self, job_id: str) -> bool:
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+        shutil.rmtree(job.workdir, ignore_errors=True)
+        return True
+
+    async def stop(self) -> None:
+        for job_id in list(self._jobs):
+            self.delete(job_id)
+
+    # --- körning -------------------------------------------------------------
+
+    async def _run(self, job: BatchJob, raw_format: Optional[AudioFormat]) -> None:
+        try:
+            job.status = "running"
+            segments = await asyncio.to_thread(self._prepare, job, raw_format)
+            if self._sessions is None:
+                self._sessions = asyncio.Semaphore(self.max_sessions)
+            bytes_per_ms = settings.upstream_sample_rate_hz * 2 / 1000
+            queue: asyncio.Queue = asyncio.Queue()
+            for seg in segments:
+                if seg["end_ms"] - seg["start_ms"] < MIN_SEGMENT_MS:
+                    seg["status"] = "skipped"
+                else:
+                    queue.put_nowait(seg)
+            n_workers = min(self.job_concurrency, queue.qsize())
+            await asyncio.gather(*(self._worker(job, queue, bytes_per_ms) for _ in range(n_workers)))
+            failed = sum(1 for seg in segments if seg["status"] == "failed")
+            if failed and failed == sum(1 for seg in segments if seg["status"] != "skipped"):
+                job.status = "failed"
+                job.error = f"alla {failed} segment misslyckades"
+            else:
+                job.status = "partial" if failed else "done"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("Batchjobb %s misslyckades: %s", job.id, e)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            shutil.rmtree(job.workdir, ignore_errors=True)
+
+    def _prepare(self, job: BatchJob, raw_format: Optional[AudioFormat]) -> List[Dict[str, Any]]:
+        """Konvertera till PCM16 mono (upstream-frekvens) och dela vid tystnader. Körs i en tråd."""
+        out_rate = settings.upstream_sample_rate_hz
+        energy = FrameEnergy(out_rate, FRAME_MS)
+        written = 0
+        with open(job.src_path, "rb") as src, open(job.pcm_path, "wb") as dst:
+            if raw_format is None:
+                try:
+                    w = wave.open(src, "rb")
+                except (wave.Error, EOFError) as e:
+                    raise ValueError(f"ogiltig WAV-fil: {e}") from None
+                if w.getsampwidth() != 2:
+                    raise ValueError("WAV måste vara 16-bitars PCM")
+                fmt = AudioFormat("pcm16", w.getframerate(), w.getnchannels())
+                frames_per_read = max(1, READ_BYTES // fmt.frame_bytes)
+                read = lambda: w.readframes(frames_per_read)  # noqa: E731
+            else:
+                fmt = raw_format
+                read = lambda: src.read(READ_BYTES)  # noqa: E731
+            job.audio_in = fmt
+            conv = FormatConverter(fmt, out_rate)
+            while True:
+                data = read()
+                if not data:
+                    break
+                pcm = conv.process(data)
+                if pcm:
+                    dst.write(pcm)
+                    energy.process(pcm)
+                    written += len(pcm)
+        os.remove(job.src_path)
+
+        samples_per_frame = out_rate * FRAME_MS // 1000
+        frame_bytes = samples_per_frame * 2
+        job.duration_ms = written / (out_rate * 2 / 1000)
+        bounds = split_at_silence(
+            energy.finish(),
+            min_frames=int(self.segment_min_s * 1000 / FRAME_MS),
+            max_frames=int(self.segment_max_s * 1000 / FRAME_MS),
+            threshold_dbfs=self.silence_dbfs,
+            min_silence_frames=max(1, self.min_silence_ms // FRAME_MS),
+        )
+        job.segments = [
+            {
+                "index": i,
+                "offset": start * frame_bytes,
+                "length": min(written, end * frame_bytes) - start * frame_bytes,
+                "start_ms": start * FRAME_MS,
+                "end_ms": min(job.duration_ms, end * FRAME_MS),
+                "text": "",
+                "status": "pending",
+            }
+            for i, (start, end) in enumerate(bounds)
+        ]
+        return job.segments
+
+    async def _worker(self, job: BatchJob, queue: asyncio.Queue, bytes_per_ms: float) -> None:
+        """En Realtime-session som tar segment ur kön tills den är tom."""
+        async with self._sessions:
+            client: Optional[OpenAIRealtimeClient] = None
+            events: asyncio.Queue = asyncio.Queue()
+            recv_task: Optional[asyncio.Task] = None
+            try:
+                while not queue.empty():
+                    seg = queue.get_nowait()
+                    pcm = await asyncio.to_thread(_read_range, job.pcm_path, seg["offset"], seg["length"])
+                    for attempt in (1, 2):
+                        try:
+                            if client is None or not client.is_open:
+                                await _cancel(recv_task)
+                                client = self.factory()
+                                await client.connect()
+                                events = asyncio.Queue()
+                                recv_task = asyncio.create_task(client.recv_loop(_put_events(events)))
+                            seg["text"] = await asyncio.wait_for(
+                                _transcribe(client, events, pcm), self.segment_timeout_s
+                            )
+                            seg["status"] = "done"
+                            break
+                        except (asyncio.TimeoutError, OSError, RuntimeError, ValueError) as e:
+                            log.warning("Batchsegment %s/%d försök %d: %s", job.id, seg["index"], attempt, e)
+                            seg["status"] = "failed"
+                            if client is not None:
+                                await _quiet_close(client)
+                            client = None
+            finally:
+                await _cancel(recv_task)
+                if client is not None:
+                    await _quiet_close(client)
+
+    def _sweep(self) -> None:
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - (job.finished_at or now) > self.ttl_s
+        ]
+        for job_id in expired:
+            self.delete(job_id)
+
+
+def _read_range(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+# Events som `_transcribe` tittar på; övriga parsas inte ens
+_SEGMENT_EVENTS = (
+    "input_audio_buffer.committed",
+    "conversation.item.input_audio_transcription.completed",
+    "conversation.item.input_audio_transcription.failed",
+    "error",
+)
+
+
+def _put_events(events: asyncio.Queue) -> EventDispatcher:
+    async def on_event(evt: dict) -> None:
+        events.put_nowait(evt)
+    async def on_rate_limits(evt: dict) -> None:
+        admission.note_rate_limits(evt.get("rate_limits"))
+    dispatcher = EventDispatcher()
+    for event_type in _SEGMENT_EVENTS:
+        dispatcher.on(event_type, on_event)
+    dispatcher.on("rate_limits.updated", on_rate_limits)
+    return dispatcher
+
+
+async def _transcribe(client: OpenAIRealtimeClient, events: asyncio.Queue, pcm: bytes) -> str:
+    """Skicka ett segment, commit:a och vänta på dess transkript."""
+    for i in range(0, len(pcm), APPEND_BYTES):
+        await client.send_audio_chunk(pcm[i:i + APPEND_BYTES])
+    await client.commit()
+    item_id = None
+    while True:
+        evt = await events.get()
+        t = evt.get("type")
+        if t == "input_audio_buffer.committed" and item_id is None:
+            item_id = evt.get("item_id")
+        elif t == "conversation.item.input_audio_transcription.completed":
+            if item_id is None or evt.get("item_id") == item_id:
+                return evt.get("transcript") or ""
+        elif t == "conversation.item.input_audio_transcription.failed":
+            if item_id is None or evt.get("item_id") == item_id:
+                raise ValueError(f"transkribering misslyckades: {evt.get('error')}")
+        elif t == "error":
+            raise ValueError(f"Realtime-fel: {evt.get('error', evt)}")
+
+
+async def _cancel(task: Optional[asyncio.Task]) -> None:
+    """Avbryt och vänta in recv-loopen, så att dess fel inte blir hängande."""
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def _quiet_close(client: OpenAIRealtimeClient) -> None:
+    try:
+        await client.close()
+    except Exception:
+        pass
+
+
+jobs = BatchJobManager(
+    workdir=settings.batch_dir,
+    job_concurrency=settings.batch_job_concurrency,
+    max_sessions=settings.batch_max_sessions,
+    segment_min_s=settings.batch_segment_min_s,
+    segment_max_s=settings.batch_segment_max_s,
+    silence_dbfs=settings.batch_silence_dbfs,
+    min_silence_ms=settings.batch_min_silence_ms,
+    segment_timeout_s=settings.batch_segment_timeout_s,
+    ttl_s=settings.batch_job_ttl_s,
+    max_jobs=settings.batch_max_jobs,
+)
@@ -16,9 +16,126 @@ class Settings(BaseModel):
     realtime_url: str = "wss://api.openai.com/v1/realtime?model=gpt-4o-mini-realtime-preview-2024-12-17"
     transcribe_model: str = "gpt-4o-mini-transcribe"
     input_language: str = "sv"
-    commit_interval_ms: int = 150
+    commit_interval_ms: int = 150      # grundintervall, anpassas per session
+    commit_min_audio_ms: int = 500     # commit:a aldrig mindre (kortare bitar ger Whisper ordfragment)
+    # Med server-VAD delar upstream själv vid tystnad; timern commit:ar bara
+    # om det gått så här mycket ljud utan en commit (långt tal utan paus)
+    commit_vad_fallback_ms: int = 5000
+    commit_max_interval_ms: int = 2000
+    commit_idle_timeout_ms: int = 2000
+    commit_tick_ms: int = 25           # upplösning i den gemensamma timer-wheel:n
+    audio_in_sample_rate_hz: int = 16000   # default för klienter som inte anger format
+    upstream_sample_rate_hz: int = 24000   # Realtime pcm16 = 24 kHz mono
+
+    # --- Sammanslagning av ljudchunks innan de skickas upstream (0 = av) ---
+    audio_coalesce_ms: int = 40
+    audio_coalesce_max_latency_ms: int = 60
+    # Ljudbatcher från så här många byte base64-kodas i en worker-tråd
+    audio_encode_offload_bytes: int = 256 * 1024
+
+    # Avslutade transkript-items som sparas per session (för sena events)
+    transcript_max_finalized_items: int = 200
+
+    # --- Batchtranskribering av filer (/batch/jobs) ---
+    batch_dir: str = "/tmp/stt-batch"
+    batch_max_upload_bytes: int = 1024 * 1024 * 1024
+    batch_job_concurrency: int = 4        # parallella Realtime-sessioner per jobb
+    batch_max_sessions: int = 8           # ... och totalt i processen
+    batch_segment_min_s: float = 5.0
+    batch_segment_max_s: float = 30.0     # segment delas vid tystnad, aldrig längre än så här
+    batch_silence_dbfs: float = -45.0
+    batch_min_silence_ms: int = 300
+    batch_segment_timeout_s: float = 60.0
+    batch_job_ttl_s: float = 3600.0       # färdiga jobb (resultat) sparas så länge
+    batch_max_jobs: int = 100             # pågående jobb samtidigt
+
+    # --- Inspelning av sessioner (ljud + händelselogg), av som default ---
+    recording_enabled: bool = False
+    recording_sample_rate: float = 1.0          # andel sessioner som spelas in
+    recording_dir: str = "/tmp/stt-recordings"
+    recording_max_session_bytes: int = 64 * 1024 * 1024
+    recording_max_total_bytes: int = 2 * 1024 * 1024 * 1024
+    recording_retention_s: float = 7 * 24 * 3600
+
+    # --- Antagning av nya /ws/transcribe-sessioner (0 = obegränsat) ---
+    admission_max_sessions: int = 0          # t.ex. 500; av som default, som före antagningen
+    admission_max_per_client: int = 0        # per klient-IP; bakom en proxy delar alla samma IP
+    admission_queue_max: int = 100           # väntande sessioner när det är fullt
+    admission_queue_timeout_s: float = 5.0
+    # Andel kvar av en upstream-rate-limit (rate_limits.updated) under vilken
+    # nya sessioner får vänta tills den återställs, resp. avvisas direkt
+    admission_rate_limit_slow_below: float = 0.10
+    admission_rate_limit_reject_below: float = 0.02
+
+    # --- Tidslinjer per session (Chrome trace-event, öppnas i Perfetto), av som default ---
+    tracing_enabled: bool = False
+    tracing_sample_rate: float = 0.01      # andel sessioner; ?trace=1 spårar alltid när påslaget
+    tracing_dir: str = "/tmp/stt-traces"
+    tracing_max_events: int = 200_000      # per session, resten räknas bara
+    tracing_max_files: int = 1000
+
+    # --- Återanslutning (?resume=<session_id>&resume_token=<t>&last_seq=<n>), av som default ---
+    # Så länge hålls en bortkopplad session vid liv – med upstream-anslutning
+    # och antagningsplats. Gäller bara avbrott; stängd flik (1001) avslutar
+    session_resume_grace_s: float = 0.0
+    session_replay_max_messages: int = 256   # skickade meddelanden som kan skickas om
+
+    # --- Läsande prenumeranter på en sessions transkript (/ws/subscribe?session_id=<id>) ---
+    subscribe_max_per_session: int = 16     # 0 = av
+    subscribe_queue_max: int = 256           # meddelanden per prenumerant
+    subscribe_queue_policy: str = "drop_oldest"   # eller "close": för långsam läsare kopplas bort
+
+    # --- Cache för transkript av ljud som kommit förut (kiosk/IVR), av som default ---
+    # Nyckel = ljudet i ett item. Påslagen stänger den av commits på timer, så
+    # att upstreams server-VAD delar ljudet i yttranden (kräver upstream_replay_max_ms > 0)
+    transcript_cache_enabled: bool = False
+    transcript_cache_max_entries: int = 10_000
+    transcript_cache_ttl_s: float = 24 * 3600
+    transcript_cache_min_ms: int = 200          # kortare yttranden (utan tystnad runt) cachas inte
+    transcript_cache_max_ms: int = 10_000       # längre hashas inte
+    transcript_cache_silence_dbfs: float = -50.0   # tystnad först och sist ingår inte i nyckeln
+    transcript_cache_dir: str = ""              # tom = bara i minnet
+    transcript_cache_disk_max_entries: int = 100_000
+
+    # --- /metrics (Prometheus-textformat). Av = inga mätningar alls ---
+    metrics_enabled: bool = True
+
+    # --- Debugbuffrar per session (/debug/*) ---
+    debug_max_sessions: int = 1000
+    debug_session_ttl_s: float = 3600.0   # avslutade sessioner sparas så länge
+    debug_max_items: int = 500
+    # "memory" = per process (default). "sqlite" = en WAL-fil som alla
+    # workers på noden delar, så /debug/* fungerar med uvicorn --workers N
+    debug_store_backend: str = "memory"
+    debug_store_path: str = "/tmp/stt-debug.sqlite3"
+    debug_store_flush_ms: int = 100
+
+    # --- Köer per session. Policy vid full kö: block | drop_oldest | close ---
+    upstream_queue_max: int = 256       # ljudchunks från frontend
+    upstream_queue_policy: str = "block"
+    frontend_queue_max: int = 256       # meddelanden till frontend
+    frontend_queue_policy: str = "drop_oldest"
+
+    # --- Lokal VAD som gallrar tystnad innan den går upstream (av som default) ---
+    vad_enabled: bool = False
+    vad_frame_ms: int = 10
+    vad_threshold_dbfs: float = -45.0
+    vad_zcr_max: float = 0.35
+    vad_hangover_ms: int = 600        # > server-VAD:ns silence_duration_ms
+    vad_prefix_padding_ms: int = 300
     add_beta_header: bool = True
 
+    # --- Återanslutning om Realtime-anslutningen tappas mitt i en session (0 = av) ---
+    upstream_replay_max_ms: int = 15000        # ljud som ännu inte bekräftats som commit:at
+    upstream_reconnect_attempts: int = 5
+    upstream_reconnect_backoff_ms: int = 200   # första försöket görs direkt, sedan jittrad backoff
+    upstream_reconnect_backoff_max_ms: int = 5000
+
+    # --- Pool med förvärmda Realtime-anslutningar (0 = av) ---
+    realtime_pool_size: int = 2
+    realtime_pool_max_age_s: float = 300.0   # max ålder för en anslutning i poolen
+    realtime_pool_idle_ttl_s: float = 120.0  # pensionera om den legat oanvänd så länge
+
     # Behåller str-format (kommaseparerad) för minimal risk i resten av koden
     cors_origins: str = (
         "*.lovable.app,"
@@ -2,39 +2,189 @@ from __future__ import annotations
 
 import time
 import uuid
-from collections import deque
-from typing import Dict, Deque, List, Any
+from array import array
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import settings
+
+
+class IntRing:
+    """Ringbuffer av heltal i en `array` (4 byte per post).
+
+    Ersätter `deque` av Python-int för byte-längder: ingen int-objekt-
+    eller nodallokering per append, och `tail()` rör bara de sista posterna.
+    """
+
+    __slots__ = ("_data", "_head", "_len")
+
+    def __init__(self, capacity: int, typecode: str = "I") -> None:
+        self._data = array(typecode, [0]) * max(1, capacity)
+        self._head = 0  # nästa skrivposition
+        self._len = 0
+
+    def append(self, value: int) -> None:
+        data = self._data
+        data[self._head] = value
+        self._head = (self._head + 1) % len(data)
+        if self._len < len(data):
+            self._len += 1
+
+    def clear(self) -> None:
+        self._head = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def tail(self, limit: int) -> List[int]:
+        k = min(limit, self._len)
+        if k <= 0:
+            return []
+        start = (self._head - k) % len(self._data)
+        if start + k <= len(self._data):
+            return self._data[start:start + k].tolist()
+        return self._data[start:].tolist() + self._data[:self._head].tolist()
+
+
+class TextRing(deque):
+    """deque med maxlen och en `tail()` som bara läser de sista posterna."""
+
+    def tail(self, limit: int) -> List[str]:
+        out = list(islice(reversed(self), limit))
+        out.reverse()
+        return out
+
 
 class SessionBuffers:
     def __init__(self, max_items: int = 500):
         self.started_at = time.time()
-        self.frontend_chunks: Deque[int] = deque(maxlen=max_items)   # store byte lengths
-        self.openai_chunks: Deque[int] = deque(maxlen=max_items)     # store byte lengths (after b64 append)
-        self.openai_text: Deque[str] = deque(maxlen=max_items)
-        self.frontend_text: Deque[str] = deque(maxlen=max_items)
-        self.rt_events: Deque[str] = deque(maxlen=max_items)
+        self.ended_at: Optional[float] = None   # time.monotonic() när sessionen stängdes
+        self.frontend_chunks = IntRing(max_items)   # store byte lengths
+        self.openai_chunks = IntRing(max_items)     # store byte lengths (after b64 append)
+        self.openai_text = TextRing(maxlen=max_items)
+        self.frontend_text = TextRing(maxlen=max_items)
+        self.rt_events = TextRing(maxlen=max_items)
+        # Levande mätvärden (köer m.m.) som läses först när någon frågar
+        self.probes: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+    @property
+    def active(self) -> bool:
+        return self.ended_at is None
+
+    def clear(self) -> None:
+        for ring in (self.frontend_chunks, self.openai_chunks, self.openai_text, self.frontend_text, self.rt_events):
+            ring.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: probe() for name, probe in self.probes.items()}
+
 
 class DebugStore:
-    def __init__(self):
-        self._sessions: Dict[str, SessionBuffers] = {}
+    """Debugbuffrar per session, med tak på minnet.
+
+    Högst `max_sessions` sessioner sparas. Avslutade sessioner tas bort när
+    de varit orörda i `idle_ttl_s`, och blir det ändå för många kastas de
+    minst nyligen använda först (avslutade före pågående). Läsningar via
+    `get()` skapar aldrig nya sessioner.
+    """
+
+    # Läsningar är billiga och måste göras i eventloopen (buffrarna har inga lås)
+    reads_block = False
+
+    def __init__(self, max_sessions: int = 1000, idle_ttl_s: float = 3600.0, max_items: int = 500):
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self.max_items = max_items
+        # Ordning = LRU, minst nyligen använd först
+        self._sessions: "OrderedDict[str, SessionBuffers]" = OrderedDict()
+        self._next_sweep = 0.0
+
+    def get(self, session_id: str) -> Optional[SessionBuffers]:
+        buf = self._sessions.get(session_id)
+        if buf is not None:
+            self._sessions.move_to_end(session_id)
+        return buf
 
     def get_or_create(self, session_id: str) -> SessionBuffers:
-        if session_id not in self._sessions:
-            self._sessions[session_id] = SessionBuffers()
-        return self._sessions[session_id]
+        buf = self.get(session_id)
+        if buf is None:
+            buf = self._add(session_id)
+        return buf
 
     def new_session(self) -> str:
         sid = str(uuid.uuid4())
-        self._sessions[sid] = SessionBuffers()
+        self._add(sid)
         return sid
 
+    def close_session(self, session_id: str) -> None:
+        buf = self._sessions.get(session_id)
+        if buf is not None:
+            buf.ended_at = time.monotonic()
+            self._sessions.move_to_end(session_id)
+
     def list_sessions(self) -> List[str]:
         return list(self._sessions.keys())
 
     def reset(self, session_id: str | None = None) -> None:
         if session_id:
-            self._sessions[session_id] = SessionBuffers()
+            buf = self._sessions.get(session_id)
+            if buf is not None:
+                buf.clear()
         else:
             self._sessions.clear()
 
-store = DebugStore()
+    def close(self) -> None:
+        pass
+
+    def _add(self, session_id: str) -> SessionBuffers:
+        self._evict(reserve=1)
+        buf = SessionBuffers(self.max_items)
+        self._sessions[session_id] = buf
+        return buf
+
+    def _evict(self, reserve: int = 0) -> None:
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._next_sweep = now + min(60.0, self.idle_ttl_s / 4)
+            expired = [
+                sid for sid, buf in self._sessions.items()
+                if buf.ended_at is not None and now - buf.ended_at > self.idle_ttl_s
+            ]
+            for sid in expired:
+                del self._sessions[sid]
+
+        excess = len(self._sessions) + reserve - self.max_sessions
+        if excess <= 0:
+            return
+        # Avslutade sessioner först, i LRU-ordning, sedan pågående
+        victims = [sid for sid, buf in self._sessions.items() if not buf.active][:excess]
+        if len(victims) < excess:
+            victims += [sid for sid, buf in self._sessions.items() if buf.active][: excess - len(victims)]
+        for sid in victims:
+            del self._sessions[sid]
+
+
+def make_store(backend: str = settings.debug_store_backend):
+    """Skapa debuglagret. "memory" = per process, "sqlite" = delat mellan workers."""
+    if backend == "sqlite":
+        from .debug_store_sqlite import SqliteDebugStore
+
+        return SqliteDebugStore(
+            settings.debug_store_path,
+            max_sessions=settings.debug_max_sessions,
+            idle_ttl_s=settings.debug_session_ttl_s,
+            max_items=settings.debug_max_items,
+            flush_ms=settings.debug_store_flush_ms,
+        )
+    if backend != "memory":
+        raise ValueError(f"okänd debug_store_backend: {backend!r}")
+    return DebugStore(
+        max_sessions=settings.debug_max_sessions,
+        idle_ttl_s=settings.debug_session_ttl_s,
+        max_items=settings.debug_max_items,
+    )
+
+
+store = make_store()
@@ -0,0 +1,344 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger("stt")
+
+# Buffertarna i SessionBuffers, i samma ordning som där
+KINDS = ("frontend_chunks", "openai_chunks", "openai_text", "frontend_text", "rt_events")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    ended_at   REAL,
+    touched    REAL NOT NULL,
+    stats      TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    id         INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    kind       INTEGER NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS items_by_session ON items (session_id, kind, id);
+"""
+
+# Operationer i skrivkön: (op, session_id, ...)
+_ITEM, _NEW, _CLOSE, _STATS, _RESET, _RESET_ALL = range(6)
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+class SqliteRing:
+    """En debugbuffer i SQLite. `append()` lägger bara posten i skrivkön."""
+
+    __slots__ = ("_store", "_sid", "_kind")
+
+    def __init__(self, store: SqliteDebugStore, session_id: str, kind: int) -> None:
+        self._store = store
+        self._sid = session_id
+        self._kind = kind
+
+    def append(self, value: Any) -> None:
+        # deque.append är trådsäker utan lås; skrivtråden tar hand om resten
+        self._store._ops.append((_ITEM, self._sid, self._kind, value))
+
+    def tail(self, limit: int) -> List[Any]:
+        rows = self._store._reader().execute(
+            "SELECT value FROM items WHERE session_id = ? AND kind = ? ORDER BY id DESC LIMIT ?",
+            (self._sid, self._kind, limit),
+        ).fetchall()
+        return [r[0] for r in reversed(rows)]
+
+
+class SqliteSessionBuffers:
+    """Samma yta som `SessionBuffers`, men data ligger i den delade databasen.
+
+    Sessioner som körs i den här processen har levande `probes`; för
+    sessioner i andra workers visar `stats()` senast sparade ögonblicksbild.
+    """
+
+    def __init__(self, store: SqliteDebugStore, session_id: str, started_at: float,
+                 ended_at: Optional[float] = None, stored_stats: Optional[Dict[str, Any]] = None):
+        self.session_id = session_id
+        self.started_at = started_at
+        self.ended_at = ended_at          # time.time(), jämförbart mellan processer
+        for i, name in enumerate(KINDS):
+            setattr(self, name, SqliteRing(store, session_id, i))
+        self.probes: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._stored_stats = stored_stats or {}
+        self._store = store
+
+    @property
+    def active(self) -> bool:
+        return self.ended_at is None
+
+    def clear(self) -> None:
+        self._store.reset(self.session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.probes:
+            return self._stored_stats
+        return {name: probe() for name, probe in self.probes.items()}
+
+
+class SqliteDebugStore:
+    """DebugStore i en lokal SQLite-fil (WAL), delad av alla workers på noden.
+
+    Ljudvägen skriver aldrig till databasen själv: poster läggs i en
+    `deque` och en bakgrundstråd per process skriver dem i en transaktion
+    var `flush_ms`. Läsningar går direkt mot databasen och kan alltså
+    ligga upp till en flush efter. Samma tak som i minnesvarianten gäller:
+    högst `max_items` poster per buffer, `max_sessions` sessioner och
+    `idle_ttl_s` för avslutade sessioner.
+    """
+
+    # `get()` och `tail()` frågar databasen och kan vänta på skrivtråden:
+    # debug-routerna kör dem i en worker-tråd (varje tråd har egen läsanslutning)
+    reads_block = True
+
+    def __init__(self, path: str, max_sessions: int = 1000, idle_ttl_s: float = 3600.0,
+                 max_items: int = 500, flush_ms: int = 100):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self.max_items = max_items
+        self.flush_s = max(1, flush_ms) / 1000
+        self._ops: deque = deque()
+        # Sessioner som körs i den här processen
+        self._local: Dict[str, SqliteSessionBuffers] = {}
+        self._local_reader = threading.local()
+        self._writer: Optional[threading.Thread] = None
+        # Eventloopen som sessionerna (och deras probes) lever i
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+
+    # --- samma API som DebugStore ------------------------------------------
+
+    def get(self, session_id: str) -> Optional[SqliteSessionBuffers]:
+        buf = self._local.get(session_id)
+        if buf is not None:
+            return buf
+        row = self._reader().execute(
+            "SELECT started_at, ended_at, stats FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        stats = json.loads(row[2]) if row[2] else {}
+        return SqliteSessionBuffers(self, session_id, row[0], row[1], stats)
+
+    def get_or_create(self, session_id: str) -> SqliteSessionBuffers:
+        buf = self._local.get(session_id)
+        if buf is None:
+            buf = self._add(session_id)
+        return buf
+
+    def new_session(self) -> str:
+        sid = str(uuid.uuid4())
+        self._add(sid)
+        return sid
+
+    def close_session(self, session_id: str) -> None:
+        buf = self._local.pop(session_id, None)
+        if buf is None:
+            return
+        buf.ended_at = time.time()
+        self._ops.append((_CLOSE, session_id, buf.ended_at, self._snapshot(buf)))
+
+    def list_sessions(self) -> List[str]:
+        rows = self._reader().execute("SELECT session_id FROM sessions ORDER BY touched").fetchall()
+        return [r[0] for r in rows]
+
+    def reset(self, session_id: str | None = None) -> None:
+        # Går via skrivkön så att den hamnar efter redan köade poster
+        if session_id:
+            self._ops.append((_RESET, session_id))
+        else:
+            self._ops.append((_RESET_ALL, None))
+        self._ensure_writer()
+
+    def close(self) -> None:
+        """Skriv ut det som ligger i kön och stoppa skrivtråden."""
+        if self._writer is not None:
+            self._stop.set()
+            self._writer.join(timeout=5.0)
+            self._writer = None
+            self._stop.clear()
+
+    # ------------------------------------------------------------------
+
+    def _add(self, session_id: str) -> SqliteSessionBuffers:
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        self._ensure_writer()
+        now = time.time()
+        buf = SqliteSessionBuffers(self, session_id, now)
+        self._local[session_id] = buf
+        self._ops.append((_NEW, session_id, now))
+        return buf
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local_reader, "conn", None)
+        if conn is None:
+            conn = self._local_reader.conn = _connect(self.path)
+        return conn
+
+    def _ensure_writer(self) -> None:
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._start_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name="debug-store-writer", daemon=True)
+                self._writer.start()
+
+    @staticmethod
+    def _snapshot(buf: SqliteSessionBuffers) -> Optional[str]:
+        try:
+            return json.dumps(buf.stats(), default=str)
+        except Exception:
+            return None
+
+    def _write_loop(self) -> None:
+        conn = _connect(self.path)
+        next_stats = next_sweep = 0.0
+        since_trim: Dict[tuple, int] = {}
+        while True:
+            stopping = self._stop.wait(self.flush_s)
+            now = time.time()
+            try:
+                self._flush(conn, now, since_trim)
+                if now >= next_stats:
+                    next_stats = now + 1.0
+                    self._request_stats()
+                if now >= next_sweep:
+                    next_sweep = now + min(60.0, self.idle_ttl_s / 4)
+                    self._sweep(conn, now)
+            except sqlite3.Error as e:
+                log.warning("DebugStore (sqlite): skrivning misslyckades: %s", e)
+            if stopping:
+                break
+        conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, now: float, since_trim: Dict[tuple, int]) -> None:
+        ops = self._ops
+        if not ops:
+            return
+        items: List[tuple] = []
+        touched = set()
+        conn.execute("BEGIN")
+        try:
+            while True:
+                try:
+                    op = ops.popleft()
+                except IndexError:
+                    break
+                kind = op[0]
+                if kind == _ITEM:
+                    items.append(op[1:])
+                    touched.add(op[1])
+                    key = (op[1], op[2])
+                    since_trim[key] = since_trim.get(key, 0) + 1
+                    continue
+                # Övriga operationer måste komma i ordning efter posterna före dem
+                if items:
+                    conn.executemany("INSERT INTO items (session_id, kind, value) VALUES (?, ?, ?)", items)
+                    items = []
+                if kind == _NEW:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO sessions (session_id, started_at, touched) VALUES (?, ?, ?)",
+                        (op[1], op[2], op[2]),
+                    )
+                elif kind == _CLOSE:
+                    conn.execute(
+                        "UPDATE sessions SET ended_at = ?, touched = ?, stats = COALESCE(?, stats) WHERE session_id = ?",
+                        (op[2], op[2], op[3], op[1]),
+                    )
+                elif kind == _STATS:
+                    conn.executemany(
+                        "UPDATE sessions SET stats = ? WHERE session_id = ?",
+                        [(json.dumps(stats, default=str), sid) for sid, stats in op[2]],
+                    )
+                elif kind == _RESET:
+                    conn.execute("DELETE FROM items WHERE session_id = ?", (op[1],))
+                elif kind == _RESET_ALL:
+                    # Pågående sessioner (i alla workers) finns kvar, med tomma buffrar
+                    conn.execute("DELETE FROM items")
+                    conn.execute("DELETE FROM sessions WHERE ended_at IS NOT NULL")
+            if items:
+                conn.executemany("INSERT INTO items (session_id, kind, value) VALUES (?, ?, ?)", items)
+            if touched:
+                conn.executemany("UPDATE sessions SET touched = ? WHERE session_id = ?", [(now, s) for s in touched])
+            # Håll varje buffer runt max_items utan att trimma vid varje post
+            limit = max(1, self.max_items // 4)
+            for key, n in list(since_trim.items()):
+                if n < limit:
+                    continue
+                del since_trim[key]
+                conn.execute(
+                    "DELETE FROM items WHERE session_id = ? AND kind = ? AND id <= ("
+                    "SELECT id FROM items WHERE session_id = ? AND kind = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (key[0], key[1], key[0], key[1], self.max_items),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _request_stats(self) -> None:
+        # Probes läser köer och state som eventloopen äger: de körs där, och
+        # bara färdiga dictar kommer tillbaka hit via skrivkön
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._collect_stats)
+        except RuntimeError:
+            pass  # loopen stängdes precis
+
+    def _collect_stats(self) -> None:
+        rows = []
+        for sid, buf in self._local.items():
+            if buf.probes:
+                try:
+                    rows.append((sid, buf.stats()))
+                except Exception:
+                    pass
+        if rows:
+            self._ops.append((_STATS, None, rows))
+
+    def _sweep(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                "DELETE FROM sessions WHERE ended_at IS NOT NULL AND ended_at < ?", (now - self.idle_ttl_s,)
+            )
+            # Avslutade sessioner först, i LRU-ordning, sedan pågående
+            conn.execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                "SELECT session_id FROM sessions ORDER BY ended_at IS NULL, touched "
+                "LIMIT max(0, (SELECT count(*) FROM sessions) - ?))",
+                (self.max_sessions,),
+            )
+            conn.execute("DELETE FROM items WHERE session_id NOT IN (SELECT session_id FROM sessions)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
@@ -0,0 +1,76 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request
+
+from ..batch import UploadTooLarge, jobs
+from ..config import settings
+from ..stt.receive_audio_from_frontend import AudioFormat, parse_audio_format
+
+router = APIRouter()
+
+WAV_TYPES = ("audio/wav", "audio/x-wav", "audio/wave", "audio/vnd.wave")
+
+
+@router.post("/batch/jobs", status_code=202)
+async def create_job(request: Request):
+    """Ladda upp en fil som rå request-body.
+
+    WAV (16-bitars PCM) känns igen på Content-Type eller RIFF-huvudet. Rå PCM
+    beskrivs med samma query-parametrar som /ws/transcribe (encoding,
+    sample_rate_hz, channels). Svaret innehåller `job_id` för polling.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    raw_format = None
+    if content_type not in WAV_TYPES:
+        try:
+            raw_format = parse_audio_format(
+                request.query_params, AudioFormat("pcm16", settings.audio_in_sample_rate_hz, 1)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if not jobs.can_accept():
+        raise HTTPException(status_code=503, detail="för många pågående batchjobb")
+    try:
+        job = await jobs.receive(request.stream(), settings.batch_max_upload_bytes)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="filen är för stor")
+    if job.upload_bytes == 0:
+        jobs.delete(job.id)
+        raise HTTPException(status_code=400, detail="tom uppladdning")
+    if raw_format is not None and "encoding" not in request.query_params:
+        if await asyncio.to_thread(_is_riff, job.src_path):
+            raw_format = None
+    jobs.start(job, raw_format)
+    return job.snapshot()
+
+
+def _is_riff(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(4) == b"RIFF"
+
+
+@router.get("/batch/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="okänt jobb")
+    return job.snapshot()
+
+
+@router.get("/batch/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="okänt jobb")
+    if not job.finished:
+        raise HTTPException(status_code=409, detail=f"jobbet är inte klart ({job.status})")
+    if job.status == "failed":
+        raise HTTPException(status_code=422, detail=job.error or "jobbet misslyckades")
+    return job.result()
+
+
+@router.delete("/batch/jobs/{job_id}")
+async def delete_job(job_id: str):
+    if not jobs.delete(job_id):
+        raise HTTPException(status_code=404, detail="okänt jobb")
+    return {"ok": True, "job_id": job_id}
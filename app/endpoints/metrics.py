@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from ..admission import admission
+from ..metrics import is_enabled, registry
+from ..realtime_pool import pool
+from ..stt.commit_scheduler import scheduler as commit_scheduler
+from ..stt.session import registry as sessions
+from ..transcript_cache import transcript_cache
+
+router = APIRouter()
+
+# Räknare som redan förs i poolen/schemaläggaren läses av vid scrape
+registry.counter("stt_pool_hits_total", "Sessioner som fick en förvärmd Realtime-anslutning", fn=lambda: pool.stats.hits)
+registry.counter("stt_pool_misses_total", "Sessioner som fick ansluta själva", fn=lambda: pool.stats.misses)
+registry.gauge("stt_pool_idle", "Förvärmda anslutningar i poolen", fn=lambda: pool.snapshot()["idle"])
+registry.gauge("stt_detached_sessions", "Sessioner som väntar på att frontend återansluter", fn=lambda: sessions.snapshot()["detached"])
+registry.gauge("stt_subscribers", "Läsande prenumeranter på pågående sessioner", fn=lambda: sessions.snapshot()["subscribers"])
+registry.gauge("stt_admission_waiting", "Nya sessioner som väntar på en plats", fn=lambda: admission.snapshot()["waiting"])
+registry.counter("stt_admission_queued_total", "Nya sessioner som fick vänta på en plats", fn=lambda: admission.stats.queued)
+registry.counter("stt_transcript_cache_hits_total", "Items vars transkript kom ur cachen", fn=lambda: transcript_cache.stats.hits)
+registry.counter("stt_transcript_cache_misses_total", "Cachebara items som fick vänta på upstream", fn=lambda: transcript_cache.stats.misses)
+registry.gauge("stt_transcript_cache_hit_ratio", "Andel träffar av cachebara items", fn=lambda: transcript_cache.stats.hit_ratio)
+registry.counter(
+    "stt_transcript_cache_latency_saved_seconds_total",
+    "Tid till final som träffarna sparat (tills upstreams transkript för samma item kom)",
+    fn=lambda: transcript_cache.stats.saved_s_total,
+)
+registry.gauge("stt_commit_scheduler_armed", "Sessioner som väntar på commit", fn=lambda: commit_scheduler.snapshot()["armed"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    if not is_enabled():
+        raise HTTPException(status_code=404, detail="metrics disabled")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
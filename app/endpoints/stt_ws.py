@@ -1,187 +1,198 @@
 import asyncio
 import logging
 import os
+import secrets
 import time
+from typing import Optional
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from starlette.websockets import WebSocketState
 
+from .. import metrics
+from ..admission import AdmissionRejected, Ticket, admission
 from ..config import settings
 from ..debug_store import store
-from ..realtime_client import OpenAIRealtimeClient
+from ..realtime_pool import pool
+from ..recording import recorder
+from ..tracing import tracer
+from ..stt.broadcast import Subscriber, run_subscriber_sender
+from ..stt.receive_audio_from_frontend import AudioFormat, parse_audio_format
+from ..stt.send_text_to_frontend import BINARY_PROTOCOL_VERSION
+from ..stt.session import TranscribeSession, registry
 
 log = logging.getLogger("stt")
 
 router = APIRouter()
 
+DEFAULT_AUDIO_IN = AudioFormat("pcm16", settings.audio_in_sample_rate_hz, 1)
+
+# Stängningskoder som betyder att klienten är klar: 1000 = normal, 1001 = fliken stängdes
+CLIENT_CLOSE_CODES = (1000, 1001)
+
+
+def protocol_info(mode: str) -> dict:
+    """Protokollet, som det redovisas i `ready`.
+
+    Komprimering (permessage-deflate) förhandlas av uvicorn i handskakningen
+    och syns inte för appen; klienten ser den i sitt eget handskakningssvar
+    (Sec-WebSocket-Extensions).
+    """
+    info = {"mode": mode}
+    if mode == "binary":
+        info["version"] = BINARY_PROTOCOL_VERSION
+    return info
+
+
 @router.websocket("/ws/transcribe")
 async def ws_transcribe(ws: WebSocket):
     await ws.accept()
-    
-    # A är default: JSON, B som fallback: ren text
+
+    # Återanslutning: ?resume=<session_id>&resume_token=<t>&last_seq=<n> tar
+    # över en session som tappat sin frontend, med samma upstream-anslutning
+    # och transkript. Token kommer i `session.started`
+    resume_id = ws.query_params.get("resume")
+    session = registry.get(resume_id) if resume_id else None
+    if session is not None and session.can_resume(ws.query_params.get("resume_token") or ""):
+        try:
+            last_seq = int(ws.query_params.get("last_seq") or 0)
+        except ValueError:
+            last_seq = 0
+        metrics.RESUMES.inc()
+        if session.send_json:
+            await ws.send_json({
+                "type": "ready",
+                "audio_in": session.audio_in.as_dict(),
+                "audio_out": {"mimetype": "audio/mpeg"},
+                "protocol": protocol_info(session.mode),
+            })
+        gen = await session.attach(ws, last_seq)
+        await receive_loop(ws, session, gen)
+        return
+    metrics.SESSIONS.inc()
+
+    # A är default: JSON, B: binära ramar (bara tillagd text), C som fallback: ren text
     mode = (ws.query_params.get("mode") or os.getenv("WS_DEFAULT_MODE", "json")).lower()
-    send_json = (mode == "json")
+    send_json = mode in ("json", "binary")   # kontrollmeddelanden går som JSON i båda
     
+    # Klienten väljer sitt ljudformat vid connect; servern konverterar till upstream-formatet
+    try:
+        audio_in = parse_audio_format(ws.query_params, DEFAULT_AUDIO_IN)
+    except ValueError as e:
+        metrics.ERRORS.labels("invalid_audio_format").inc()
+        if send_json:
+            await ws.send_json({"type": "error", "reason": "invalid_audio_format", "detail": str(e)})
+        await ws.close(code=1003)
+        return
+
+    # Antagning: en plats (eventuellt efter en kort väntan) eller ett avslag,
+    # innan något annat skapas för sessionen
+    client = ws.client.host if ws.client else "unknown"
+
+    async def on_queued(position: int) -> None:
+        if send_json:
+            await ws.send_json({"type": "info", "msg": "queued", "position": position})
+
+    try:
+        ticket = await admission.acquire(client, on_queued)
+    except AdmissionRejected as e:
+        metrics.ERRORS.labels(e.reason).inc()
+        try:
+            if send_json:
+                await ws.send_json({
+                    "type": "error",
+                    "reason": e.reason,
+                    "detail": e.detail,
+                    "retry_after_ms": int(e.retry_after_s * 1000),
+                })
+            await ws.close(code=1013, reason=e.reason)  # 1013 = Try Again Later
+        except Exception:
+            pass  # klienten gav upp medan den väntade
+        return
+
+    try:
+        session = await open_session(ws, mode, send_json, audio_in, resume_id, ticket)
+    except BaseException:
+        ticket.release()
+        raise
+    if session is None:
+        ticket.release()
+        return
+    gen = await session.attach(ws)
+    await receive_loop(ws, session, gen)
+
+
+async def open_session(
+    ws: WebSocket, mode: str, send_json: bool, audio_in: AudioFormat, resume_id: Optional[str], ticket: Ticket
+) -> Optional[TranscribeSession]:
+    """Skicka `ready`, hämta en Realtime-klient och skapa sessionen (None om upstream inte gick att nå)."""
     session_id = store.new_session()
-    
+    resume_token = secrets.token_urlsafe(24) if settings.session_resume_grace_s > 0 else None
+
     # Skicka "ready" meddelande för kompatibilitet med frontend
     if send_json:
         await ws.send_json({
             "type": "ready",
-            "audio_in": {"encoding": "pcm16", "sample_rate_hz": 16000, "channels": 1},
+            "audio_in": audio_in.as_dict(),
             "audio_out": {"mimetype": "audio/mpeg"},
+            "protocol": protocol_info(mode),
         })
-        await ws.send_json({"type": "session.started", "session_id": session_id})
-
-    # Setup klient mot OpenAI/Azure Realtime
-    rt = OpenAIRealtimeClient(
-        url=settings.realtime_url,
-        api_key=settings.openai_api_key,
-        transcribe_model=settings.transcribe_model,
-        language=settings.input_language,
-        add_beta_header=settings.add_beta_header,
-    )
-    
+        if resume_id:
+            await ws.send_json({"type": "info", "msg": "resume_unavailable"})
+        started = {"type": "session.started", "session_id": session_id}
+        if resume_token is not None:
+            started["resume_token"] = resume_token
+        await ws.send_json(started)
+
+    # Hämta klient mot OpenAI/Azure Realtime (förvärmd ur poolen om möjligt)
+    t_connect = time.perf_counter()
     try:
-        await rt.connect()
+        rt = await pool.acquire()
     except Exception as e:
+        metrics.ERRORS.labels("realtime_connect_failed").inc()
         if send_json and ws.client_state == WebSocketState.CONNECTED:
             await ws.send_json({"type": "error", "reason": "realtime_connect_failed", "detail": str(e)})
-        return
+        store.close_session(session_id)
+        return None
     else:
+        metrics.UPSTREAM_CONNECT.observe(time.perf_counter() - t_connect)
+        rt.connection_source = pool.acquire  # återanslutning tar en varm anslutning om det finns
         if send_json and ws.client_state == WebSocketState.CONNECTED:
             await ws.send_json({"type": "info", "msg": "realtime_connected"})
 
-    buffers = store.get_or_create(session_id)
-
-    # Hålla senaste text för enkel diff
-    last_text = ""
-    
-    # Flagga för att veta om vi har skickat ljud
-    has_audio = False
-    last_audio_time = 0  # Timestamp för senaste ljud
-
-    # Task: läs events från Realtime och skicka deltas till frontend
-    async def on_rt_event(evt: dict):
-        nonlocal last_text
-        t = evt.get("type")
-
-        # (A) logga alltid eventtyp för felsökning (/debug/rt-events om ni har det)
-        try:
-            buffers.rt_events.append(str(t))
-        except Exception:
-            pass
-
-        # (B) bubbla upp error/info till klienten (syns i browser-konsol)
-        if t == "error":
-            detail = evt.get("error", evt)
-            if send_json and ws.client_state == WebSocketState.CONNECTED:
-                await ws.send_json({"type": "error", "reason": "realtime_error", "detail": detail})
-            return
-        if t == "session.updated":
-            if send_json and ws.client_state == WebSocketState.CONNECTED:
-                await ws.send_json({"type": "info", "msg": "realtime_connected_and_configured"})
-            return
-
-        # (C) försök extrahera transcript från flera varianter
-        transcript = None
-
-        # 1) Klassisk Realtime-transkript (som repo 2 använder) - whisper-1 + server VAD
-        if t == "conversation.item.input_audio_transcription.completed":
-            transcript = (
-                evt.get("transcript")
-                or evt.get("item", {}).get("content", [{}])[0].get("transcript")
-            )
-
-        # 2) Alternativ nomenklatur: response.audio_transcript.delta/completed
-        if not transcript and t in ("response.audio_transcript.delta", "response.audio_transcript.completed"):
-            transcript = evt.get("transcript") or evt.get("text") or evt.get("delta")
-
-        # 3) Sista fallback: response.output_text.delta (text-delning)
-        if not transcript and t == "response.output_text.delta":
-            delta_txt = evt.get("delta")
-            if isinstance(delta_txt, str):
-                transcript = (last_text or "") + delta_txt
-
-        if not isinstance(transcript, str) or not transcript:
-            return
-
-        # (D) beräkna delta och skicka till frontend
-        delta = transcript[len(last_text):] if transcript.startswith(last_text) else transcript
-
-        if delta and ws.client_state == WebSocketState.CONNECTED:
-            buffers.openai_text.append(transcript)
-            
-            # Bestäm om detta är final eller partial transcript
-            is_final = t in (
-                "conversation.item.input_audio_transcription.completed",
-                "response.audio_transcript.completed",
-            )
-            
-            if send_json:
-                await ws.send_json({
-                    "type": "stt.final" if is_final else "stt.partial",
-                    "text": transcript
-                })
-            else:
-                await ws.send_text(delta)  # fallback: ren text
-            buffers.frontend_text.append(delta)
-            last_text = transcript
+    recording = recorder.start_session(session_id, {"mode": mode, "audio_in": audio_in.as_dict()})
+    trace = tracer.start_session(session_id, force=ws.query_params.get("trace") == "1")
+    session = TranscribeSession(
+        session_id, mode, audio_in, rt, store.get_or_create(session_id), recording, ticket, trace, resume_token
+    )
+    registry.add(session)
+    return session
 
-    rt_recv_task = asyncio.create_task(rt.recv_loop(on_rt_event))
 
-    # Periodisk commit för att få löpande partials
-    async def commit_loop():
-        try:
-            while True:
-                await asyncio.sleep(max(0.001, settings.commit_interval_ms / 1000))
-                # Bara committa om vi har skickat ljud
-                if has_audio:
-                    # Kontrollera om det har gått för lång tid sedan senaste ljudet
-                    import time
-                    if time.time() - last_audio_time > 2.0:  # 2 sekunder timeout
-                        has_audio = False
-                        log.debug("Timeout - återställer has_audio flaggan")
-                        continue
-                    
-                    try:
-                        await rt.commit()
-                    except Exception as e:
-                        # Hantera "buffer too small" fel mer elegant
-                        if "buffer too small" in str(e) or "input_audio_buffer_commit_empty" in str(e):
-                            log.debug("Buffer för liten, väntar på mer ljud: %s", e)
-                            # Om buffern är helt tom, återställ has_audio flaggan
-                            if "0.00ms of audio" in str(e):
-                                has_audio = False
-                            continue  # Fortsätt loopen istället för att bryta
-                        else:
-                            log.warning("Commit fel: %s", e)
-                            break
-        except asyncio.CancelledError:
-            pass
-
-    commit_task = asyncio.create_task(commit_loop())
+async def receive_loop(ws: WebSocket, session: TranscribeSession, gen: int) -> None:
+    """Läs ljud/ping från frontend tills anslutningen tar slut.
 
+    Stänger klienten (1000, eller 1001 när fliken stängs) avslutas sessionen
+    direkt; annars kopplas frontend bara bort och sessionen väntar på en
+    återanslutning (om `session_resume_grace_s` > 0).
+    """
+    session_id = session.session_id
+    ended_by_client = False
     try:
         while ws.client_state == WebSocketState.CONNECTED:
             try:
                 msg = await ws.receive()
 
+                if msg.get("type") == "websocket.disconnect":
+                    log.info("WebSocket stängd: %s", session_id)
+                    ended_by_client = msg.get("code", 1000) in CLIENT_CLOSE_CODES
+                    break
                 if "bytes" in msg and msg["bytes"] is not None:
-                    chunk = msg["bytes"]
-                    buffers.frontend_chunks.append(len(chunk))
-                    try:
-                        await rt.send_audio_chunk(chunk)
-                        buffers.openai_chunks.append(len(chunk))
-                        has_audio = True  # Markera att vi har skickat ljud
-                        import time
-                        last_audio_time = time.time()  # Uppdatera timestamp
-                    except Exception as e:
-                        log.error("Fel när chunk skickades till Realtime: %s", e)
+                    if not await session.feed(msg["bytes"]):
                         break
                 elif "text" in msg and msg["text"] is not None:
                     # Tillåt ping/ctrl meddelanden som sträng
                     if msg["text"] == "ping":
-                        await ws.send_text("pong")
+                        await session.to_frontend("pong")
                     else:
                         # ignoreras
                         pass
@@ -189,8 +200,9 @@ async def ws_transcribe(ws: WebSocket):
                     # okänt format
                     pass
 
-            except WebSocketDisconnect:
+            except WebSocketDisconnect as e:
                 log.info("WebSocket stängd: %s", session_id)
+                ended_by_client = e.code in CLIENT_CLOSE_CODES
                 break
             except RuntimeError as e:
                 log.info("WS disconnect during receive(): %s", e)
@@ -199,16 +211,10 @@ async def ws_transcribe(ws: WebSocket):
                 log.error("WebSocket fel: %s", e)
                 break
     finally:
-        commit_task.cancel()
-        rt_recv_task.cancel()
-        try:
-            await rt.close()
-        except Exception:
-            pass
-        try:
-            await asyncio.gather(commit_task, rt_recv_task, return_exceptions=True)
-        except Exception:
-            pass
+        if ended_by_client or settings.session_resume_grace_s <= 0:
+            await session.close()
+        else:
+            session.detach(gen)
         # Stäng WebSocket bara om den inte redan är stängd
         if ws.client_state != WebSocketState.DISCONNECTED:
             try:
@@ -217,6 +223,53 @@ async def ws_transcribe(ws: WebSocket):
                 pass
 
 
+@router.websocket("/ws/subscribe")
+async def ws_subscribe(ws: WebSocket):
+    """Läs med i en pågående session: `?session_id=<id>` från `session.started`.
+
+    Först kommer `subscribed` med det som redan transkriberats, sedan
+    `stt.partial`/`stt.final` (hela texten för itemet) och till sist
+    `session.ended`. Allt från klienten utom "ping" ignoreras.
+    """
+    await ws.accept()
+    session = registry.get(ws.query_params.get("session_id") or "")
+    if session is None:
+        await ws.send_json({"type": "error", "reason": "unknown_session"})
+        await ws.close(code=1008)
+        return
+    sub = session.subscribe()
+    if sub is None:
+        metrics.ERRORS.labels("too_many_subscribers").inc()
+        await ws.send_json({"type": "error", "reason": "too_many_subscribers"})
+        await ws.close(code=1013)
+        return
+
+    sender = asyncio.create_task(run_subscriber_sender(ws, sub))
+    receiver = asyncio.create_task(_read_until_disconnect(ws, sub))
+    try:
+        await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        session.subscribers.remove(sub)
+        for t in (sender, receiver):
+            t.cancel()
+        await asyncio.gather(sender, receiver, return_exceptions=True)
+        if ws.client_state != WebSocketState.DISCONNECTED:
+            try:
+                # Sessionen slut (1000) eller läsaren hängde inte med (1013)
+                await ws.close(code=1013 if sub.overflowed else 1000)
+            except Exception:
+                pass
+
+
+async def _read_until_disconnect(ws: WebSocket, sub: Subscriber) -> None:
+    while True:
+        msg = await ws.receive()
+        if msg.get("type") == "websocket.disconnect":
+            return
+        if msg.get("text") == "ping" and not sub.queue.closed:
+            sub.queue.put_nowait("pong", force=True)
+
+
 # Alias route för /ws som använder samma logik som /ws/transcribe
 @router.websocket("/ws")
 async def ws_alias(ws: WebSocket):
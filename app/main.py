@@ -6,6 +6,7 @@ import logging
 import os
 import re
 import time
+from contextlib import asynccontextmanager
 from typing import Optional
 
 from fastapi import FastAPI, Query
@@ -14,12 +15,39 @@ from pydantic import BaseModel
 
 from .config import settings
 from .debug_store import store
+from .batch import jobs as batch_jobs
+from .endpoints import batch as batch_endpoint
+from .endpoints import metrics as metrics_endpoint
 from .endpoints import stt_ws
+from .admission import admission
+from .realtime_pool import pool
+from .recording import recorder
+from .tracing import tracer
+from .transcript_cache import transcript_cache
+from .stt.commit_scheduler import scheduler as commit_scheduler
+from .stt.session import registry as sessions
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("stt")
 
-app = FastAPI(title="stefan-api-test-7 – STT-backend (FastAPI + Realtime)")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await pool.start()
+    try:
+        yield
+    finally:
+        await sessions.close_all()
+        await batch_jobs.stop()
+        await pool.stop()
+        await commit_scheduler.stop()
+        store.close()
+        recorder.stop()
+        tracer.stop()
+        transcript_cache.stop()
+
+
+app = FastAPI(title="stefan-api-test-7 – STT-backend (FastAPI + Realtime)", lifespan=lifespan)
 
 
 # ----------------------- CORS -----------------------
@@ -44,6 +72,8 @@ app.add_middleware(
 
 # Inkludera WebSocket router
 app.include_router(stt_ws.router, tags=["stt"])
+app.include_router(metrics_endpoint.router, tags=["metrics"])
+app.include_router(batch_endpoint.router, tags=["batch"])
 
 
 # --------------------- Models -----------------------
@@ -59,7 +89,21 @@ class DebugListOut(BaseModel):
     session_id: str
     data: list
 
+class DebugStatsOut(BaseModel):
+    session_id: str
+    stats: dict
+
 # --------------------- Endpoints --------------------
+async def _debug_read(fn, *args):
+    """Läs ur debuglagret; mot SQLite i en tråd så att sessionerna inte väntar."""
+    if store.reads_block:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+def _tail(session_id: str, kind: str, limit: int) -> list:
+    buf = store.get(session_id)
+    return getattr(buf, kind).tail(limit) if buf else []
+
 @app.get("/healthz")
 async def healthz():
     return {"ok": True, "ts": time.time()}
@@ -77,34 +121,59 @@ async def get_config():
 
 @app.get("/debug/frontend-chunks", response_model=DebugListOut)
 async def debug_frontend_chunks(session_id: str = Query(...), limit: int = Query(200, ge=1, le=1000)):
-    buf = store.get_or_create(session_id)
-    data = list(buf.frontend_chunks)[-limit:]
+    data = await _debug_read(_tail, session_id, "frontend_chunks", limit)
     return DebugListOut(session_id=session_id, data=data)
 
 @app.get("/debug/openai-chunks", response_model=DebugListOut)
 async def debug_openai_chunks(session_id: str = Query(...), limit: int = Query(200, ge=1, le=1000)):
-    buf = store.get_or_create(session_id)
-    data = list(buf.openai_chunks)[-limit:]
+    data = await _debug_read(_tail, session_id, "openai_chunks", limit)
     return DebugListOut(session_id=session_id, data=data)
 
 @app.get("/debug/openai-text", response_model=DebugListOut)
 async def debug_openai_text(session_id: str = Query(...), limit: int = Query(200, ge=1, le=2000)):
-    buf = store.get_or_create(session_id)
-    data = list(buf.openai_text)[-limit:]
+    data = await _debug_read(_tail, session_id, "openai_text", limit)
     return DebugListOut(session_id=session_id, data=data)
 
 @app.get("/debug/frontend-text", response_model=DebugListOut)
 async def debug_frontend_text(session_id: str = Query(...), limit: int = Query(200, ge=1, le=2000)):
-    buf = store.get_or_create(session_id)
-    data = list(buf.frontend_text)[-limit:]
+    data = await _debug_read(_tail, session_id, "frontend_text", limit)
     return DebugListOut(session_id=session_id, data=data)
 
 @app.get("/debug/rt-events", response_model=DebugListOut)
 async def debug_rt_events(session_id: str = Query(...), limit: int = Query(200, ge=1, le=2000)):
-    buf = store.get_or_create(session_id)
-    data = list(buf.rt_events)[-limit:]
+    data = await _debug_read(_tail, session_id, "rt_events", limit)
     return DebugListOut(session_id=session_id, data=data)
 
+@app.get("/debug/session-stats", response_model=DebugStatsOut)
+async def debug_session_stats(session_id: str = Query(...)):
+    buf = await _debug_read(store.get, session_id)
+    # Probes för sessioner i den här processen körs i eventloopen
+    return DebugStatsOut(session_id=session_id, stats=buf.stats() if buf else {})
+
+@app.get("/debug/pool")
+async def debug_pool():
+    return pool.snapshot()
+
+@app.get("/debug/admission")
+async def debug_admission():
+    return admission.snapshot()
+
+@app.get("/debug/tracing")
+async def debug_tracing():
+    return tracer.snapshot()
+
+@app.get("/debug/transcript-cache")
+async def debug_transcript_cache():
+    return transcript_cache.snapshot()
+
+@app.get("/debug/recording")
+async def debug_recording():
+    return recorder.snapshot()
+
+@app.get("/debug/commits")
+async def debug_commits():
+    return commit_scheduler.snapshot()
+
 @app.post("/debug/reset")
 async def debug_reset(session_id: str | None = Query(None)):
     store.reset(session_id)
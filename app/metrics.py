@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .config import settings
+
+
+class _State:
+    enabled: bool = settings.metrics_enabled
+
+
+def set_enabled(enabled: bool) -> None:
+    _State.enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _State.enabled
+
+
+def _fmt(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _labelstr(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...] | str, _Metric] = {}
+
+    def labels(self, *values: str) -> "_Metric":
+        # En etikett: nyckeln är strängen själv, så uppslaget allokerar inget
+        key = values[0] if len(values) == 1 else values
+        child = self._children.get(key)
+        if child is None:
+            child = self._new_child()
+            self._children[key] = child
+        return child
+
+    def _new_child(self) -> "_Metric":
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.labelnames:
+            for key, child in list(self._children.items()):
+                values = (key,) if isinstance(key, str) else key
+                lines.extend(child._samples_with(self.name, self.labelnames, values))
+        else:
+            lines.extend(self._samples_with(self.name, (), ()))
+        return lines
+
+    def _samples_with(self, name: str, names: Sequence[str], values: Sequence[str]) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable[[], float]] = None) -> None:
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+        self._fn = fn  # läses vid scrape, för räknare som redan finns någon annanstans
+
+    def inc(self, amount: float = 1) -> None:
+        if _State.enabled:
+            self.value += amount
+
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.help)
+
+    def _samples_with(self, name, names, values):
+        v = self._fn() if self._fn is not None else self.value
+        yield f"{name}{_labelstr(names, values)} {_fmt(v)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable[[], float]] = None) -> None:
+        super().__init__(name, help, labelnames)
+        self.value = 0.0
+        self._fn = fn  # läses vid scrape i stället för värdet
+
+    def inc(self, amount: float = 1) -> None:
+        if _State.enabled:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        if _State.enabled:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        if _State.enabled:
+            self.value = value
+
+    def _new_child(self) -> "Gauge":
+        return Gauge(self.name, self.help)
+
+    def _samples_with(self, name, names, values):
+        v = self._fn() if self._fn is not None else self.value
+        yield f"{name}{_labelstr(names, values)} {_fmt(v)}"
+
+
+class Histogram(_Metric):
+    """Histogram med fasta hinkar. `observe()` gör en bisect och två additioner."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)  # sista = +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        if _State.enabled:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.sum += value
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.help, self.bounds)
+
+    def _samples_with(self, name, names, values):
+        acc = 0
+        for bound, n in zip(self.bounds + (math.inf,), self.counts):
+            acc += n
+            le = 'le="' + _fmt(bound) + '"'
+            yield f"{name}_bucket{_labelstr(names, values, le)} {acc}"
+        yield f"{name}_sum{_labelstr(names, values)} {_fmt(self.sum)}"
+        yield f"{name}_count{_labelstr(names, values)} {acc}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable[[], float]] = None) -> Counter:
+        return self.register(Counter(name, help, labelnames, fn))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()) -> Histogram:
+        return self.register(Histogram(name, help, buckets, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+CONNECT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+ACTIVE_SESSIONS = registry.gauge("stt_active_sessions", "Pågående /ws/transcribe-sessioner")
+SESSIONS = registry.counter("stt_sessions_total", "Accepterade /ws/transcribe-sessioner")
+RESUMES = registry.counter("stt_session_resumes_total", "Återanslutningar till en pågående session")
+FRONTEND_BYTES_IN = registry.counter("stt_frontend_bytes_in_total", "Ljudbyte mottagna från frontend")
+UPSTREAM_BYTES_OUT = registry.counter("stt_upstream_audio_bytes_out_total", "PCM16-byte skickade till Realtime")
+FRONTEND_MESSAGES_OUT = registry.counter("stt_frontend_messages_out_total", "Meddelanden skickade till frontend")
+UPSTREAM_CONNECT = registry.histogram(
+    "stt_upstream_connect_seconds", "Tid att få en ansluten Realtime-klient (pool eller ny)", CONNECT_BUCKETS
+)
+COMMITS = registry.counter("stt_commits_total", "input_audio_buffer.commit skickade upstream")
+FIRST_PARTIAL = registry.histogram(
+    "stt_time_to_first_partial_seconds", "Från första ljud i ett yttrande till första stt.partial", LATENCY_BUCKETS
+)
+FINAL = registry.histogram(
+    "stt_time_to_final_seconds", "Från första ljud i ett yttrande till stt.final", LATENCY_BUCKETS
+)
+UPSTREAM_EVENTS = registry.counter("stt_upstream_events_total", "Events från Realtime per typ", ("type",))
+# Typer som får en egen etikett; allt annat (nya eller trasiga typer) räknas som
+# "other", så att antalet serier inte kan växa med vad upstream skickar
+UPSTREAM_EVENT_TYPES = frozenset((
+    "session.created",
+    "session.updated",
+    "input_audio_buffer.committed",
+    "input_audio_buffer.cleared",
+    "input_audio_buffer.speech_started",
+    "input_audio_buffer.speech_stopped",
+    "conversation.item.created",
+    "conversation.item.input_audio_transcription.delta",
+    "conversation.item.input_audio_transcription.completed",
+    "conversation.item.input_audio_transcription.failed",
+    "response.audio_transcript.delta",
+    "response.audio_transcript.done",
+    "response.audio_transcript.completed",
+    "response.output_text.delta",
+    "response.output_text.done",
+    "rate_limits.updated",
+    "error",
+))
+UPSTREAM_RECONNECTS = registry.counter("stt_upstream_reconnects_total", "Tappade Realtime-anslutningar som återställts")
+UPSTREAM_RECOVERY = registry.histogram(
+    "stt_upstream_recovery_seconds", "Från tappad Realtime-anslutning till återansluten och ljudet skickat igen", CONNECT_BUCKETS
+)
+ERRORS = registry.counter("stt_errors_total", "Fel per orsak", ("reason",))
+
+
+def upstream_event_label(event_type: str) -> str:
+    return event_type if event_type in UPSTREAM_EVENT_TYPES else "other"
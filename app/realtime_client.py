@@ -1,23 +1,190 @@
 from __future__ import annotations
 
 import asyncio
-import base64
 import json
 import logging
-from typing import AsyncIterator, Awaitable, Callable, Optional
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
 
 import websockets
 
+from . import metrics
+from .realtime_codec import EventDispatcher, encode_append
+from .tracing import TRACK_UPSTREAM, SessionTrace, now_ns
+
 logger = logging.getLogger(__name__)
 
 JsonDict = dict[str, object]
 
+class UnackedAudio:
+    """Ljud som skickats upstream men vars transkript ännu inte kommit.
+
+    Allt räknas i byte-offsets i det skickade ljudet. Varje
+    `input_audio_buffer.committed` gör ljudet fram till en gräns till ett
+    item: en manuell commit ger sin egen offset, en server-VAD-commit
+    `audio_end_ms` från `speech_stopped` (räknat från `base`, där den
+    nuvarande anslutningen började). Ljudet släpps först när itemets
+    transkribering är klar (completed/failed) – allt tidigare dessutom klart.
+    Rymmer högst `max_bytes`; äldre ljud kastas och räknas i `truncated_bytes`.
+    `bytes_per_ms` (PCM16 mono i upstream-frekvensen) räknar om audio_end_ms.
+    """
+
+    def __init__(self, max_bytes: int, bytes_per_ms: int) -> None:
+        self.max_bytes = max_bytes
+        self.bytes_per_ms = bytes_per_ms
+        self._chunks: Deque[Tuple[int, bytes]] = deque()   # (offset, ljud)
+        self._bytes = 0
+        self.start = 0      # första byte som inte är klar
+        self.end = 0        # allt som skickats
+        self.base = 0       # offset där nuvarande upstream-anslutning började
+        self.commits: Deque[int] = deque()   # manuella commits som väntar på `committed`
+        self._vad_end: Optional[int] = None
+        # item_id -> slut-offset, i commit-ordning; `_done` = transkriptet har kommit
+        self.items: "OrderedDict[str, int]" = OrderedDict()
+        self._done: set = set()
+        self._starts: Dict[str, int] = {}   # item_id -> start-offset (föregående commits slut)
+        self._last_end = 0
+        self.truncated_bytes = 0
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._bytes
+
+    def append(self, chunk: bytes) -> None:
+        self._chunks.append((self.end, chunk))
+        self.end += len(chunk)
+        self._bytes += len(chunk)
+        while self._bytes > self.max_bytes and self._chunks:
+            offset, old = self._chunks.popleft()
+            self._bytes -= len(old)
+            self.truncated_bytes += len(old)
+            self.start = offset + len(old)
+
+    def note_commit(self) -> None:
+        self.commits.append(self.end)
+
+    def speech_stopped(self, audio_end_ms: Any) -> None:
+        if isinstance(audio_end_ms, (int, float)):
+            self._vad_end = min(self.end, self.base + int(audio_end_ms) * self.bytes_per_ms)
+
+    def committed(self, item_id: Any) -> None:
+        if self._vad_end is not None:
+            offset, self._vad_end = self._vad_end, None
+        elif self.commits:
+            offset = self.commits.popleft()
+        else:
+            return
+        start, self._last_end = self._last_end, max(self._last_end, offset)
+        if isinstance(item_id, str):
+            self.items[item_id] = offset
+            self._starts[item_id] = start
+
+    def commit_empty(self) -> None:
+        # Inget nytt item; ljudet (under minimigränsen) följer med nästa commit
+        if self.commits:
+            self.commits.popleft()
+
+    def item_done(self, item_id: Any) -> None:
+        if item_id not in self.items:
+            return
+        self._done.add(item_id)
+        while self.items:
+            first = next(iter(self.items))
+            if first not in self._done:
+                break
+            self._done.discard(first)
+            self._starts.pop(first, None)
+            self._ack(self.items.pop(first))
+
+    def item_audio(self, item_id: str) -> Optional[List[memoryview]]:
+        """Ljudet mellan föregående commit och itemets, eller None om det släppts/kastats."""
+        end = self.items.get(item_id)
+        start = self._starts.get(item_id)
+        if end is None or start is None or start < self.start:
+            return None
+        out = []
+        for offset, chunk in self._chunks:
+            if offset >= end:
+                break
+            if offset + len(chunk) <= start:
+                continue
+            out.append(memoryview(chunk)[max(0, start - offset): end - offset])
+        return out
+
+    def _ack(self, offset: int) -> None:
+        while self._chunks and offset > self.start:
+            first, chunk = self._chunks[0]
+            if first + len(chunk) <= offset:
+                self._chunks.popleft()
+                self._bytes -= len(chunk)
+                self.start = first + len(chunk)
+            else:
+                cut = offset - first
+                self._chunks[0] = (offset, chunk[cut:])
+                self._bytes -= cut
+                self.start = offset
+        self.start = max(self.start, offset)
+
+    def replay_plan(self):
+        """Ny anslutning: ljud och commits att skicka igen, i ordning (None = commit).
+
+        Items utan transkript commit:as om vid sina gränser, så att de
+        transkriberas på nytt; väntande manuella commits likaså.
+        """
+        bounds = sorted({o for o in self.items.values() if o > self.start} | {c for c in self.commits if c > self.start})
+        self.base = self.start
+        self._vad_end = None
+        self.items.clear()
+        self._done.clear()
+        self._starts.clear()
+        self._last_end = self.start
+        self.commits = deque(bounds)
+        pending = deque(bounds)
+        for offset, chunk in list(self._chunks):
+            yield chunk
+            end = offset + len(chunk)
+            while pending and pending[0] <= end:
+                pending.popleft()
+                yield None
+
+
+class RecoveryStats:
+    def __init__(self) -> None:
+        self.reconnects = 0
+        self.failures = 0
+        self.recovery_ms_total = 0.0
+        self.recovery_ms_max = 0.0
+        self.replayed_bytes = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "recovery_ms_total": round(self.recovery_ms_total, 1),
+            "recovery_ms_max": round(self.recovery_ms_max, 1),
+            "replayed_bytes": self.replayed_bytes,
+        }
+
+
 class OpenAIRealtimeClient:
     """Minimal WebSocket-klient mot OpenAI/Azure Realtime.
 
     Den här klienten skickar PCM16-ljud som base64 i events av typen
     `input_audio_buffer.append` och kan manuellt commit:a bufferten med
     `input_audio_buffer.commit` för att trigga transkribering.
+
+    Med `replay_max_bytes > 0` sparas ljud vars transkript inte kommit än.
+    Tappas anslutningen återansluter `recv_loop` (först direkt, sedan med
+    jittrad backoff), skickar det sparade ljudet och commits igen och
+    fortsätter. Under tiden läggs nytt ljud bara i bufferten. Först när
+    alla försök misslyckats får anroparen ett fel från `send_audio_chunk`.
+
+    Är `connection_source` satt (t.ex. poolen) tas i stället en ny klient
+    därifrån, som tar över sessionen (`take_over`): `handover` får den nya
+    klienten och `recv_loop` fortsätter på den. Den gamla klienten skickar
+    bara vidare det som redan väntade på låset.
     """
     def __init__(
         self,
@@ -26,6 +193,13 @@ class OpenAIRealtimeClient:
         transcribe_model: str,
         language: str = "sv",
         add_beta_header: bool = True,
+        encode_offload_bytes: int = 0,
+        server_vad: bool = True,
+        sample_rate_hz: int = 24000,
+        replay_max_bytes: int = 0,
+        reconnect_attempts: int = 5,
+        reconnect_backoff_s: float = 0.2,
+        reconnect_backoff_max_s: float = 5.0,
     ) -> None:
         self.url = url
         self.api_key = api_key
@@ -35,6 +209,32 @@ class OpenAIRealtimeClient:
         self.ws: Optional[websockets.WebSocketClientProtocol] = None
         self._recv_task: Optional[asyncio.Task] = None
         self._connected = asyncio.Event()
+        self.connected_at: float = 0.0  # time.monotonic() vid senaste connect
+        # Chunks >= så här många byte base64-kodas i en worker-tråd (0 = aldrig)
+        self.encode_offload_bytes = encode_offload_bytes
+        self._send_lock = asyncio.Lock()
+        # Av = bara manuella commits (t.ex. batch, där ett segment = ett item)
+        self.server_vad = server_vad
+        # Sätts av sessionen när den spåras: tid för base64-kodningen
+        self.trace: Optional[SessionTrace] = None
+
+        # Återanslutning (se klassens docstring)
+        self.bytes_per_ms = sample_rate_hz * 2 // 1000
+        self.unacked = UnackedAudio(replay_max_bytes, self.bytes_per_ms) if replay_max_bytes > 0 else None
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_backoff_s = reconnect_backoff_s
+        self.reconnect_backoff_max_s = reconnect_backoff_max_s
+        self.connection_source: Optional[Callable[[], Awaitable[OpenAIRealtimeClient]]] = None
+        self.handover: Optional[Callable[[OpenAIRealtimeClient], None]] = None
+        self.successor: Optional[OpenAIRealtimeClient] = None   # klienten som tog över sessionen
+        self.recovery = RecoveryStats()
+        self._down = False      # anslutningen är borta, återanslutning pågår
+        self._failed = False    # återanslutningen gav upp
+        self._closing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.ws is not None and self.ws.open
 
     async def connect(self) -> None:
         # Headers: Azure vs OpenAI
@@ -52,6 +252,7 @@ class OpenAIRealtimeClient:
             extra_headers=headers,
             max_size=32 * 1024 * 1024,
         )
+        self.connected_at = time.monotonic()
         self._connected.set()
 
         # Konfigurera sessionen (pcm16 + transcribe-modell + språk)
@@ -71,12 +272,13 @@ class OpenAIRealtimeClient:
                     "silence_duration_ms": 500,
                     "create_response": False,  # vi vill bara STT
                     "interrupt_response": True
-                },
+                } if self.server_vad else None,
             },
         }
         await self.ws.send(json.dumps(session_update))
 
     async def close(self) -> None:
+        self._closing = True
         if self.ws:
             await self.ws.close()
             self.ws = None
@@ -85,29 +287,170 @@ class OpenAIRealtimeClient:
         """Skicka en ljudchunk (PCM16) som base64 till input_audio_buffer.append"""
         if not self.ws:
             raise RuntimeError("WebSocket not connected")
-        b64 = base64.b64encode(pcm_bytes).decode("ascii")
-        msg = {"type": "input_audio_buffer.append", "audio": b64}
-        await self.ws.send(json.dumps(msg))
+        # Låset håller ordningen mellan bufferten för omsändning och det som skickas
+        async with self._send_lock:
+            unacked = self.unacked
+            if unacked is None:
+                await self._send_audio(pcm_bytes)
+                return
+            # Överlämnad medan vi väntade på låset (som den nya klienten delar)
+            conn = self.successor or self
+            if conn._failed:
+                raise RuntimeError("Realtime-anslutningen kunde inte återställas")
+            unacked.append(pcm_bytes)
+            if conn._down:
+                return  # skickas när anslutningen är tillbaka
+            try:
+                await conn._send_audio(pcm_bytes)
+            except websockets.exceptions.ConnectionClosed:
+                conn._down = True  # recv_loop märker det och återansluter
+
+    async def _send_audio(self, pcm_bytes: bytes) -> None:
+        trace = self.trace
+        start = now_ns() if trace is not None else 0
+        if 0 < self.encode_offload_bytes <= len(pcm_bytes):
+            payload = await asyncio.to_thread(encode_append, pcm_bytes)
+        else:
+            payload = encode_append(pcm_bytes)
+        if trace is not None:
+            trace.span("encode", TRACK_UPSTREAM, start, {"bytes": len(pcm_bytes)})
+        if not self.ws:
+            raise RuntimeError("WebSocket not connected")
+        await self.ws.send(payload)
 
     async def commit(self) -> None:
         if not self.ws:
             raise RuntimeError("WebSocket not connected")
-        await self.ws.send(json.dumps({"type": "input_audio_buffer.commit"}))
+        unacked = self.unacked
+        if unacked is None:
+            await self.ws.send(_COMMIT)
+            return
+        async with self._send_lock:
+            conn = self.successor or self
+            if conn._failed:
+                raise RuntimeError("Realtime-anslutningen kunde inte återställas")
+            unacked.note_commit()
+            if conn._down:
+                return
+            try:
+                await conn.ws.send(_COMMIT)
+            except websockets.exceptions.ConnectionClosed:
+                conn._down = True
+
+    def item_audio(self, item_id: str) -> Optional[List[memoryview]]:
+        """Ljudet i ett commit:at item vars transkript inte kommit än (None om det inte finns kvar)."""
+        return self.unacked.item_audio(item_id) if self.unacked is not None else None
 
-    async def recv_loop(self, on_event: Callable[[JsonDict], Awaitable[None]]) -> None:
+    async def recv_loop(self, events: EventDispatcher) -> None:
         if not self.ws:
             raise RuntimeError("WebSocket not connected")
-        try:
-            async for raw in self.ws:
-                try:
-                    data = json.loads(raw)
-                    await on_event(data)
-                except Exception as e:
-                    logger.warning("Fel vid hantering av Realtime event: %s", e)
-                    continue
-        except asyncio.CancelledError:
-            raise
-        except websockets.exceptions.ConnectionClosedError as e:
-            logger.info("Realtime WebSocket stängd: %s", e)
-        except Exception as e:
-            logger.exception("Realtime recv_loop fel: %s", e)
+        unacked = self.unacked
+        if unacked is not None:
+            events.tap("input_audio_buffer.speech_stopped", lambda e: unacked.speech_stopped(e.get("audio_end_ms")))
+            events.tap("input_audio_buffer.committed", lambda e: unacked.committed(e.get("item_id")))
+            events.tap("conversation.item.input_audio_transcription.completed", lambda e: unacked.item_done(e.get("item_id")))
+            events.tap("conversation.item.input_audio_transcription.failed", lambda e: unacked.item_done(e.get("item_id")))
+            events.tap("error", self._on_error)
+        while True:
+            try:
+                async for raw in self.ws:
+                    try:
+                        await events.dispatch(raw)
+                    except Exception as e:
+                        logger.warning("Fel vid hantering av Realtime event: %s", e)
+                        continue
+            except asyncio.CancelledError:
+                raise
+            except websockets.exceptions.ConnectionClosedError as e:
+                logger.info("Realtime WebSocket stängd: %s", e)
+            except Exception as e:
+                logger.exception("Realtime recv_loop fel: %s", e)
+            if self._closing or unacked is None or not await self._recover():
+                return
+            if self.successor is not None:
+                await self.successor.recv_loop(events)
+                return
+
+    def take_over(self, old: OpenAIRealtimeClient) -> None:
+        """Ta över en tappad klients session: obekräftat ljud, sändlås och statistik."""
+        self.unacked = old.unacked
+        self._send_lock = old._send_lock
+        self.recovery = old.recovery
+        self.trace = old.trace
+        self.connection_source = old.connection_source
+        self.handover = old.handover
+        self.reconnect_attempts = old.reconnect_attempts
+        self.reconnect_backoff_s = old.reconnect_backoff_s
+        self.reconnect_backoff_max_s = old.reconnect_backoff_max_s
+
+    def _on_error(self, evt: dict) -> None:
+        detail = evt.get("error")
+        if isinstance(detail, dict) and detail.get("code") == "input_audio_buffer_commit_empty":
+            self.unacked.commit_empty()
+
+    async def _recover(self) -> bool:
+        """Återanslut och skicka obekräftat ljud igen. False om alla försök misslyckades.
+
+        Med `connection_source` sätts `successor` till klienten som tog över.
+        """
+        self._down = True
+        t0 = time.monotonic()
+        old = self.ws
+        for attempt in range(self.reconnect_attempts):
+            if attempt:
+                cap = min(self.reconnect_backoff_max_s, self.reconnect_backoff_s * 2 ** (attempt - 1))
+                await asyncio.sleep(random.uniform(0, cap))  # full jitter
+            conn = self
+            try:
+                if self.connection_source is not None:
+                    conn = await self.connection_source()
+                    conn.take_over(self)
+                else:
+                    await self.connect()
+                async with self._send_lock:
+                    replayed = await conn._replay()
+                    if conn is not self:
+                        self.successor = conn
+                        if self.handover is not None:
+                            self.handover(conn)
+                    conn._down = False
+            except asyncio.CancelledError:
+                if conn is not self:
+                    asyncio.create_task(conn.close())
+                raise
+            except Exception as e:
+                logger.warning("Realtime: återanslutning %d/%d misslyckades: %s", attempt + 1, self.reconnect_attempts, e)
+                if conn is not self:
+                    asyncio.create_task(conn.close())
+                elif self.ws is not None and self.ws is not old:
+                    asyncio.create_task(self.ws.close())
+                continue
+            ms = (time.monotonic() - t0) * 1000.0
+            stats = self.recovery
+            stats.reconnects += 1
+            stats.recovery_ms_total += ms
+            stats.recovery_ms_max = max(stats.recovery_ms_max, ms)
+            stats.replayed_bytes += replayed
+            metrics.UPSTREAM_RECONNECTS.inc()
+            metrics.UPSTREAM_RECOVERY.observe(ms / 1000.0)
+            logger.info("Realtime: återansluten efter %.0f ms, %d byte ljud skickat igen", ms, replayed)
+            if old is not None and (conn is not self or old is not self.ws):
+                asyncio.create_task(old.close())
+            return True
+        self._failed = True
+        self.recovery.failures += 1
+        metrics.ERRORS.labels("upstream_reconnect_failed").inc()
+        return False
+
+    async def _replay(self) -> int:
+        n = 0
+        for chunk in self.unacked.replay_plan():
+            if chunk is None:
+                await self.ws.send(_COMMIT)
+            else:
+                await self._send_audio(chunk)
+                n += len(chunk)
+        return n
+
+
+_COMMIT = json.dumps({"type": "input_audio_buffer.commit"})
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import binascii
+import json
+import re
+import sys
+from typing import Awaitable, Callable, Dict, Optional, Union
+
+# Fast JSON-kuvert för input_audio_buffer.append. base64 innehåller aldrig
+# tecken som behöver escapas i JSON, så payloaden kan skrivas rakt in.
+APPEND_PREFIX = '{"type":"input_audio_buffer.append","audio":"'
+APPEND_SUFFIX = '"}'
+
+
+def encode_append(pcm: bytes) -> str:
+    """Bygg ett `input_audio_buffer.append`-meddelande som str för `ws.send`.
+
+    Ingen återanvänd buffer: websockets publika `send` skickar bara str som
+    textram (bytes blir en binär ram, som Realtime inte tar emot), så
+    meddelandet måste bli en ny str. Jämfört med den gamla vägen (dict ->
+    b64encode -> decode -> json.dumps) slipper payloaden json.dumps, som
+    letar tecken att escapa i hela base64-strängen. Kvar är tre kopior:
+    base64-bytes, ascii-str och sammanfogningen med kuvertet. Funktionen
+    har inget delat state och kan därför köras i en worker-tråd.
+    """
+    return APPEND_PREFIX + binascii.b2a_base64(pcm, newline=False).decode("ascii") + APPEND_SUFFIX
+
+
+# --- Realtime-events in ------------------------------------------------------
+
+UNKNOWN_TYPE = "unknown"
+
+# Nyckeln "type" följd av ett strängvärde utan escapes (alla Realtime-typer)
+_TYPE_VALUE = re.compile(r'"type"\s*:\s*"([^"\\]*)"')
+_MAX_TYPES = 512
+_types: Dict[str, str] = {}
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+def intern_type(t: str) -> str:
+    """Samma str-objekt för samma eventtyp, så att uppslag i dicts blir billiga."""
+    s = _types.get(t)
+    if s is None:
+        s = sys.intern(t)
+        if len(_types) < _MAX_TYPES:
+            _types[s] = s
+    return s
+
+
+def peek_type(raw: Union[str, bytes]) -> Optional[str]:
+    """Läs toppnivåns "type" ur ett event utan att parsa resten.
+
+    Returnerar None om det inte går att avgöra säkert (bytes, nyckeln inne
+    i ett nästlat objekt, escapes i värdet); då får anroparen parsa allt.
+    """
+    if type(raw) is not str:
+        return None
+    # Realtime skickar typen först; annars letas nyckeln upp
+    if raw.startswith('{"type":"'):
+        j = 9
+    elif raw.startswith('{"type": "'):
+        j = 10
+    else:
+        i = raw.find('"type"')
+        # Toppnivå: före nyckeln får bara det yttersta objektet ha öppnats
+        if i < 0 or raw.count("{", 0, i) != 1 or raw.find("[", 0, i) >= 0:
+            return None
+        m = _TYPE_VALUE.match(raw, i)
+        return intern_type(m.group(1)) if m is not None else None
+    k = raw.find('"', j)
+    if k < 0:
+        return None
+    t = raw[j:k]
+    if "\\" in t:
+        return None
+    s = _types.get(t)
+    return s if s is not None else intern_type(t)
+
+
+class EventDispatcher:
+    """Avkodar Realtime-events och skickar dem till hanterare per eventtyp.
+
+    Typen läses med `peek_type()`. Bara events som någon hanterare (eller
+    `on_other()`) vill ha parsas med json.loads; övriga räknas i `skipped`.
+    `observer` får (typ, rå text) för varje event, före hanteraren – till
+    räkning och loggning som inte behöver innehållet. En `tap()` är en
+    synkron lyssnare som får det parsade eventet före hanteraren.
+    """
+
+    def __init__(self, observer: Optional[Callable[[str, Union[str, bytes]], None]] = None) -> None:
+        self.observer = observer
+        self._handlers: Dict[str, EventHandler] = {}
+        self._other: Optional[EventHandler] = None
+        self._taps: Dict[str, Callable[[dict], None]] = {}
+        self.decoded = 0
+        self.skipped = 0
+
+    def on(self, event_type: str, handler: EventHandler) -> None:
+        self._handlers[intern_type(event_type)] = handler
+
+    def tap(self, event_type: str, fn: Callable[[dict], None]) -> None:
+        self._taps[intern_type(event_type)] = fn
+
+    def on_other(self, handler: EventHandler) -> None:
+        """Hanterare för alla typer som inte har en egen."""
+        self._other = handler
+
+    async def dispatch(self, raw: Union[str, bytes]) -> None:
+        evt = None
+        t = peek_type(raw)
+        if t is None:
+            evt = json.loads(raw)
+            t = evt.get("type") if type(evt) is dict else None
+            t = intern_type(t) if type(t) is str else UNKNOWN_TYPE
+        if self.observer is not None:
+            self.observer(t, raw)
+        handler = self._handlers.get(t, self._other)
+        tap = self._taps.get(t) if self._taps else None
+        if handler is None and tap is None:
+            self.skipped += 1
+            return
+        if evt is None:
+            evt = json.loads(raw)
+        if type(evt) is not dict:
+            self.skipped += 1
+            return
+        self.decoded += 1
+        if tap is not None:
+            tap(evt)
+        if handler is not None:
+            await handler(evt)
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from .config import settings
+from .realtime_client import OpenAIRealtimeClient
+
+logger = logging.getLogger(__name__)
+
+
+def new_client(server_vad: bool = True, replay_max_ms: Optional[int] = None) -> OpenAIRealtimeClient:
+    """Skapa en (ej ansluten) Realtime-klient enligt settings.
+
+    `replay_max_ms` ersätter `settings.upstream_replay_max_ms` (0 = ingen återanslutning).
+    """
+    if replay_max_ms is None:
+        replay_max_ms = settings.upstream_replay_max_ms
+    rate = settings.upstream_sample_rate_hz
+    return OpenAIRealtimeClient(
+        url=settings.realtime_url,
+        api_key=settings.openai_api_key,
+        transcribe_model=settings.transcribe_model,
+        language=settings.input_language,
+        add_beta_header=settings.add_beta_header,
+        encode_offload_bytes=settings.audio_encode_offload_bytes,
+        server_vad=server_vad,
+        sample_rate_hz=rate,
+        replay_max_bytes=replay_max_ms * (rate * 2 // 1000),
+        reconnect_attempts=settings.upstream_reconnect_attempts,
+        reconnect_backoff_s=settings.upstream_reconnect_backoff_ms / 1000,
+        reconnect_backoff_max_s=settings.upstream_reconnect_backoff_max_ms / 1000,
+    )
+
+
+class PoolStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.connect_failures = 0
+        self.retired_idle = 0
+        self.retired_expired = 0
+        self.retired_closed = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def observe_wait(self, ms: float) -> None:
+        self.wait_ms_total += ms
+        if ms > self.wait_ms_max:
+            self.wait_ms_max = ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        acquires = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / acquires) if acquires else 0.0,
+            "connect_failures": self.connect_failures,
+            "retired_idle": self.retired_idle,
+            "retired_expired": self.retired_expired,
+            "retired_closed": self.retired_closed,
+            "wait_ms_avg": (self.wait_ms_total / acquires) if acquires else 0.0,
+            "wait_ms_max": self.wait_ms_max,
+        }
+
+
+class RealtimePool:
+    """Håller N färdigkonfigurerade Realtime-sessioner varma.
+
+    Varje klient i poolen har redan gjort `connect()` (TLS-handshake +
+    `session.update`), så en ny frontend-session slipper vänta på det.
+    En bakgrundstask fyller på poolen och pensionerar anslutningar som
+    legat för länge (`idle_ttl_s`) eller är för gamla (`max_age_s`).
+    Använda klienter lämnas aldrig tillbaka – de bär på sessionens
+    ljudbuffer och transkript upstream.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        max_age_s: float,
+        idle_ttl_s: float,
+        factory: Callable[[], OpenAIRealtimeClient] = new_client,
+    ) -> None:
+        self.size = size
+        self.max_age_s = max_age_s
+        self.idle_ttl_s = idle_ttl_s
+        self.factory = factory
+        self.stats = PoolStats()
+        # (klient, tidpunkt då den lades i poolen)
+        self._idle: Deque[Tuple[OpenAIRealtimeClient, float]] = deque()
+        self._connecting = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.size <= 0:
+            logger.info("Realtime-pool avstängd (size=%d)", self.size)
+            return
+        if not settings.openai_api_key:
+            logger.info("Realtime-pool startas inte: OPENAI_API_KEY saknas")
+            return
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._refill_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._idle:
+            client, _ = self._idle.popleft()
+            await self._close(client)
+
+    async def acquire(self) -> OpenAIRealtimeClient:
+        """Lämna ut en ansluten klient – varm om det finns, annars nyansluten."""
+        t0 = time.perf_counter()
+        client = self._pop_healthy()
+        if client is not None:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+            client = self.factory()
+            await client.connect()
+        self.stats.observe_wait((time.perf_counter() - t0) * 1000.0)
+        self._wake.set()
+        return client
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "running": self.running,
+            "idle": len(self._idle),
+            "connecting": self._connecting,
+            **self.stats.as_dict(),
+        }
+
+    # ------------------------------------------------------------------
+
+    def _pop_healthy(self) -> Optional[OpenAIRealtimeClient]:
+        now = time.monotonic()
+        while self._idle:
+            client, _ = self._idle.popleft()
+            if not client.is_open:
+                self.stats.retired_closed += 1
+                asyncio.create_task(self._close(client))
+                continue
+            if now - client.connected_at > self.max_age_s:
+                self.stats.retired_expired += 1
+                asyncio.create_task(self._close(client))
+                continue
+            return client
+        return None
+
+    async def _reap(self) -> None:
+        now = time.monotonic()
+        keep: Deque[Tuple[OpenAIRealtimeClient, float]] = deque()
+        while self._idle:
+            client, pooled_at = self._idle.popleft()
+            if not client.is_open:
+                self.stats.retired_closed += 1
+            elif now - client.connected_at > self.max_age_s:
+                self.stats.retired_expired += 1
+            elif now - pooled_at > self.idle_ttl_s:
+                self.stats.retired_idle += 1
+            else:
+                keep.append((client, pooled_at))
+                continue
+            await self._close(client)
+        self._idle = keep
+
+    async def _warm_one(self) -> None:
+        client = self.factory()
+        self._connecting += 1
+        try:
+            await client.connect()
+        finally:
+            self._connecting -= 1
+        self._idle.append((client, time.monotonic()))
+
+    async def _refill_loop(self) -> None:
+        backoff = 0.5
+        tick = max(0.5, min(self.idle_ttl_s, self.max_age_s) / 4)
+        while True:
+            self._wake.clear()
+            await self._reap()
+            missing = self.size - len(self._idle) - self._connecting
+            if missing > 0:
+                results = await asyncio.gather(
+                    *(self._warm_one() for _ in range(missing)), return_exceptions=True
+                )
+                failures = [r for r in results if isinstance(r, Exception)]
+                if failures:
+                    self.stats.connect_failures += len(failures)
+                    logger.warning("Realtime-pool: %d anslutningar misslyckades: %s", len(failures), failures[0])
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+                backoff = 0.5
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=tick)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    async def _close(client: OpenAIRealtimeClient) -> None:
+        try:
+            await client.close()
+        except Exception:
+            pass
+
+
+pool = RealtimePool(
+    size=settings.realtime_pool_size,
+    max_age_s=settings.realtime_pool_max_age_s,
+    idle_ttl_s=settings.realtime_pool_idle_ttl_s,
+)
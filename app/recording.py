@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .config import settings
+
+log = logging.getLogger("stt")
+
+AUDIO_FILE = "audio_in.raw"
+EVENTS_FILE = "events.jsonl"
+
+# Operationer till skrivtråden: (op, session_id, ...)
+_OPEN, _AUDIO, _EVENT, _RAW, _CLOSE = range(5)
+
+
+class SessionRecording:
+    """Inspelning av en session: frontendens ljud (exakt som det kom) och en händelselogg.
+
+    Anropen här gör bara en `put()` på skrivtrådens kö; serialisering och
+    disk-I/O sker i tråden. Tidsstämplar (`t`) är sekunder sedan start
+    (monotont). Blir sessionen större än `max_bytes` slutar den spelas in.
+    """
+
+    __slots__ = ("session_id", "_recorder", "_t0", "_bytes", "max_bytes", "active")
+
+    def __init__(self, recorder: Recorder, session_id: str, max_bytes: int) -> None:
+        self.session_id = session_id
+        self._recorder = recorder
+        self._t0 = time.monotonic()
+        self._bytes = 0
+        self.max_bytes = max_bytes
+        self.active = True
+
+    def audio(self, chunk: bytes) -> None:
+        if not self.active:
+            return
+        t = time.monotonic() - self._t0
+        if self._account(len(chunk) + 64):
+            self._recorder._put((_AUDIO, self.session_id, t, chunk), len(chunk))
+
+    def event(self, kind: str, data: Any = None) -> None:
+        """`kind` t.ex. "out" (till frontend) eller "commit"."""
+        if not self.active:
+            return
+        t = time.monotonic() - self._t0
+        if self._account(256):
+            self._recorder._put((_EVENT, self.session_id, t, kind, data), 256)
+
+    def raw_event(self, kind: str, raw) -> None:
+        """Som `event()`, men med färdig JSON-text (t.ex. ett upstream-event som det kom)."""
+        if not self.active:
+            return
+        t = time.monotonic() - self._t0
+        if self._account(len(raw) + 64):
+            self._recorder._put((_RAW, self.session_id, t, kind, raw), len(raw))
+
+    def close(self) -> None:
+        if self.active:
+            self.active = False
+            self._recorder._put((_CLOSE, self.session_id, time.monotonic() - self._t0), 0)
+
+    def _account(self, n: int) -> bool:
+        self._bytes += n
+        if self._bytes <= self.max_bytes:
+            return True
+        # Storlekstaket nått: skriv en markering och sluta spela in
+        self.active = False
+        self._recorder._put((_EVENT, self.session_id, time.monotonic() - self._t0, "truncated", None), 256)
+        self._recorder._put((_CLOSE, self.session_id, time.monotonic() - self._t0), 0)
+        return False
+
+
+class Recorder:
+    """Opt-in-inspelning av sessioner till `directory/<session_id>/`.
+
+    En bakgrundstråd per process skriver allt; eventloopen lägger bara
+    poster i en kö. Hinner tråden inte med (mer än `queue_max_bytes`
+    ljud i kö) kastas poster och räknas i `dropped`. Tråden städar också:
+    inspelningar äldre än `retention_s` tas bort, och den totala storleken
+    hålls under `max_total_bytes` genom att de äldsta tas bort först.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        enabled: bool = False,
+        sample_rate: float = 1.0,
+        max_session_bytes: int = 64 * 1024 * 1024,
+        max_total_bytes: int = 2 * 1024 * 1024 * 1024,
+        retention_s: float = 7 * 24 * 3600,
+        queue_max_bytes: int = 32 * 1024 * 1024,
+    ) -> None:
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        self.retention_s = retention_s
+        self.queue_max_bytes = queue_max_bytes
+        self._queue: "queue.SimpleQueue[Optional[tuple]]" = queue.SimpleQueue()
+        self._pending_bytes = 0
+        # Räknas upp i eventloopen och ner i skrivtråden
+        self._pending_lock = threading.Lock()
+        self.dropped = 0
+        self.recorded = 0
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start_session(self, session_id: str, meta: Dict[str, Any]) -> Optional[SessionRecording]:
+        """Börja spela in en session, eller None om den inte ska spelas in."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        self._ensure_thread()
+        self.recorded += 1
+        meta = dict(meta, session_id=session_id, started_at=time.time())
+        self._put((_OPEN, session_id, meta), 0)
+        return SessionRecording(self, session_id, self.max_session_bytes)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "pending_bytes": self._pending_bytes,
+        }
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    # ------------------------------------------------------------------
+
+    def _put(self, op: tuple, size: int) -> None:
+        if size:
+            with self._pending_lock:
+                if self._pending_bytes + size > self.queue_max_bytes:
+                    self.dropped += 1
+                    return
+                self._pending_bytes += size
+        self._queue.put(op)
+
+    def _written(self, size: int) -> None:
+        with self._pending_lock:
+            self._pending_bytes -= size
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                os.makedirs(self.directory, exist_ok=True)
+                self._thread = threading.Thread(target=self._write_loop, name="recorder", daemon=True)
+                self._thread.start()
+
+    def _write_loop(self) -> None:
+        files: Dict[str, tuple] = {}   # session_id -> (ljudfil, händelsefil)
+        next_sweep = 0.0
+        while True:
+            try:
+                op = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                op = ()
+            if op is None:
+                break
+            try:
+                if op:
+                    self._apply(op, files)
+                now = time.time()
+                if now >= next_sweep:
+                    next_sweep = now + 60.0
+                    self._sweep(now, set(files))
+            except Exception as e:
+                log.warning("Inspelning: skrivning misslyckades: %s", e)
+        for audio_f, events_f in files.values():
+            audio_f.close()
+            events_f.close()
+
+    def _apply(self, op: tuple, files: Dict[str, tuple]) -> None:
+        kind, sid = op[0], op[1]
+        if kind == _OPEN:
+            path = os.path.join(self.directory, sid)
+            os.makedirs(path, exist_ok=True)
+            files[sid] = (
+                open(os.path.join(path, AUDIO_FILE), "wb"),
+                open(os.path.join(path, EVENTS_FILE), "w", encoding="utf-8"),
+            )
+            files[sid][1].write(json.dumps({"t": 0.0, "kind": "meta", "data": op[2]}, ensure_ascii=False) + "\n")
+            return
+        if kind == _AUDIO:
+            self._written(len(op[3]))
+        elif kind == _EVENT:
+            self._written(256)
+        elif kind == _RAW:
+            self._written(len(op[4]))
+        f = files.get(sid)
+        if f is None:
+            return
+        audio_f, events_f = f
+        if kind == _AUDIO:
+            _, _, t, chunk = op
+            # Offset från filen själv, så loggen stämmer även om poster kastats
+            offset = audio_f.tell()
+            audio_f.write(chunk)
+            events_f.write(f'{{"t":{t:.6f},"kind":"audio","offset":{offset},"len":{len(chunk)}}}\n')
+        elif kind == _EVENT:
+            _, _, t, name, data = op
+            line = {"t": round(t, 6), "kind": name}
+            if data is not None:
+                line["data"] = data
+            events_f.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+        elif kind == _RAW:
+            _, _, t, name, raw = op
+            if isinstance(raw, bytes):
+                raw = raw.decode("utf-8", "replace")
+            # Radbrytningar i JSON kan bara vara blanktecken mellan tokens
+            raw = raw.replace("\r", " ").replace("\n", " ")
+            events_f.write(f'{{"t":{t:.6f},"kind":"{name}","data":{raw}}}\n')
+        elif kind == _CLOSE:
+            events_f.write(f'{{"t":{op[2]:.6f},"kind":"end"}}\n')
+            audio_f.close()
+            events_f.close()
+            del files[sid]
+
+    def _sweep(self, now: float, open_sessions: set) -> None:
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.is_dir() and e.name not in open_sessions]
+        except FileNotFoundError:
+            return
+        recs = []
+        for e in entries:
+            size = sum(f.stat().st_size for f in os.scandir(e.path) if f.is_file())
+            recs.append((e.stat().st_mtime, size, e.path))
+        recs.sort()
+        total = sum(size for _, size, _ in recs)
+        for mtime, size, path in recs:
+            if now - mtime > self.retention_s or total > self.max_total_bytes:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+
+recorder = Recorder(
+    directory=settings.recording_dir,
+    enabled=settings.recording_enabled,
+    sample_rate=settings.recording_sample_rate,
+    max_session_bytes=settings.recording_max_session_bytes,
+    max_total_bytes=settings.recording_max_total_bytes,
+    retention_s=settings.recording_retention_s,
+)
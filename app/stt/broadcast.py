@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from fastapi import WebSocket
+
+from .queues import BoundedSendQueue, QueueClosed, QueueOverflow
+
+log = logging.getLogger("stt")
+
+
+class Subscriber:
+    """En läsande anslutning med egen begränsad utkö."""
+
+    __slots__ = ("queue", "overflowed")
+
+    def __init__(self, maxsize: int, policy: str) -> None:
+        self.queue = BoundedSendQueue("subscriber", maxsize, policy)
+        self.overflowed = False
+
+
+class TranscriptBroadcast:
+    """Skickar en sessions transkript till läsande prenumeranter (/ws/subscribe).
+
+    Varje meddelande serialiseras en gång och samma sträng läggs i varje
+    prenumerants kö, så kostnaden per prenumerant är en köpost. Köerna är
+    begränsade var för sig: en långsam läsare tappar sina egna äldsta
+    meddelanden (`drop_oldest`) eller kopplas bort (`close`, 1013) – den
+    bromsar aldrig sessionen eller de andra. Meddelandena bär hela texten
+    för itemet, så en tappad partial ersätts av nästa.
+    """
+
+    def __init__(self, max_subscribers: int, queue_max: int, policy: str = "drop_oldest") -> None:
+        self.max_subscribers = max_subscribers
+        self.queue_max = queue_max
+        self.policy = policy
+        self._subs: List[Subscriber] = []
+        self.closed = False
+        self.published = 0
+        self.joined = 0
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def add(self, snapshot: Dict[str, Any]) -> Optional[Subscriber]:
+        """Ny prenumerant, med `snapshot` först i kön. None om det är fullt."""
+        if self.closed or len(self._subs) >= self.max_subscribers:
+            return None
+        sub = Subscriber(self.queue_max, self.policy)
+        sub.queue.put_nowait(_dumps(snapshot), force=True)
+        self._subs.append(sub)
+        self.joined += 1
+        return sub
+
+    def remove(self, sub: Subscriber) -> None:
+        try:
+            self._subs.remove(sub)
+        except ValueError:
+            pass
+        sub.queue.close()
+
+    def publish(self, payload: Dict[str, Any]) -> None:
+        if not self._subs:
+            return
+        data = _dumps(payload)
+        self.published += 1
+        for sub in list(self._subs):
+            try:
+                sub.queue.put_nowait(data)
+            except QueueOverflow:
+                # policy `close`: läsaren hänger inte med och kopplas bort
+                sub.overflowed = True
+                self.remove(sub)
+            except QueueClosed:
+                self.remove(sub)
+
+    def close(self, payload: Optional[Dict[str, Any]] = None) -> None:
+        """Sessionen är slut: `payload` sist i varje kö, sedan stängs köerna."""
+        self.closed = True
+        data = _dumps(payload) if payload is not None else None
+        for sub in self._subs:
+            if data is not None:
+                try:
+                    sub.queue.put_nowait(data, force=True)
+                except QueueClosed:
+                    pass
+            sub.queue.close()
+        self._subs.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subs),
+            "joined": self.joined,
+            "published": self.published,
+            "dropped": sum(s.queue.dropped for s in self._subs),
+            "max_depth": max((len(s.queue) for s in self._subs), default=0),
+        }
+
+
+def _dumps(payload: Dict[str, Any]) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+async def run_subscriber_sender(ws: WebSocket, sub: Subscriber) -> None:
+    """Töm prenumerantens kö mot dess WebSocket tills kön stängs."""
+    try:
+        while True:
+            await ws.send_text(await sub.queue.get())
+    except QueueClosed:
+        pass
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from ..config import settings
+
+log = logging.getLogger("stt")
+
+
+class CommitHandle:
+    """En sessions plats i schemaläggaren.
+
+    Sessionen rapporterar hur mycket ljud som gått mot upstream med
+    `note_audio()`. Schemaläggaren anropar `commit` (synkront, t.ex. lägg
+    en commit-post i sessionens kö) först när minst `min_audio_ms` ljud
+    buffrats sedan förra commit och sessionens intervall har gått. Commit:ar
+    upstream själv (server-VAD) anropar sessionen `note_committed()`, så
+    att timern bara blir en reserv.
+    """
+
+    __slots__ = (
+        "_scheduler", "_commit", "bytes_per_ms", "min_audio_ms", "buffered_ms", "interval_ms",
+        "last_audio", "due_tick", "armed", "closed", "commits", "empty_commits",
+    )
+
+    def __init__(self, scheduler: CommitScheduler, commit: Callable[[], None], bytes_per_ms: float,
+                 min_audio_ms: float) -> None:
+        self._scheduler = scheduler
+        self._commit = commit
+        self.bytes_per_ms = bytes_per_ms
+        self.min_audio_ms = min_audio_ms
+        self.buffered_ms = 0.0
+        self.interval_ms = float(scheduler.base_interval_ms)
+        self.last_audio = 0.0
+        self.due_tick = 0
+        self.armed = False
+        self.closed = False
+        self.commits = 0
+        self.empty_commits = 0
+
+    def note_audio(self, n_bytes: int) -> None:
+        if self.closed or n_bytes <= 0:
+            return
+        self.buffered_ms += n_bytes / self.bytes_per_ms
+        self.last_audio = time.monotonic()
+        if not self.armed:
+            self._scheduler._arm(self, self.interval_ms)
+
+    def note_committed(self) -> None:
+        """Upstream har commit:at ljudet (server-VAD): räkna om från noll."""
+        self.buffered_ms = 0.0
+
+    def note_empty_commit(self) -> None:
+        """Upstream svarade input_audio_buffer_commit_empty – glesa ut commits."""
+        self.empty_commits += 1
+        self.buffered_ms = 0.0
+        self.interval_ms = min(float(self._scheduler.max_interval_ms), self.interval_ms * 2)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._scheduler._unregister(self)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "commits": self.commits,
+            "empty_commits": self.empty_commits,
+            "buffered_ms": round(self.buffered_ms, 1),
+            "interval_ms": round(self.interval_ms, 1),
+        }
+
+
+class CommitScheduler:
+    """Processgemensam timer-wheel som styr commits för alla sessioner.
+
+    I stället för en `asyncio.sleep`-loop per session finns en enda task
+    som tickar var `tick_ms` – och bara så länge någon session har ljud
+    som väntar på commit. Varje tick behandlar bara sin egen slot i
+    hjulet, så kostnaden per tick beror på hur många sessioner som ska
+    committas just då, inte på hur många som finns.
+    """
+
+    def __init__(
+        self,
+        tick_ms: int,
+        base_interval_ms: int,
+        min_audio_ms: int,
+        max_interval_ms: int,
+        idle_timeout_ms: int,
+        slots: int = 512,
+    ) -> None:
+        self.tick_ms = max(1, tick_ms)
+        self.base_interval_ms = base_interval_ms
+        self.min_audio_ms = min_audio_ms
+        self.max_interval_ms = max(max_interval_ms, base_interval_ms)
+        self.idle_timeout_s = idle_timeout_ms / 1000
+        self._wheel: List[Set[CommitHandle]] = [set() for _ in range(slots)]
+        self._tick = 0
+        self._t0 = 0.0
+        self._armed = 0
+        self._sessions = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.commits = 0
+        self.wakeups = 0
+
+    def register(self, commit: Callable[[], None], bytes_per_ms: float,
+                 min_audio_ms: Optional[float] = None) -> CommitHandle:
+        """`min_audio_ms` ersätter schemaläggarens minimum för den här sessionen."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._sessions += 1
+        return CommitHandle(self, commit, bytes_per_ms, self.min_audio_ms if min_audio_ms is None else min_audio_ms)
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "sessions": self._sessions,
+            "armed": self._armed,
+            "tick_ms": self.tick_ms,
+            "commits": self.commits,
+            "wakeups": self.wakeups,
+        }
+
+    # ------------------------------------------------------------------
+
+    def _arm(self, h: CommitHandle, delay_ms: float) -> None:
+        ticks = max(1, math.ceil(delay_ms / self.tick_ms))
+        h.due_tick = self._tick + ticks
+        h.armed = True
+        self._wheel[h.due_tick % len(self._wheel)].add(h)
+        self._armed += 1
+        self._wake.set()
+
+    def _unregister(self, h: CommitHandle) -> None:
+        self._sessions -= 1
+        if h.armed:
+            self._wheel[h.due_tick % len(self._wheel)].discard(h)
+            h.armed = False
+            self._armed -= 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        tick_s = self.tick_ms / 1000
+        self._t0 = loop.time() - self._tick * tick_s
+        while True:
+            if self._armed == 0:
+                self._wake.clear()
+                await self._wake.wait()
+                # Förankra om klockan så att aktuell tick motsvarar "nu"
+                self._t0 = loop.time() - self._tick * tick_s
+            delay = self._t0 + (self._tick + 1) * tick_s - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.wakeups += 1
+            # Minst en tick framåt: timers (t.ex. uvloop) kan vakna någon ms för tidigt
+            now_tick = max(self._tick + 1, int((loop.time() - self._t0) / tick_s))
+            while self._tick < now_tick:
+                self._tick += 1
+                self._fire_slot(self._tick)
+
+    def _fire_slot(self, tick: int) -> None:
+        slot = self._wheel[tick % len(self._wheel)]
+        if not slot:
+            return
+        due = [h for h in slot if h.due_tick <= tick]
+        now = time.monotonic()
+        for h in due:
+            slot.discard(h)
+            h.armed = False
+            self._armed -= 1
+            self._fire(h, now)
+
+    def _fire(self, h: CommitHandle, now: float) -> None:
+        if h.closed:
+            return
+        if h.buffered_ms >= h.min_audio_ms:
+            h.buffered_ms = 0.0
+            h.commits += 1
+            self.commits += 1
+            # Lyckad commit: gå tillbaka mot grundintervallet
+            h.interval_ms = max(float(self.base_interval_ms), h.interval_ms * 0.75)
+            try:
+                h._commit()
+            except Exception as e:
+                log.debug("Commit kunde inte schemaläggas: %s", e)
+            return
+        if now - h.last_audio > self.idle_timeout_s:
+            # Inget nytt ljud på länge; vänta tills sessionen skickar igen
+            return
+        # För lite ljud: vänta ungefär tills resten hunnit komma i realtid
+        self._arm(h, h.min_audio_ms - h.buffered_ms)
+
+
+scheduler = CommitScheduler(
+    tick_ms=settings.commit_tick_ms,
+    base_interval_ms=settings.commit_interval_ms,
+    min_audio_ms=settings.commit_min_audio_ms,
+    max_interval_ms=settings.commit_max_interval_ms,
+    idle_timeout_ms=settings.commit_idle_timeout_ms,
+)
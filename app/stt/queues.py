@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "close")
+
+
+class QueueOverflow(Exception):
+    """Kön är full och policy är `close` – sessionen ska stängas."""
+
+
+class QueueClosed(Exception):
+    """Kön har stängts; konsumenten ska avsluta."""
+
+
+class BoundedSendQueue:
+    """Begränsad kö mellan en producent och en konsument i en session.
+
+    Varje post tidsstämplas när den läggs i kön, så att `snapshot()` kan
+    visa hur långt efter konsumenten ligger (djup och fördröjning i ms).
+    När kön är full styr `policy` vad som händer:
+
+    - `block`: producenten väntar tills det finns plats (backpressure)
+    - `drop_oldest`: äldsta posten kastas och räknas i `dropped`
+    - `close`: `QueueOverflow` kastas så att sessionen kan stängas
+    """
+
+    def __init__(self, name: str, maxsize: int, policy: str = "block") -> None:
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"okänd overflow-policy: {policy!r}")
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self._items: Deque[Tuple[float, Any]] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._closed = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def lag_ms(self) -> float:
+        """Ålder på äldsta posten i kön, dvs. hur långt efter konsumenten är."""
+        if not self._items:
+            return 0.0
+        return (time.monotonic() - self._items[0][0]) * 1000.0
+
+    async def put(self, item: Any) -> None:
+        while self.policy == "block" and len(self._items) >= self.maxsize and not self._closed:
+            self._not_full.clear()
+            await self._not_full.wait()
+        self.put_nowait(item)
+
+    def put_nowait(self, item: Any, force: bool = False) -> None:
+        """Lägg till utan att vänta. `force` ignorerar gränsen (kontrollposter)."""
+        if self._closed:
+            raise QueueClosed(self.name)
+        if not force and len(self._items) >= self.maxsize:
+            if self.policy == "close":
+                raise QueueOverflow(self.name)
+            if self.policy == "drop_oldest":
+                self._items.popleft()
+                self.dropped += 1
+            else:
+                raise asyncio.QueueFull(self.name)
+        self._items.append((time.monotonic(), item))
+        self.enqueued += 1
+        self._not_empty.set()
+
+    async def get(self) -> Any:
+        while not self._items:
+            if self._closed:
+                raise QueueClosed(self.name)
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        enqueued_at, item = self._items.popleft()
+        lag = (time.monotonic() - enqueued_at) * 1000.0
+        self.last_lag_ms = lag
+        if lag > self.max_lag_ms:
+            self.max_lag_ms = lag
+        if len(self._items) < self.maxsize:
+            self._not_full.set()
+        return item
+
+    def close(self) -> None:
+        self._closed = True
+        self._not_empty.set()
+        self._not_full.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._items),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "lag_ms": round(self.lag_ms, 1),
+            "last_lag_ms": round(self.last_lag_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+        }
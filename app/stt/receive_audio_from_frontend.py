@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import math
+from typing import Mapping, NamedTuple
+
+import numpy as np
+
+# encoding -> (numpy-dtype, byte per sampel, skalning till [-1, 1])
+ENCODINGS = {
+    "pcm16": ("<i2", 2, 1.0 / 32768.0),
+    "float32": ("<f4", 4, 1.0),
+}
+
+
+class AudioFormat(NamedTuple):
+    encoding: str
+    sample_rate_hz: int
+    channels: int
+
+    @property
+    def frame_bytes(self) -> int:
+        return ENCODINGS[self.encoding][1] * self.channels
+
+    def as_dict(self) -> dict:
+        return {"encoding": self.encoding, "sample_rate_hz": self.sample_rate_hz, "channels": self.channels}
+
+
+def parse_audio_format(params: Mapping[str, str], default: AudioFormat) -> AudioFormat:
+    """Läs klientens ljudformat från query-parametrar (samma namn som i `ready`).
+
+    Kastar ValueError med en läsbar förklaring om något värde är ogiltigt.
+    """
+    encoding = (params.get("encoding") or default.encoding).lower()
+    if encoding not in ENCODINGS:
+        raise ValueError(f"encoding måste vara en av {sorted(ENCODINGS)}")
+    try:
+        rate = int(params.get("sample_rate_hz") or default.sample_rate_hz)
+        channels = int(params.get("channels") or default.channels)
+    except ValueError:
+        raise ValueError("sample_rate_hz och channels måste vara heltal") from None
+    if not 8000 <= rate <= 192000:
+        raise ValueError("sample_rate_hz måste ligga mellan 8000 och 192000")
+    if not 1 <= channels <= 8:
+        raise ValueError("channels måste ligga mellan 1 och 8")
+    return AudioFormat(encoding, rate, channels)
+
+
+class FormatConverter:
+    """Gör om klientens ljud till PCM16 mono i upstream-samplingsfrekvensen.
+
+    Stegen (alla vektoriserade i NumPy): avkodning + nedmixning till mono,
+    lågpassfilter (FIR, bara vid nedsampling) och linjär interpolation
+    till ny frekvens. Filterhistorik, interpolationsfas och en ev. halv
+    ram sparas mellan chunks, så resultatet blir detsamma oavsett hur
+    klienten delar upp strömmen. Arbetsbuffrarna allokeras en gång och
+    växer bara om en chunk är större än alla tidigare.
+    """
+
+    def __init__(self, fmt: AudioFormat, out_rate_hz: int, taps: int = 31) -> None:
+        self.fmt = fmt
+        self.out_rate_hz = out_rate_hz
+        self._dtype, _, scale = ENCODINGS[fmt.encoding]
+        # Nedmixning = medelvärde, så kanalantalet bakas in i skalningen
+        self._scale = np.float32(scale / fmt.channels)
+        self._frame_bytes = fmt.frame_bytes
+        self._carry = b""
+        self._step = fmt.sample_rate_hz / out_rate_hz  # insampel per utsampel
+        self._t = 0.0       # position för nästa utsampel, relativt chunkens start
+        self._last = 0.0    # sista insampel från förra chunken
+        self._h = None
+        self._hist = None
+        if out_rate_hz < fmt.sample_rate_hz:
+            self._h = _lowpass(taps, 0.9 * 0.5 * out_rate_hz / fmt.sample_rate_hz)
+            self._hist = np.zeros(taps - 1, dtype=np.float32)
+        self._cap = 0
+        self._cap_out = 0
+
+    @property
+    def passthrough(self) -> bool:
+        f = self.fmt
+        return f.encoding == "pcm16" and f.channels == 1 and f.sample_rate_hz == self.out_rate_hz
+
+    def process(self, chunk: bytes) -> bytes:
+        if self.passthrough:
+            return chunk
+        data = self._carry + chunk if self._carry else chunk
+        n = len(data) // self._frame_bytes
+        self._carry = data[n * self._frame_bytes:]
+        if n == 0:
+            return b""
+        self._ensure(n)
+
+        # 1) avkoda + mono, skalat till [-1, 1]. Blandade dtyper i en ufunc
+        #    ger interna kastbuffrar, så varje kanal kopieras till float32 först.
+        raw = np.frombuffer(data, dtype=self._dtype, count=n * self.fmt.channels)
+        frames = raw.reshape(n, self.fmt.channels)
+        x = self._x[:n]
+        np.copyto(x, frames[:, 0], casting="unsafe")
+        if self.fmt.channels > 1:
+            tmp = self._tmp[:n]
+            for ch in range(1, self.fmt.channels):
+                np.copyto(tmp, frames[:, ch], casting="unsafe")
+                x += tmp
+        x *= self._scale
+
+        # 2) anti-alias-filter med historik från förra chunken
+        if self._h is not None:
+            x = self._fir(x, n)
+
+        # 3) linjär interpolation till ut-frekvensen
+        y = self._interpolate(x, n)
+
+        # 4) tillbaka till PCM16
+        np.multiply(y, np.float32(32767.0), out=y)
+        np.rint(y, out=y)
+        np.minimum(y, np.float32(32767.0), out=y)
+        np.maximum(y, np.float32(-32768.0), out=y)
+        out = self._i16[: len(y)]
+        np.copyto(out, y, casting="unsafe")
+        return out.tobytes()
+
+    # ------------------------------------------------------------------
+
+    def _fir(self, x: np.ndarray, n: int) -> np.ndarray:
+        h, hist = self._h, self._hist
+        k = len(hist)
+        ext = self._ext[: k + n]
+        ext[:k] = hist
+        ext[k:] = x
+        y = self._y[:n]
+        tmp = self._tmp[:n]
+        y.fill(0.0)
+        # Koefficienterna är symmetriska, så ingen omvändning behövs
+        for i, c in enumerate(h):
+            np.multiply(ext[i:i + n], c, out=tmp)
+            y += tmp
+        hist[:] = ext[n:n + k]
+        return y
+
+    def _interpolate(self, x: np.ndarray, n: int) -> np.ndarray:
+        step, t = self._step, self._t
+        if t > n - 1:
+            n_out = 0
+        else:
+            n_out = int(math.floor((n - 1 - t) / step)) + 1
+        # src[0] = sista sampel från förra chunken, src[i + 1] = x[i], plus en utfyllnad
+        src = self._src[: n + 2]
+        src[0] = self._last
+        src[1:n + 1] = x
+        src[n + 1] = x[n - 1]
+        self._last = float(x[n - 1])
+        self._t = t + n_out * step - n
+        if n_out == 0:
+            return self._a[:0]
+
+        pos = self._pos[:n_out]
+        np.multiply(self._ramp[:n_out], step, out=pos)
+        pos += t
+        fl = self._fl[:n_out]
+        np.floor(pos, out=fl)
+        np.subtract(pos, fl, out=pos)            # pos = bråkdel
+        frac = self._frac[:n_out]
+        np.copyto(frac, pos, casting="unsafe")
+        idx = self._idx[:n_out]
+        np.copyto(idx, fl, casting="unsafe")
+        idx += 1
+        a = self._a[:n_out]
+        b = self._b[:n_out]
+        # mode="clip" gör att take skriver direkt till out (index är alltid giltiga)
+        np.take(src, idx, out=a, mode="clip")
+        idx += 1
+        np.take(src, idx, out=b, mode="clip")
+        np.subtract(b, a, out=b)
+        np.multiply(b, frac, out=b)
+        np.add(a, b, out=a)
+        return a
+
+    def _ensure(self, n: int) -> None:
+        if n > self._cap:
+            cap = max(n, 2 * self._cap)
+            k = len(self._hist) if self._hist is not None else 0
+            self._x = np.empty(cap, dtype=np.float32)
+            self._y = np.empty(cap, dtype=np.float32)
+            self._tmp = np.empty(cap, dtype=np.float32)
+            self._ext = np.empty(cap + k, dtype=np.float32)
+            self._src = np.empty(cap + 2, dtype=np.float32)
+            self._cap = cap
+        n_out = int(n / self._step) + 2
+        if n_out > self._cap_out:
+            cap = max(n_out, 2 * self._cap_out)
+            self._ramp = np.arange(cap, dtype=np.float64)
+            self._pos = np.empty(cap, dtype=np.float64)
+            self._fl = np.empty(cap, dtype=np.float64)
+            self._frac = np.empty(cap, dtype=np.float32)
+            self._idx = np.empty(cap, dtype=np.intp)
+            self._a = np.empty(cap, dtype=np.float32)
+            self._b = np.empty(cap, dtype=np.float32)
+            self._i16 = np.empty(cap, dtype=np.int16)
+            self._cap_out = cap
+
+
+def _lowpass(taps: int, cutoff: float) -> np.ndarray:
+    """Fönstrad sinc (Hann). `cutoff` i andelar av insamplingsfrekvensen."""
+    m = np.arange(taps) - (taps - 1) / 2
+    h = 2 * cutoff * np.sinc(2 * cutoff * m) * np.hanning(taps)
+    return (h / h.sum()).astype(np.float32)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+# Realtime-events som bär transkript: typ -> (är final, fält med texten)
+TRANSCRIPT_EVENTS = {
+    "conversation.item.input_audio_transcription.delta": (False, "delta"),
+    "conversation.item.input_audio_transcription.completed": (True, "transcript"),
+    "response.audio_transcript.delta": (False, "delta"),
+    "response.audio_transcript.done": (True, "transcript"),
+    "response.audio_transcript.completed": (True, "transcript"),
+    "response.output_text.delta": (False, "delta"),
+    "response.output_text.done": (True, "text"),
+}
+
+
+class TranscriptUpdate(NamedTuple):
+    item_id: str
+    delta: str      # ny text sedan förra uppdateringen för samma item
+    final: bool
+
+
+class TranscriptAssembler:
+    """Bygger transkript per upstream-`item_id` av delta- och completed-events.
+
+    Texten per item byggs på med varje delta och finns alltid färdig, så
+    en partial med hela texten kostar en kopia av den i stället för en
+    ny hopslagning av alla deltas. Överlappande yttranden från server-VAD får
+    var sitt item och kan inte skriva över varandra. Avslutade items
+    sparas (bara den färdiga texten) i högst `max_finalized` poster, så
+    sena deltas för dem kan ignoreras; pågående items är begränsade till
+    `max_active` – de äldsta släpps om upstream aldrig avslutar dem.
+    """
+
+    def __init__(self, max_finalized: int = 200, max_active: int = 32) -> None:
+        self.max_finalized = max_finalized
+        self.max_active = max_active
+        self._active: "OrderedDict[str, str]" = OrderedDict()   # item_id -> text hittills
+        self._finalized: "OrderedDict[str, str]" = OrderedDict()
+
+    def handle(self, evt: dict) -> Optional[TranscriptUpdate]:
+        """Mata in ett Realtime-event; returnerar en uppdatering om det bar text."""
+        spec = TRANSCRIPT_EVENTS.get(evt.get("type"))
+        if spec is None:
+            return None
+        final, field = spec
+        text = evt.get(field)
+        if final and not isinstance(text, str):
+            # Äldre format: texten ligger i item.content[0].transcript
+            content = (evt.get("item") or {}).get("content") or [{}]
+            text = content[0].get("transcript") if isinstance(content[0], dict) else None
+        item_id = evt.get("item_id") or evt.get("response_id") or ""
+        if final:
+            return self.complete(item_id, text if isinstance(text, str) else None)
+        if not isinstance(text, str) or not text:
+            return None
+        return self.delta(item_id, text)
+
+    def delta(self, item_id: str, piece: str) -> Optional[TranscriptUpdate]:
+        if item_id in self._finalized:
+            return None
+        text = self._active.get(item_id)
+        if text is None:
+            self._active[item_id] = piece
+            if len(self._active) > self.max_active:
+                self._active.popitem(last=False)
+        else:
+            self._active[item_id] = text + piece
+        return TranscriptUpdate(item_id, piece, False)
+
+    def complete(self, item_id: str, transcript: Optional[str]) -> Optional[TranscriptUpdate]:
+        if item_id in self._finalized:
+            return None
+        partial = self._active.pop(item_id, "")
+        text = transcript if transcript is not None else partial
+        if not text:
+            return None
+        self._finalized[item_id] = text
+        if len(self._finalized) > self.max_finalized:
+            self._finalized.popitem(last=False)
+        # Delta = det som inte redan skickats som partial (hela texten om den ändrats)
+        delta = text[len(partial):] if partial and text.startswith(partial) else text
+        return TranscriptUpdate(item_id, delta, True)
+
+    def text(self, item_id: str) -> str:
+        """Aktuell text för ett item (partial eller final)."""
+        if item_id in self._finalized:
+            return self._finalized[item_id]
+        return self._active.get(item_id, "")
+
+    def finalized(self) -> Dict[str, str]:
+        """De senaste avslutade itemen, äldst först."""
+        return dict(self._finalized)
+
+    def active(self) -> Dict[str, str]:
+        """Pågående items och deras text hittills, äldst först."""
+        return dict(self._active)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from typing import List, Tuple
+
+import numpy as np
+
+
+class FrameEnergy:
+    """Energi i dBFS per ram (`frame_ms`) för en PCM16-mono-ström i bitar.
+
+    Rester som inte fyller en hel ram sparas till nästa anrop, så
+    resultatet blir detsamma oavsett hur strömmen delas upp.
+    """
+
+    def __init__(self, sample_rate_hz: int, frame_ms: int = 10) -> None:
+        self.frame = max(1, sample_rate_hz * frame_ms // 1000)
+        self._carry = np.zeros(0, dtype=np.int16)
+        self._parts: List[np.ndarray] = []
+
+    def process(self, pcm16: bytes) -> None:
+        x = np.frombuffer(pcm16, dtype="<i2")
+        if len(self._carry):
+            x = np.concatenate((self._carry, x))
+        n = len(x) // self.frame
+        self._carry = x[n * self.frame:].copy()
+        if n == 0:
+            return
+        frames = x[: n * self.frame].reshape(n, self.frame).astype(np.float32)
+        frames *= np.float32(1.0 / 32768.0)
+        ms = np.einsum("ij,ij->i", frames, frames) / self.frame
+        self._parts.append(10.0 * np.log10(ms + 1e-10))
+
+    def finish(self) -> np.ndarray:
+        if len(self._carry):
+            self.process(np.zeros(self.frame - len(self._carry), dtype="<i2").tobytes())
+        out = np.concatenate(self._parts) if self._parts else np.zeros(0, dtype=np.float32)
+        self._parts = [out]
+        return out
+
+
+def split_at_silence(
+    energy_db: np.ndarray,
+    min_frames: int,
+    max_frames: int,
+    threshold_dbfs: float,
+    min_silence_frames: int,
+) -> List[Tuple[int, int]]:
+    """Dela upp en inspelning i segment (start, slut) i ramar.
+
+    Varje segment blir högst `max_frames` långt. Snittet läggs mitt i den
+    längsta tystnaden (minst `min_silence_frames` ramar under
+    `threshold_dbfs`) mellan `min_frames` och `max_frames` från segmentets
+    start; finns ingen sådan läggs det i den tystaste ramen i fönstret.
+    """
+    n = len(energy_db)
+    max_frames = max(1, max_frames)
+    min_frames = min(max(0, min_frames), max_frames - 1)
+    segments: List[Tuple[int, int]] = []
+    pos = 0
+    while n - pos > max_frames:
+        lo = pos + max(1, min_frames)
+        window = energy_db[lo:pos + max_frames]
+        cut = lo + _best_cut(window, threshold_dbfs, min_silence_frames)
+        segments.append((pos, cut))
+        pos = cut
+    if pos < n:
+        segments.append((pos, n))
+    return segments
+
+
+def _best_cut(window: np.ndarray, threshold_dbfs: float, min_run: int) -> int:
+    quiet = np.concatenate(([False], window < threshold_dbfs, [False]))
+    edges = np.flatnonzero(np.diff(quiet.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    if len(starts):
+        lengths = ends - starts
+        i = int(np.argmax(lengths))
+        if lengths[i] >= max(1, min_run):
+            return int((starts[i] + ends[i]) // 2)
+    return int(np.argmin(window))
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from ..tracing import TRACK_UPSTREAM, SessionTrace, now_ns
+from .commit_scheduler import CommitHandle
+from .queues import BoundedSendQueue, QueueClosed
+from .receive_audio_from_frontend import FormatConverter
+from .vad import VoiceActivityGate
+
+log = logging.getLogger("stt")
+
+SendFn = Callable[[bytes], Awaitable[None]]
+
+# Kontrollpost i upstream-kön: flusha sammanslaget ljud och commit:a
+COMMIT = object()
+
+
+class AudioCoalescer:
+    """Slår ihop små PCM16-chunks från frontend till större ramar upstream.
+
+    Webbläsare skickar ofta 10–20 ms per chunk, vilket ger ett
+    `input_audio_buffer.append` per chunk. Här samlas ljudet tills
+    `target_ms` finns i bufferten. Ligger ljud kvar längre än
+    `max_latency_ms` skickas det ändå, och `flush()` anropas före commit
+    så att inget ljud blir kvar lokalt. `target_ms <= 0` = skicka direkt.
+    """
+
+    def __init__(
+        self,
+        send: SendFn,
+        sample_rate_hz: int,
+        target_ms: int,
+        max_latency_ms: int,
+    ) -> None:
+        self._send = send
+        # PCM16 mono: 2 byte per sampel
+        self.frame_bytes = int(sample_rate_hz * target_ms / 1000) * 2 if target_ms > 0 else 0
+        self.max_latency_s = max(0.001, max_latency_ms / 1000)
+        self._buf = bytearray()
+        self._lock = asyncio.Lock()
+        self._deadline: Optional[asyncio.TimerHandle] = None
+        self._deadline_task: Optional[asyncio.Task] = None
+        self.chunks_in = 0
+        self.frames_out = 0
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._buf)
+
+    async def push(self, chunk: bytes) -> None:
+        self.chunks_in += 1
+        if self.frame_bytes <= 0:
+            async with self._lock:
+                await self._emit(chunk)
+            return
+        async with self._lock:
+            self._buf += chunk
+            if len(self._buf) >= self.frame_bytes:
+                await self._drain()
+            else:
+                self._arm_deadline()
+
+    async def flush(self) -> None:
+        """Skicka allt som ligger i bufferten (t.ex. inför commit)."""
+        async with self._lock:
+            await self._drain()
+
+    def close(self) -> None:
+        self._cancel_deadline()
+        if self._deadline_task and not self._deadline_task.done():
+            self._deadline_task.cancel()
+        self._buf.clear()
+
+    # ------------------------------------------------------------------
+
+    async def _drain(self) -> None:
+        # Skicka bara hela sampel; en ev. udda byte väntar på nästa chunk
+        n = len(self._buf) & ~1
+        self._cancel_deadline()
+        if n == len(self._buf):
+            frame = bytes(self._buf)
+            self._buf.clear()
+            await self._emit(frame)
+        elif n:
+            frame = bytes(self._buf[:n])
+            del self._buf[:n]
+            await self._emit(frame)
+        if len(self._buf) > 1:
+            self._arm_deadline()
+
+    async def _emit(self, frame: bytes) -> None:
+        self.frames_out += 1
+        await self._send(frame)
+
+    def _arm_deadline(self) -> None:
+        if self._deadline is None:
+            loop = asyncio.get_running_loop()
+            self._deadline = loop.call_later(self.max_latency_s, self._on_deadline)
+
+    def _cancel_deadline(self) -> None:
+        if self._deadline is not None:
+            self._deadline.cancel()
+            self._deadline = None
+
+    def _on_deadline(self) -> None:
+        self._deadline = None
+        self._deadline_task = asyncio.create_task(self._flush_on_deadline())
+
+    async def _flush_on_deadline(self) -> None:
+        try:
+            await self.flush()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.error("Fel vid tidsstyrd flush till Realtime: %s", e)
+
+
+async def run_upstream_sender(
+    queue: BoundedSendQueue,
+    coalescer: AudioCoalescer,
+    commit: Callable[[], Awaitable[None]],
+    commits: CommitHandle,
+    converter: Optional[FormatConverter] = None,
+    vad: Optional[VoiceActivityGate] = None,
+    trace: Optional[SessionTrace] = None,
+) -> None:
+    """Konsument: tar ljud från frontend-kön och skickar det upstream.
+
+    Körs som egen task så att en långsam Realtime-anslutning inte
+    blockerar mottagningen från frontend (kön tar smällen i stället).
+    `converter` gör om klientens format till PCM16 mono i upstream-frekvens
+    och med `vad` gallras långa tystnader bort innan sammanslagningen.
+    `COMMIT` i kön flushar sammanslaget ljud och anropar `commit`, så att
+    commit alltid hamnar efter ljudet som köades före den.
+    Med `trace` blir varje post ett steg i tidslinjen (med kötiden).
+    """
+    while True:
+        try:
+            chunk = await queue.get()
+        except QueueClosed:
+            return
+        start = now_ns() if trace is not None else 0
+        if chunk is COMMIT:
+            await coalescer.flush()
+            await commit()
+            if trace is not None:
+                trace.span("flush+commit", TRACK_UPSTREAM, start, {"queue_lag_ms": queue.last_lag_ms})
+            continue
+        n_in = len(chunk)
+        if converter is not None:
+            chunk = converter.process(chunk)
+            if not chunk:
+                continue
+        if vad is not None:
+            chunk = vad.process(chunk)
+            if not chunk:
+                continue
+        commits.note_audio(len(chunk))
+        if trace is not None:
+            trace.span("convert", TRACK_UPSTREAM, start, {"bytes_in": n_in, "bytes_out": len(chunk)})
+            start = now_ns()
+        await coalescer.push(chunk)
+        if trace is not None:
+            trace.span("coalesce", TRACK_UPSTREAM, start, {
+                "pending_bytes": coalescer.pending_bytes, "queue_lag_ms": queue.last_lag_ms,
+            })
@@ -0,0 +1,349 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import struct
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+
+from fastapi import WebSocket
+
+from .. import metrics
+from ..tracing import TRACK_FRONTEND_OUT, SessionTrace, now_ns
+from .queues import BoundedSendQueue, QueueClosed, QueueOverflow
+
+
+class _Partial:
+    """Plats i kön för ett items senaste partial; innehållet kan bytas ut."""
+
+    __slots__ = ("item_id", "payload")
+
+    def __init__(self, item_id: str, payload: Dict[str, Any]) -> None:
+        self.item_id = item_id
+        self.payload = payload
+
+
+def _partial_item(payload: Any) -> str | None:
+    if type(payload) is dict and payload.get("type") == "stt.partial":
+        return payload.get("item_id")
+    return None
+
+
+class OutboundMailbox(BoundedSendQueue):
+    """Utkö till frontend där senaste partial per item vinner.
+
+    En ny `stt.partial` för ett item som redan har en osänd partial i kön
+    ersätter den på samma plats (deltas slås ihop, så klienten tappar ingen
+    text). En final för itemet stryker den väntande partialen. Finals, fel
+    och övriga meddelanden levereras i ordning: med `drop_oldest` kastas
+    bara partials – och deras delta läggs först i itemets nästa meddelande,
+    så text som bara skickas som tillägg (binärt, ren text) aldrig tappas
+    eller hamnar på fel offset. Finns inga partials att kasta när kön är full kastas
+    `QueueOverflow` som med `close` – `maxsize` är en hård gräns även för
+    en klient som är bortkopplad eller för långsam. Konsumenten hämtar allt
+    som hunnit komma in under en tick i taget med `get_batch()`.
+    """
+
+    def __init__(self, name: str, maxsize: int, policy: str = "block") -> None:
+        super().__init__(name, maxsize, policy)
+        self._partials: Dict[str, _Partial] = {}
+        # item_id -> delta från kastade partials, läggs först i itemets nästa meddelande
+        self._carry: Dict[str, str] = {}
+        self.replaced = 0
+
+    async def put(self, item: Any) -> None:
+        if self._replace(item):
+            return
+        await super().put(item)
+
+    def put_nowait(self, item: Any, force: bool = False) -> None:
+        if self._replace(item):
+            return
+        if self._closed:
+            raise QueueClosed(self.name)
+        item_id = _partial_item(item)
+        if item_id is None:
+            self._retire_partial(item)
+        else:
+            item = self._take_carry(item_id, item)
+        if not force and self.policy == "drop_oldest" and len(self._items) >= self.maxsize:
+            if not self._drop_oldest_partial():
+                if item_id is not None:
+                    self._carry_delta(item_id, item)   # följer med itemets nästa meddelande
+                    self.dropped += 1
+                    return
+                # Bara meddelanden som inte får kastas: klienten hänger inte med
+                raise QueueOverflow(self.name)
+            force = True
+        if item_id is not None:
+            slot = _Partial(item_id, item)
+            super().put_nowait(slot, force)
+            self._partials[item_id] = slot
+        else:
+            super().put_nowait(item, force)
+
+    async def get(self) -> Any:
+        while True:
+            item = await super().get()
+            item = self._unwrap(item)
+            if item is not None:
+                return item
+
+    async def get_batch(self) -> List[Any]:
+        """Vänta på minst ett meddelande och hämta allt som finns efter en tick."""
+        while not self._items:
+            if self._closed:
+                raise QueueClosed(self.name)
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        # Låt events som redan är på väg (samma tick) hinna ersätta partials
+        await asyncio.sleep(0)
+        out = []
+        now = time.monotonic()
+        while self._items:
+            enqueued_at, item = self._items.popleft()
+            lag = (now - enqueued_at) * 1000.0
+            self.last_lag_ms = lag
+            if lag > self.max_lag_ms:
+                self.max_lag_ms = lag
+            item = self._unwrap(item)
+            if item is not None:
+                out.append(item)
+        self._not_full.set()
+        return out
+
+    def snapshot(self) -> Dict[str, Any]:
+        snap = super().snapshot()
+        snap["replaced"] = self.replaced
+        return snap
+
+    # ------------------------------------------------------------------
+
+    def _replace(self, item: Any) -> bool:
+        item_id = _partial_item(item)
+        slot = self._partials.get(item_id) if item_id is not None else None
+        if slot is None or self._closed:
+            return False
+        slot.payload = _merge_delta(slot.payload, item)
+        self.replaced += 1
+        return True
+
+    def _retire_partial(self, item: Any) -> None:
+        # En final gör itemets väntande partial överflödig; finalen tar över dess delta
+        if type(item) is not dict or item.get("type") != "stt.final":
+            return
+        item_id = item.get("item_id")
+        pending = self._carry.pop(item_id, "")
+        slot = self._partials.pop(item_id, None)
+        if slot is not None:
+            pending += slot.payload.get("delta") or ""
+            slot.payload = None
+            self.replaced += 1
+        delta = item.get("delta")
+        if pending and isinstance(delta, str) and delta != item.get("text"):
+            item["delta"] = pending + delta
+
+    def _take_carry(self, item_id: str, item: Dict[str, Any]) -> Dict[str, Any]:
+        carry = self._carry.pop(item_id, None)
+        if not carry:
+            return item
+        return _merge_delta({"delta": carry}, item)
+
+    def _carry_delta(self, item_id: str, payload: Dict[str, Any]) -> None:
+        delta = payload.get("delta")
+        if isinstance(delta, str) and delta:
+            self._carry[item_id] = self._carry.get(item_id, "") + delta
+            if len(self._carry) > 64:
+                # Items som aldrig fick en final
+                self._carry.pop(next(iter(self._carry)))
+
+    def _drop_oldest_partial(self) -> bool:
+        for i, (_, item) in enumerate(self._items):
+            if type(item) is _Partial:
+                del self._items[i]
+                if self._partials.get(item.item_id) is item:
+                    del self._partials[item.item_id]
+                if item.payload is not None:
+                    self._carry_delta(item.item_id, item.payload)
+                    self.dropped += 1
+                return True
+        return False
+
+    def _unwrap(self, item: Any) -> Any:
+        if type(item) is not _Partial:
+            return item
+        if self._partials.get(item.item_id) is item:
+            del self._partials[item.item_id]
+        return item.payload
+
+
+def _merge_delta(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    a, b = old.get("delta"), new.get("delta")
+    if isinstance(a, str) and isinstance(b, str):
+        new = dict(new)
+        new["delta"] = a + b
+    return new
+
+
+# --- mode=binary -----------------------------------------------------------
+#
+# Varje binärt WebSocket-meddelande innehåller en eller flera ramar:
+#
+#   typ u8 | item u32 | offset u32 | längd u32 | text (UTF-8, `längd` byte)
+#
+# (big-endian). `item` är ett löpnummer per session; ramen FRAME_ITEM kommer
+# först och bär upstream-item_id som text. `offset` är antal UTF-8-byte i
+# itemets text före den här texten: klienten skär av sin text där och lägger
+# till. För partials är offset alltid hittills mottagen längd (ren append),
+# en final med offset 0 ersätter hela texten.
+
+FRAME_PARTIAL = 1
+FRAME_FINAL = 2
+FRAME_ITEM = 3
+BINARY_PROTOCOL_VERSION = 1
+
+_HEADER = struct.Struct(">BIII")
+
+
+class BinaryFrameEncoder:
+    """Kodar stt.partial/stt.final till binära ramar; håller state per item.
+
+    State för ett item släpps vid dess final. Items som aldrig får någon
+    (transkriberingen misslyckades) begränsas till `max_items`, de minst
+    nyligen använda släpps först. Kommer det ändå mer text för ett släppt
+    item får det ett nytt löpnummer och börjar om från offset 0.
+    """
+
+    def __init__(self, max_items: int = 64) -> None:
+        self.max_items = max_items
+        # item_id -> (löpnummer, byte skickade hittills), minst nyligen använda först
+        self._items: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        self._next = 0
+
+    def encode(self, msg: Dict[str, Any], out: bytearray) -> bool:
+        """Lägg ramar för `msg` i `out`; False om det inte är ett transkript."""
+        t = msg.get("type")
+        if t == "stt.partial":
+            final = False
+        elif t == "stt.final":
+            final = True
+        else:
+            return False
+        item_id = msg.get("item_id") or ""
+        state = self._items.get(item_id)
+        if state is None:
+            idx = self._next
+            self._next = (self._next + 1) & 0xFFFFFFFF
+            raw_id = item_id.encode()
+            out += _HEADER.pack(FRAME_ITEM, idx, 0, len(raw_id))
+            out += raw_id
+            sent = 0
+        else:
+            idx, sent = state
+        delta = msg.get("delta") or ""
+        if final and not sent and isinstance(msg.get("text"), str):
+            delta = msg["text"]   # nytt löpnummer (t.ex. släppt state): hela texten
+        offset = sent
+        if final and delta == msg.get("text") and sent:
+            offset = 0  # texten har ändrats sedan partialen: ersätt allt
+        data = delta.encode()
+        out += _HEADER.pack(FRAME_FINAL if final else FRAME_PARTIAL, idx, offset, len(data))
+        out += data
+        if final:
+            self._items.pop(item_id, None)
+        else:
+            self._items[item_id] = (idx, offset + len(data))
+            self._items.move_to_end(item_id)
+            if len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return True
+
+
+class ReplayBuffer:
+    """De senast skickade meddelandena, så som de gick ut på tråden.
+
+    Varje meddelande från `run_frontend_sender` får ett löpnummer (`seq`,
+    med i JSON-meddelanden, annars = ordningsnummer bland mottagna
+    meddelanden). Vid återanslutning skickas allt efter klientens senaste
+    `seq` igen, så länge det finns kvar i bufferten.
+    """
+
+    def __init__(self, maxlen: int) -> None:
+        self._items: Deque[Tuple[int, Union[str, bytes]]] = deque(maxlen=max(1, maxlen))
+        self.seq = 0
+
+    def record(self, data: Union[str, bytes]) -> None:
+        self.seq += 1
+        self._items.append((self.seq, data))
+
+    def since(self, last_seq: int) -> Tuple[List[Union[str, bytes]], bool]:
+        """Meddelanden efter `last_seq`, och om några hann falla ur bufferten."""
+        out = [data for seq, data in self._items if seq > last_seq]
+        oldest = self._items[0][0] if self._items else self.seq + 1
+        return out, last_seq + 1 < oldest and last_seq < self.seq
+
+
+async def run_frontend_sender(
+    ws: WebSocket,
+    queue: BoundedSendQueue,
+    encoder: Optional[BinaryFrameEncoder] = None,
+    replay: Optional[ReplayBuffer] = None,
+    trace: Optional[SessionTrace] = None,
+    plain_text: bool = False,
+) -> None:
+    """Konsument: skickar köade meddelanden till frontend.
+
+    dict skickas som JSON, str som ren text; med `plain_text` (mode=text)
+    skickas transkriptens `delta` som ren text i stället. En långsam klient fyller bara
+    sin egen kö och stoppar inte läsningen från Realtime. Med en
+    `OutboundMailbox` skickas allt som samlats under en tick i ett svep,
+    och med `encoder` (mode=binary) packas transkripten i den svepen i ett
+    enda binärt meddelande; övriga meddelanden går som JSON i ordning.
+    Med `replay` numreras och sparas hela svepen innan något av det
+    skickas – avbryts sändningen halvvägs (avbrott, detach) finns resten
+    kvar för en återansluten klient. Med `trace` blir varje send ett steg
+    i tidslinjen.
+    """
+    batched = isinstance(queue, OutboundMailbox)
+
+    while True:
+        try:
+            batch = await queue.get_batch() if batched else [await queue.get()]
+        except QueueClosed:
+            return
+        wire: List[Union[str, bytes]] = []
+
+        def emit(data: Union[str, bytes]) -> None:
+            if replay is not None:
+                replay.record(data)
+            wire.append(data)
+
+        frames = bytearray()
+        for payload in batch:
+            if encoder is not None and type(payload) is dict and encoder.encode(payload, frames):
+                continue
+            if frames:
+                emit(bytes(frames))
+                frames.clear()
+            if isinstance(payload, str):
+                emit(payload)
+            elif plain_text:
+                if payload.get("delta"):
+                    emit(payload["delta"])
+            else:
+                if replay is not None:
+                    payload["seq"] = replay.seq + 1
+                emit(json.dumps(payload, separators=(",", ":"), ensure_ascii=False))
+        if frames:
+            emit(bytes(frames))
+
+        for data in wire:
+            start = now_ns() if trace is not None else 0
+            if isinstance(data, str):
+                await ws.send_text(data)
+            else:
+                await ws.send_bytes(data)
+            if trace is not None:
+                trace.span("frontend.send", TRACK_FRONTEND_OUT, start, {"bytes": len(data), "queue_lag_ms": queue.last_lag_ms})
+        metrics.FRONTEND_MESSAGES_OUT.inc(len(batch))
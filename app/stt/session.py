@@ -0,0 +1,537 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+
+from .. import metrics
+from ..admission import Ticket, admission
+from ..config import settings
+from ..debug_store import SessionBuffers, store
+from ..realtime_client import OpenAIRealtimeClient
+from ..realtime_codec import EventDispatcher
+from ..recording import SessionRecording
+from ..transcript_cache import transcript_cache
+from ..tracing import TRACK_FRONTEND_IN, TRACK_REALTIME, TRACK_UPSTREAM, TRACK_UTTERANCE, SessionTrace, now_ns
+from .broadcast import Subscriber, TranscriptBroadcast
+from .commit_scheduler import scheduler as commit_scheduler
+from .queues import BoundedSendQueue, QueueClosed, QueueOverflow
+from .receive_audio_from_frontend import AudioFormat, FormatConverter
+from .receive_text_from_realtime import TRANSCRIPT_EVENTS, TranscriptAssembler, TranscriptUpdate
+from .send_audio_to_realtime import COMMIT, AudioCoalescer, run_upstream_sender
+from .send_text_to_frontend import BinaryFrameEncoder, OutboundMailbox, ReplayBuffer, run_frontend_sender
+from .vad import VoiceActivityGate
+
+log = logging.getLogger("stt")
+
+
+class TranscribeSession:
+    """Allt i en /ws/transcribe-session som ska överleva ett frontend-avbrott.
+
+    Upstream-klienten, köerna, transkripten och commit-platsen lever så
+    länge sessionen lever. Frontend-WebSocketen kopplas på med `attach()`
+    och av med `detach()`; däremellan fortsätter transkript från
+    Realtime att samlas i utkön, och skickade meddelanden finns kvar i
+    `replay` så att en återansluten klient kan ta igen det den missat.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        mode: str,
+        audio_in: AudioFormat,
+        rt: OpenAIRealtimeClient,
+        buffers: SessionBuffers,
+        recording: Optional[SessionRecording] = None,
+        ticket: Optional[Ticket] = None,
+        trace: Optional[SessionTrace] = None,
+        resume_token: Optional[str] = None,
+    ) -> None:
+        self.session_id = session_id
+        # Hemlig, till skillnad från session_id (som räcker för /ws/subscribe)
+        self.resume_token = resume_token
+        self.mode = mode
+        self.binary = (mode == "binary")
+        self.send_json = self.binary or (mode == "json")  # kontrollmeddelanden går som JSON i båda
+        self.audio_in = audio_in
+        self.rt = rt
+        self.buffers = buffers
+        self.recording = recording
+        self.ticket = ticket  # platsen från antagningen, lämnas tillbaka i close()
+        # Tidslinje (None = spåras inte; varje steg kollar det först)
+        self.trace = trace
+        rt.trace = trace
+        rt.handover = self._handover
+        buffers.probes["upstream"] = rt.recovery.as_dict
+        self._configured = False   # session.updated kommer igen efter en återanslutning
+        self.ws: Optional[WebSocket] = None
+        self.closed = False
+        self._failed = False
+        self.detached_at: Optional[float] = None
+        self._attach_gen = 0
+        self._expiry: Optional[asyncio.TimerHandle] = None
+        self._frontend_task: Optional[asyncio.Task] = None
+
+        self.converter = FormatConverter(audio_in, settings.upstream_sample_rate_hz)
+
+        # Samla små frontend-chunks till större ramar innan de går upstream
+        self.coalescer = AudioCoalescer(
+            self._send_upstream,
+            sample_rate_hz=settings.upstream_sample_rate_hz,
+            target_ms=settings.audio_coalesce_ms,
+            max_latency_ms=settings.audio_coalesce_max_latency_ms,
+        )
+
+        # Valfri lokal VAD: långa tystnader skickas aldrig upstream
+        self.vad = None
+        if settings.vad_enabled:
+            self.vad = VoiceActivityGate(
+                sample_rate_hz=settings.upstream_sample_rate_hz,
+                frame_ms=settings.vad_frame_ms,
+                threshold_dbfs=settings.vad_threshold_dbfs,
+                zcr_max=settings.vad_zcr_max,
+                hangover_ms=settings.vad_hangover_ms,
+                prefix_padding_ms=settings.vad_prefix_padding_ms,
+            )
+            buffers.probes["vad"] = self.vad.snapshot
+
+        # Frikopplade steg: frontend -> upstream_q -> Realtime, Realtime -> frontend_q -> frontend
+        self.upstream_q = BoundedSendQueue("upstream", settings.upstream_queue_max, settings.upstream_queue_policy)
+        self.frontend_q = OutboundMailbox("frontend", settings.frontend_queue_max, settings.frontend_queue_policy)
+        buffers.probes["upstream_queue"] = self.upstream_q.snapshot
+        buffers.probes["frontend_queue"] = self.frontend_q.snapshot
+
+        # Kodaren har state per item och följer sessionen, inte anslutningen
+        self.encoder = BinaryFrameEncoder() if self.binary else None
+        self.replay = ReplayBuffer(settings.session_replay_max_messages)
+
+        # Commits styrs av den processgemensamma schemaläggaren, som lägger en
+        # COMMIT-post i upstream-kön när tillräckligt med ljud har buffrats.
+        # Med server-VAD delar upstream vid tystnad och timern är bara reserv
+        self.commits = commit_scheduler.register(
+            lambda: self.upstream_q.put_nowait(COMMIT, force=True),
+            bytes_per_ms=settings.upstream_sample_rate_hz * 2 / 1000,
+            min_audio_ms=settings.commit_vad_fallback_ms if rt.server_vad else None,
+        )
+        buffers.probes["commits"] = self.commits.snapshot
+
+        # Transkript per upstream-item (deltas + completed)
+        self.transcripts = TranscriptAssembler(max_finalized=settings.transcript_max_finalized_items)
+
+        # Läsande prenumeranter (/ws/subscribe) får samma transkript som JSON
+        self.subscribers = TranscriptBroadcast(
+            settings.subscribe_max_per_session, settings.subscribe_queue_max, settings.subscribe_queue_policy
+        )
+        buffers.probes["subscribers"] = self.subscribers.snapshot
+
+        # Latens per yttrande: från första ljud till första partial resp. final
+        self.utterance_started: Optional[float] = None
+        self.partial_sent = False
+
+        # Realtime-events: bara typerna med en hanterare parsas
+        self.events = EventDispatcher(self._observe_rt_event)
+        self.events.on("error", self._on_rt_error)
+        self.events.on("session.updated", self._on_session_updated)
+        self.events.on("rate_limits.updated", self._on_rate_limits)
+        for event_type in TRANSCRIPT_EVENTS:
+            self.events.on(event_type, self._on_transcript)
+
+        # Valfri transkriptcache, nyckel = ljudet i ett commit:at item. Commits
+        # på timer stängs av så att upstreams server-VAD bestämmer itemen: ett
+        # item blir ett yttrande, och samma fras ger samma ljud. Vid träff går
+        # final ut direkt och upstreams transkript för itemet ignoreras; vid
+        # miss sparas det när det kommer
+        self._cache_context: Optional[str] = None
+        self._cache_keys: "OrderedDict[str, str]" = OrderedDict()     # item_id -> nyckel (miss)
+        self._cache_hits: "OrderedDict[str, float]" = OrderedDict()   # item_id -> tid för träffen
+        if transcript_cache.enabled and rt.server_vad and rt.unacked is not None:
+            self._cache_context = f"{rt.transcribe_model}|{rt.language}|{settings.upstream_sample_rate_hz}"
+            self.commits.close()
+        self.events.on("input_audio_buffer.committed", self._on_committed)
+
+        self._rt_recv_task = asyncio.create_task(rt.recv_loop(self.events))
+        self._upstream_task = asyncio.create_task(self._run_stage(
+            run_upstream_sender(
+                self.upstream_q, self.coalescer, self._commit_upstream, self.commits, self.converter, self.vad,
+                trace,
+            ),
+            "upstream_sender",
+        ))
+        metrics.ACTIVE_SESSIONS.inc()
+
+    # --- frontend-anslutningen ---------------------------------------------
+
+    @property
+    def attached(self) -> bool:
+        return self.ws is not None
+
+    def can_resume(self, token: str) -> bool:
+        return self.resume_token is not None and hmac.compare_digest(self.resume_token, token)
+
+    async def attach(self, ws: WebSocket, last_seq: Optional[int] = None) -> int:
+        """Koppla på en (ny) frontend. Returnerar ett id för `detach()`.
+
+        Med `last_seq` skickas först allt i replay-bufferten efter det.
+        En tidigare anslutning som fortfarande hänger kvar kopplas bort.
+        """
+        self._cancel_expiry()
+        old_ws, old_task = self.ws, self._frontend_task
+        self._attach_gen += 1
+        self.ws = ws
+        self.detached_at = None
+        if old_task is not None:
+            old_task.cancel()
+            await asyncio.gather(old_task, return_exceptions=True)
+        if old_ws is not None and old_ws is not ws:
+            await _close_ws(old_ws, 4001, "resumed_elsewhere")
+
+        if last_seq is not None:
+            missed, gap = self.replay.since(last_seq)
+            if self.send_json:
+                await ws.send_json({
+                    "type": "session.resumed",
+                    "session_id": self.session_id,
+                    "seq": self.replay.seq,
+                    "replayed": len(missed),
+                    "gap": gap,
+                })
+            for data in missed:
+                if isinstance(data, str):
+                    await ws.send_text(data)
+                else:
+                    await ws.send_bytes(data)
+
+        self._frontend_task = asyncio.create_task(self._run_frontend(ws))
+        return self._attach_gen
+
+    def detach(self, gen: int) -> None:
+        """Frontend försvann. Sessionen lever vidare i `session_resume_grace_s`, sedan stängs den."""
+        if gen != self._attach_gen or self.closed or self._failed:
+            return  # övertagen av en nyare anslutning, eller redan på väg att stängas
+        self.ws = None
+        self.detached_at = time.monotonic()
+        if self._frontend_task is not None:
+            self._frontend_task.cancel()
+            self._frontend_task = None
+        grace = settings.session_resume_grace_s
+        loop = asyncio.get_running_loop()
+        self._expiry = loop.call_later(grace, lambda: asyncio.create_task(self.close()))
+
+    def _cancel_expiry(self) -> None:
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+    def subscribe(self) -> Optional[Subscriber]:
+        """Ny läsande prenumerant, med det som hittills transkriberats först i kön.
+
+        None om sessionen redan har så många prenumeranter som tillåts.
+        """
+        return self.subscribers.add({
+            "type": "subscribed",
+            "session_id": self.session_id,
+            "finalized": [{"item_id": i, "text": t} for i, t in self.transcripts.finalized().items()],
+            "partials": [{"item_id": i, "text": t} for i, t in self.transcripts.active().items()],
+        })
+
+    # --- flöden --------------------------------------------------------------
+
+    async def feed(self, chunk: bytes) -> bool:
+        """Ljud från frontend. False om sessionen ska avslutas."""
+        self.buffers.frontend_chunks.append(len(chunk))
+        metrics.FRONTEND_BYTES_IN.inc(len(chunk))
+        if self.recording is not None:
+            self.recording.audio(chunk)
+        if self.trace is not None:
+            self.trace.instant("frontend.recv", TRACK_FRONTEND_IN, {"bytes": len(chunk)})
+        if self.utterance_started is None:
+            self.utterance_started = time.monotonic()
+        try:
+            await self.upstream_q.put(chunk)
+        except QueueClosed:
+            return False
+        except QueueOverflow:
+            log.warning("Upstream-kön full, stänger session %s", self.session_id)
+            await self.fail(1013, "upstream_queue_overflow")
+            return False
+        return True
+
+    async def to_frontend(self, payload) -> None:
+        if self.recording is not None:
+            # Kopia: utkön kan ändra meddelandet (seq, sammanslagna deltas)
+            self.recording.event("out", dict(payload) if type(payload) is dict else payload)
+        try:
+            await self.frontend_q.put(payload)
+        except QueueClosed:
+            pass
+        except QueueOverflow:
+            log.warning("Frontend-kön full, stänger session %s", self.session_id)
+            await self.fail(1013, "frontend_queue_overflow")
+
+    def _handover(self, rt: OpenAIRealtimeClient) -> None:
+        # Återanslutning via poolen: en ny klient har tagit över upstream-sessionen
+        self.rt = rt
+
+    async def _send_upstream(self, frame: bytes) -> None:
+        trace = self.trace
+        start = now_ns() if trace is not None else 0
+        await self.rt.send_audio_chunk(frame)
+        if trace is not None:
+            trace.span("upstream.send", TRACK_UPSTREAM, start, {"bytes": len(frame)})
+        self.buffers.openai_chunks.append(len(frame))
+        metrics.UPSTREAM_BYTES_OUT.inc(len(frame))
+
+    async def _commit_upstream(self) -> None:
+        trace = self.trace
+        start = now_ns() if trace is not None else 0
+        await self.rt.commit()
+        if trace is not None:
+            trace.span("commit", TRACK_UPSTREAM, start)
+        metrics.COMMITS.inc()
+        if self.recording is not None:
+            self.recording.event("commit")
+
+    async def _run_frontend(self, ws: WebSocket) -> None:
+        try:
+            await run_frontend_sender(
+                ws, self.frontend_q, self.encoder, self.replay, self.trace, plain_text=not self.send_json
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Oftast ett avbrott; mottagningsloopen märker det och kopplar bort
+            log.info("Frontend-sändning avbröts (%s): %s", self.session_id, e)
+
+    async def _run_stage(self, coro, name: str) -> None:
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("%s avbröts (%s): %s", name, self.session_id, e)
+            await self.fail(1011, f"{name}_failed")
+
+    # --- events från Realtime --------------------------------------------------
+
+    def _observe_rt_event(self, t: str, raw) -> None:
+        # Alla events, även de som aldrig parsas: räkna, logga typen, spela in
+        metrics.UPSTREAM_EVENTS.labels(metrics.upstream_event_label(t)).inc()
+        self.buffers.rt_events.append(t)
+        if self.recording is not None:
+            self.recording.raw_event("rt", raw)
+        if self.trace is not None:
+            self.trace.instant(t, TRACK_REALTIME, {"bytes": len(raw)})
+
+    async def _on_rt_error(self, evt: dict) -> None:
+        # Bubbla upp till klienten (syns i browser-konsol)
+        detail = evt.get("error", evt)
+        if isinstance(detail, dict) and detail.get("code") == "input_audio_buffer_commit_empty":
+            # Väntat läge (t.ex. server-VAD hann commit:a först) – glesa ut commits
+            self.commits.note_empty_commit()
+            log.debug("Tom commit (%s): %s", self.session_id, detail.get("message"))
+            return
+        metrics.ERRORS.labels("realtime_error").inc()
+        if self.send_json:
+            await self.to_frontend({"type": "error", "reason": "realtime_error", "detail": detail})
+
+    async def _on_session_updated(self, evt: dict) -> None:
+        if self._configured:
+            return
+        self._configured = True
+        if self.send_json:
+            await self.to_frontend({"type": "info", "msg": "realtime_connected_and_configured"})
+
+    async def _on_rate_limits(self, evt: dict) -> None:
+        # Gränserna gäller API-nyckeln, dvs. alla sessioner i processen
+        admission.note_rate_limits(evt.get("rate_limits"))
+
+    async def _on_committed(self, evt: dict) -> None:
+        self.commits.note_committed()
+        if self._cache_context is None:
+            return
+        item_id = evt.get("item_id")
+        audio = self.rt.item_audio(item_id) if isinstance(item_id, str) else None
+        if audio is None:
+            return
+        hasher = transcript_cache.new_hasher(self._cache_context)
+        for piece in audio:
+            hasher.update(piece)
+        key = hasher.digest()
+        if key is None:
+            return
+        text = await transcript_cache.get(key)
+        if text is None:
+            _remember(self._cache_keys, item_id, key)
+            return
+        _remember(self._cache_hits, item_id, time.monotonic())
+        if self.trace is not None:
+            self.trace.instant("transcript_cache.hit", TRACK_REALTIME, {"item_id": item_id})
+        if self.recording is not None:
+            self.recording.event("cache_hit", {"item_id": item_id, "key": key})
+        # Itemet räknas som klart: sena deltas och completed från upstream ignoreras
+        update = self.transcripts.complete(item_id, text)
+        if update is not None:
+            await self._emit_transcript(update)
+
+    async def _on_transcript(self, evt: dict) -> None:
+        # Transkript-events (deltas och completed), per item
+        if self._cache_hits and TRANSCRIPT_EVENTS[evt.get("type")][0]:
+            hit_at = self._cache_hits.pop(evt.get("item_id"), None)
+            if hit_at is not None:
+                # Upstreams eget transkript: så mycket tidigare kom finalen ur cachen
+                transcript_cache.note_saved(time.monotonic() - hit_at)
+        update = self.transcripts.handle(evt)
+        if update is None:
+            return
+        if update.final and self._cache_keys:
+            key = self._cache_keys.pop(update.item_id, None)
+            if key is not None:
+                transcript_cache.put(key, self.transcripts.text(update.item_id))
+        await self._emit_transcript(update)
+
+    async def _emit_transcript(self, update: TranscriptUpdate) -> None:
+        buffers = self.buffers
+        buffers.openai_text.append(update.delta)
+        trace = self.trace
+        if self.utterance_started is not None:
+            elapsed = time.monotonic() - self.utterance_started
+            if update.final:
+                metrics.FINAL.observe(elapsed)
+                if trace is not None:
+                    # Hela yttrandet: från första ljudet till final
+                    start = int(self.utterance_started * 1e9)
+                    trace.span("utterance", TRACK_UTTERANCE, start, {"item_id": update.item_id})
+                self.utterance_started = None
+                self.partial_sent = False
+            elif not self.partial_sent:
+                metrics.FIRST_PARTIAL.observe(elapsed)
+                if trace is not None:
+                    trace.instant("first_partial", TRACK_UTTERANCE, {"item_id": update.item_id})
+                self.partial_sent = True
+
+        text = self.transcripts.text(update.item_id)
+        if self.subscribers:
+            self.subscribers.publish({
+                "type": "stt.final" if update.final else "stt.partial",
+                "item_id": update.item_id,
+                "text": text,
+            })
+
+        # Köas även när frontend är bortkopplad; skickas vid återanslutning
+        if self.binary and not update.final:
+            # Bara den tillagda texten
+            await self.to_frontend({"type": "stt.partial", "item_id": update.item_id, "delta": update.delta})
+        elif self.send_json:
+            await self.to_frontend({
+                "type": "stt.final" if update.final else "stt.partial",
+                "item_id": update.item_id,
+                "text": text,
+                "delta": update.delta,
+            })
+        elif update.delta:
+            # Fallback: ren text. Köas som dict så att partials kan slås ihop i utkön
+            await self.to_frontend({
+                "type": "stt.final" if update.final else "stt.partial",
+                "item_id": update.item_id,
+                "delta": update.delta,
+            })
+        buffers.frontend_text.append(update.delta)
+
+    # --- nedstängning ----------------------------------------------------------
+
+    async def fail(self, code: int, reason: str) -> None:
+        """Fel som inte går att återhämta: stäng frontend och hela sessionen."""
+        metrics.ERRORS.labels(reason).inc()
+        self._failed = True
+        self.upstream_q.close()
+        self.frontend_q.close()
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            await _close_ws(ws, code, reason)
+        asyncio.create_task(self.close())
+
+    async def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self._cancel_expiry()
+        registry.remove(self)
+        metrics.ACTIVE_SESSIONS.dec()
+        if self.ticket is not None:
+            self.ticket.release()
+        self.upstream_q.close()
+        self.frontend_q.close()
+        self.coalescer.close()
+        self.commits.close()
+        self.subscribers.close({"type": "session.ended", "session_id": self.session_id})
+        if self.recording is not None:
+            self.recording.close()
+        tasks = [t for t in (self._rt_recv_task, self._upstream_task, self._frontend_task) if t is not None]
+        current = asyncio.current_task()
+        tasks = [t for t in tasks if t is not current]
+        for t in tasks:
+            t.cancel()
+        try:
+            await self.rt.close()
+        except Exception:
+            pass
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Först nu har loopens sista steg (t.ex. avbrutna sends) skrivits
+        if self.trace is not None:
+            self.trace.close()
+        store.close_session(self.session_id)
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            await _close_ws(ws, 1000, "")
+
+
+def _remember(d: "OrderedDict[str, object]", key: str, value: object, max_items: int = 64) -> None:
+    d[key] = value
+    if len(d) > max_items:
+        d.popitem(last=False)
+
+
+async def _close_ws(ws: WebSocket, code: int, reason: str) -> None:
+    if ws.application_state == WebSocketState.CONNECTED:
+        try:
+            await ws.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+
+class SessionRegistry:
+    """Pågående sessioner i processen, så att en frontend kan återansluta."""
+
+    def __init__(self) -> None:
+        self._sessions: Dict[str, TranscribeSession] = {}
+
+    def add(self, session: TranscribeSession) -> None:
+        self._sessions[session.session_id] = session
+
+    def get(self, session_id: str) -> Optional[TranscribeSession]:
+        s = self._sessions.get(session_id)
+        return s if s is not None and not s.closed else None
+
+    def remove(self, session: TranscribeSession) -> None:
+        if self._sessions.get(session.session_id) is session:
+            del self._sessions[session.session_id]
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def snapshot(self) -> Dict[str, int]:
+        detached = sum(1 for s in self._sessions.values() if not s.attached)
+        subscribers = sum(len(s.subscribers) for s in self._sessions.values())
+        return {"sessions": len(self._sessions), "detached": detached, "subscribers": subscribers}
+
+    async def close_all(self) -> None:
+        await asyncio.gather(*(s.close() for s in list(self._sessions.values())), return_exceptions=True)
+
+
+registry = SessionRegistry()
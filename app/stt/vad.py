@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from collections import deque
+from typing import Any, Deque, Dict
+
+import numpy as np
+
+
+class VoiceActivityGate:
+    """Lokal VAD som gallrar bort långa tystnader innan ljudet går upstream.
+
+    Ljudet delas i ramar om `frame_ms`. För alla ramar i en chunk räknas
+    energi (dBFS) och zero-crossing-rate ut på en gång med NumPy. En ram
+    räknas som tal om energin ligger över `threshold_dbfs` och ZCR under
+    `zcr_max` (brus/väsljud har hög ZCR men låg energi).
+
+    - `hangover_ms`: så länge skickas ljud vidare efter sista talramen,
+      så att slutet på ord inte klipps och server-VAD hinner se tystnad.
+    - `prefix_padding_ms`: så mycket tystnad före talstart hålls kvar och
+      skickas tillsammans med första talramen.
+
+    Ramar som faller ur prefix-bufferten kastas och räknas i `suppressed_ms`.
+    """
+
+    def __init__(
+        self,
+        sample_rate_hz: int,
+        frame_ms: int = 10,
+        threshold_dbfs: float = -45.0,
+        zcr_max: float = 0.35,
+        hangover_ms: int = 600,
+        prefix_padding_ms: int = 300,
+    ) -> None:
+        self.frame_ms = frame_ms
+        self.frame_samples = max(1, sample_rate_hz * frame_ms // 1000)
+        self.frame_bytes = self.frame_samples * 2
+        self.threshold_dbfs = threshold_dbfs
+        self.zcr_max = zcr_max
+        self.hangover_frames = max(0, hangover_ms // frame_ms)
+        self._prefix: Deque[bytes] = deque(maxlen=max(0, prefix_padding_ms // frame_ms))
+        self._carry = b""
+        self._hang = 0
+        self.in_speech = False
+        self.passed_ms = 0
+        self.suppressed_ms = 0
+
+    def process(self, chunk: bytes) -> bytes:
+        """Returnera det som ska skickas upstream (kan vara b"")."""
+        data = self._carry + chunk if self._carry else chunk
+        n_frames = len(data) // self.frame_bytes
+        used = n_frames * self.frame_bytes
+        self._carry = data[used:]
+        if n_frames == 0:
+            return b""
+
+        speech = self._classify(data, n_frames)
+        fb = self.frame_bytes
+        out = []
+        for i, is_speech in enumerate(speech.tolist()):
+            frame = data[i * fb:(i + 1) * fb]
+            if is_speech:
+                self._hang = self.hangover_frames
+                if not self.in_speech:
+                    self.in_speech = True
+                    out.extend(self._prefix)
+                    self.passed_ms += len(self._prefix) * self.frame_ms
+                    self._prefix.clear()
+                out.append(frame)
+                self.passed_ms += self.frame_ms
+            elif self._hang > 0:
+                self._hang -= 1
+                out.append(frame)
+                self.passed_ms += self.frame_ms
+            else:
+                self.in_speech = False
+                if self._prefix.maxlen == 0 or len(self._prefix) == self._prefix.maxlen:
+                    self.suppressed_ms += self.frame_ms
+                if self._prefix.maxlen:
+                    self._prefix.append(frame)
+        return b"".join(out)
+
+    def _classify(self, data: bytes, n_frames: int) -> np.ndarray:
+        x = np.frombuffer(data, dtype="<i2", count=n_frames * self.frame_samples)
+        x = x.reshape(n_frames, self.frame_samples).astype(np.float32)
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        dbfs = 20.0 * np.log10(rms / 32768.0 + 1e-9)
+        signs = np.signbit(x)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / self.frame_samples
+        return (dbfs > self.threshold_dbfs) & (zcr < self.zcr_max)
+
+    def snapshot(self) -> Dict[str, Any]:
+        total = self.passed_ms + self.suppressed_ms
+        return {
+            "in_speech": self.in_speech,
+            "passed_ms": self.passed_ms,
+            "suppressed_ms": self.suppressed_ms,
+            "suppressed_ratio": (self.suppressed_ms / total) if total else 0.0,
+        }
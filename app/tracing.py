@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+
+log = logging.getLogger("stt")
+
+# Spår (tid) i tidslinjen, ett per steg i sessionen
+TRACK_FRONTEND_IN = 1
+TRACK_UPSTREAM = 2
+TRACK_REALTIME = 3
+TRACK_FRONTEND_OUT = 4
+TRACK_UTTERANCE = 5
+TRACK_NAMES = {
+    TRACK_FRONTEND_IN: "frontend in",
+    TRACK_UPSTREAM: "upstream (sammanslagning, kodning, send, commit)",
+    TRACK_REALTIME: "Realtime-events",
+    TRACK_FRONTEND_OUT: "frontend ut",
+    TRACK_UTTERANCE: "yttranden",
+}
+
+now_ns = time.monotonic_ns
+
+
+class SessionTrace:
+    """Tidslinje för en session, i Chrome trace-event-format (Perfetto).
+
+    Posterna sparas som tupler och blir JSON först vid export, i
+    skrivtråden. Tider är `time.monotonic_ns()`. Anroparen håller en
+    referens som är None när sessionen inte spåras, och kollar den före
+    varje anrop – avstängd spårning kostar bara den jämförelsen.
+    """
+
+    __slots__ = ("session_id", "t0_ns", "max_events", "events", "dropped", "_tracer")
+
+    def __init__(self, tracer: Tracer, session_id: str, max_events: int) -> None:
+        self._tracer = tracer
+        self.session_id = session_id
+        self.t0_ns = now_ns()
+        self.max_events = max_events
+        # (fas, namn, spår, start_ns, längd_ns, args)
+        self.events: List[Tuple[str, str, int, int, int, Optional[Dict[str, Any]]]] = []
+        self.dropped = 0
+
+    def instant(self, name: str, track: int, args: Optional[Dict[str, Any]] = None) -> None:
+        if len(self.events) < self.max_events:
+            self.events.append(("i", name, track, now_ns(), 0, args))
+        else:
+            self.dropped += 1
+
+    def span(self, name: str, track: int, start_ns: int, args: Optional[Dict[str, Any]] = None) -> None:
+        """Ett steg som började vid `start_ns` och slutar nu."""
+        if len(self.events) < self.max_events:
+            self.events.append(("X", name, track, start_ns, now_ns() - start_ns, args))
+        else:
+            self.dropped += 1
+
+    def close(self) -> None:
+        self._tracer._export(self)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        t0 = self.t0_ns
+        pid = 1
+        out: List[Dict[str, Any]] = [
+            {"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": f"session {self.session_id}"}}
+        ]
+        for track, name in TRACK_NAMES.items():
+            out.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": track, "args": {"name": name}})
+            out.append({"ph": "M", "name": "thread_sort_index", "pid": pid, "tid": track, "args": {"sort_index": track}})
+        for ph, name, track, start, dur, args in self.events:
+            e: Dict[str, Any] = {"ph": ph, "name": name, "pid": pid, "tid": track, "ts": (start - t0) / 1000.0}
+            if ph == "X":
+                e["dur"] = dur / 1000.0
+            else:
+                e["s"] = "t"
+            if args:
+                e["args"] = args
+            out.append(e)
+        return {
+            "traceEvents": out,
+            "displayTimeUnit": "ms",
+            "otherData": {"session_id": self.session_id, "dropped_events": self.dropped},
+        }
+
+
+class Tracer:
+    """Opt-in, samplad spårning av sessioner till `directory/<session_id>.trace.json`.
+
+    Filerna skrivs av en bakgrundstråd när sessionen stängs; högst
+    `max_files` sparas (de äldsta tas bort först). Öppna dem i
+    https://ui.perfetto.dev eller chrome://tracing.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        enabled: bool = False,
+        sample_rate: float = 1.0,
+        max_events: int = 200_000,
+        max_files: int = 1000,
+    ) -> None:
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_events = max_events
+        self.max_files = max_files
+        self._queue: "queue.SimpleQueue[Optional[SessionTrace]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.traced = 0
+        self.written = 0
+
+    def start_session(self, session_id: str, force: bool = False) -> Optional[SessionTrace]:
+        """Ny tidslinje för sessionen, eller None om den inte ska spåras.
+
+        `force` (klienten bad om `?trace=1`) går förbi samplingen, men bara
+        när spårning är påslagen.
+        """
+        if not self.enabled or not (force or random.random() < self.sample_rate):
+            return None
+        self.traced += 1
+        return SessionTrace(self, session_id, self.max_events)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "traced": self.traced, "written": self.written}
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    # ------------------------------------------------------------------
+
+    def _export(self, trace: SessionTrace) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._write_loop, name="tracer", daemon=True)
+                    self._thread.start()
+        self._queue.put(trace)
+
+    def _write_loop(self) -> None:
+        while True:
+            trace = self._queue.get()
+            if trace is None:
+                return
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{trace.session_id}.trace.json")
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(trace.to_chrome(), f, ensure_ascii=False, separators=(",", ":"))
+                self.written += 1
+                self._prune()
+            except Exception as e:
+                log.warning("Spårning: kunde inte skriva %s: %s", trace.session_id, e)
+
+    def _prune(self) -> None:
+        files = [e for e in os.scandir(self.directory) if e.name.endswith(".trace.json")]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=lambda e: e.stat().st_mtime)
+        for e in files[: len(files) - self.max_files]:
+            try:
+                os.remove(e.path)
+            except OSError:
+                pass
+
+
+tracer = Tracer(
+    directory=settings.tracing_dir,
+    enabled=settings.tracing_enabled,
+    sample_rate=settings.tracing_sample_rate,
+    max_events=settings.tracing_max_events,
+    max_files=settings.tracing_max_files,
+)
@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+
+log = logging.getLogger("stt")
+
+
+class SegmentHasher:
+    """Nyckel för ljudet i ett commit:at item (PCM16 mono), byggd bit för bit.
+
+    Tystnad först och sist (alla sampel inom ±`silence_level`) räknas inte,
+    så samma fras med olika mycket tystnad runt får samma nyckel. Tystnad
+    i slutet hålls undan tills det kommer mer ljud – då hashas den, annars
+    aldrig. Segment längre än `max_bytes` hashas inte alls, och kortare än
+    `min_bytes` (efter trimning) ger ingen nyckel.
+    """
+
+    __slots__ = ("prefix", "silence_level", "min_bytes", "max_bytes", "_h", "_tail", "voiced_bytes", "total_bytes", "valid")
+
+    def __init__(self, prefix: bytes, silence_level: int, min_bytes: int, max_bytes: int) -> None:
+        self.prefix = prefix
+        self.silence_level = silence_level
+        self.min_bytes = min_bytes
+        self.max_bytes = max_bytes
+        self.reset()
+
+    def reset(self) -> None:
+        self._h = hashlib.blake2b(self.prefix, digest_size=16)
+        self._tail: List[bytes] = []   # tystnad efter senaste ljudet
+        self.voiced_bytes = 0          # hashat hittills
+        self.total_bytes = 0
+        self.valid = True
+
+    def invalidate(self) -> None:
+        """Segmentet går inte att cacha (t.ex. upstream commit:ade mitt i det)."""
+        self.valid = False
+        self._tail.clear()
+
+    def update(self, frame: bytes) -> None:
+        if not self.valid:
+            return
+        self.total_bytes += len(frame)
+        if self.total_bytes > self.max_bytes:
+            self.invalidate()
+            return
+        x = np.frombuffer(frame, dtype="<i2", count=len(frame) // 2)
+        level = self.silence_level
+        loud = np.flatnonzero((x > level) | (x < -level))
+        if loud.size == 0:
+            if self.voiced_bytes:
+                self._tail.append(frame)
+            return
+        start = 0 if self.voiced_bytes else int(loud[0]) * 2
+        end = (int(loud[-1]) + 1) * 2
+        h = self._h
+        for piece in self._tail:
+            h.update(piece)
+            self.voiced_bytes += len(piece)
+        self._tail.clear()
+        view = memoryview(frame)
+        h.update(view[start:end])
+        self.voiced_bytes += end - start
+        if end < len(frame):
+            self._tail.append(frame[end:])
+
+    def digest(self) -> Optional[str]:
+        """Nyckeln, eller None om segmentet inte ska cachas."""
+        if not self.valid or self.voiced_bytes < self.min_bytes:
+            return None
+        return self._h.hexdigest()
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self.expired = 0
+        self.saved_s_total = 0.0
+
+    @property
+    def hit_ratio(self) -> float:
+        n = self.hits + self.misses
+        return self.hits / n if n else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hit_ratio, 4),
+            "stores": self.stores,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "saved_s_total": round(self.saved_s_total, 3),
+        }
+
+
+class TranscriptCache:
+    """Transkript för yttranden som kommit förut, nyckel = `SegmentHasher`.
+
+    För kiosker och IVR som skickar samma korta fraser om och om igen: när
+    upstream commit:ar ett item vars ljud finns i cachen går `stt.final`
+    ut direkt, utan att vänta på transkriberingen. I minnet
+    högst `max_entries` poster (LRU) som lever `ttl_s`. Med `directory`
+    sparas de också på disk (en fil per nyckel, skrivs av en
+    bakgrundstråd; läses i en worker-tråd vid miss i minnet), så att de
+    överlever omstarter och delas av workers på noden. På disk hålls
+    högst `disk_max_entries`, de äldsta tas bort först.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        max_entries: int = 10_000,
+        ttl_s: float = 24 * 3600,
+        directory: str = "",
+        disk_max_entries: int = 100_000,
+        min_ms: int = 200,
+        max_ms: int = 10_000,
+        silence_dbfs: float = -50.0,
+        sample_rate_hz: int = 24000,
+    ) -> None:
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.directory = directory
+        self.disk_max_entries = disk_max_entries
+        self.min_bytes = int(sample_rate_hz * min_ms / 1000) * 2
+        self.max_bytes = int(sample_rate_hz * max_ms / 1000) * 2
+        self.silence_level = int(32768 * 10 ** (silence_dbfs / 20))
+        # nyckel -> (text, time.time() när den sparades)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._queue: "queue.SimpleQueue[Optional[Tuple[str, str, float]]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._disk_writes = 0
+        self.stats = CacheStats()
+
+    def new_hasher(self, context: str) -> SegmentHasher:
+        """`context` (modell, språk, samplingsfrekvens) ingår i nyckeln."""
+        return SegmentHasher(context.encode("utf-8"), self.silence_level, self.min_bytes, self.max_bytes)
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now - entry[1] <= self.ttl_s:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return entry[0]
+            del self._entries[key]
+            self.stats.expired += 1
+        if self.directory:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None and now - entry[1] <= self.ttl_s:
+                self._remember(key, entry)
+                self.stats.hits += 1
+                self.stats.disk_hits += 1
+                return entry[0]
+        self.stats.misses += 1
+        return None
+
+    def put(self, key: str, text: str) -> None:
+        if not text:
+            return
+        entry = (text, time.time())
+        self._remember(key, entry)
+        self.stats.stores += 1
+        if self.directory:
+            self._ensure_thread()
+            self._queue.put((key, text, entry[1]))
+
+    def note_saved(self, seconds: float) -> None:
+        """En träff kom så här mycket före upstreams transkript för samma item."""
+        self.stats.saved_s_total += max(0.0, seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "disk": bool(self.directory),
+            **self.stats.as_dict(),
+        }
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5.0)
+            self._thread = None
+
+    # ------------------------------------------------------------------
+
+    def _remember(self, key: str, entry: Tuple[str, float]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats.evicted += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[str, float]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                d = json.load(f)
+            return str(d["text"]), float(d["stored_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._write_loop, name="transcript-cache", daemon=True)
+                    self._thread.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            key, text, stored_at = item
+            path = self._path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"text": text, "stored_at": stored_at}, f, ensure_ascii=False)
+                os.replace(tmp, path)   # läsare ser aldrig en halvskriven fil
+                self._disk_writes += 1
+                if self._disk_writes % 256 == 0:
+                    self._prune()
+            except Exception as e:
+                log.warning("Transkriptcache: kunde inte skriva %s: %s", key, e)
+
+    def _prune(self) -> None:
+        files = [e for d in os.scandir(self.directory) if d.is_dir() for e in os.scandir(d.path)]
+        cutoff = time.time() - self.ttl_s
+        keep = []
+        for e in files:
+            try:
+                mtime = e.stat().st_mtime
+                if mtime < cutoff:
+                    os.remove(e.path)
+                else:
+                    keep.append((mtime, e.path))
+            except OSError:
+                pass
+        if len(keep) <= self.disk_max_entries:
+            return
+        keep.sort()
+        for _, path in keep[: len(keep) - self.disk_max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+transcript_cache = TranscriptCache(
+    enabled=settings.transcript_cache_enabled,
+    max_entries=settings.transcript_cache_max_entries,
+    ttl_s=settings.transcript_cache_ttl_s,
+    directory=settings.transcript_cache_dir,
+    disk_max_entries=settings.transcript_cache_disk_max_entries,
+    min_ms=settings.transcript_cache_min_ms,
+    max_ms=settings.transcript_cache_max_ms,
+    silence_dbfs=settings.transcript_cache_silence_dbfs,
+    sample_rate_hz=settings.upstream_sample_rate_hz,
+)
@@ -0,0 +1,123 @@
+# bench/bench_event_decode.py
+"""Mikrobenchmark: avkodning av Realtime-events, json.loads på allt mot EventDispatcher.
+
+Körs från repo-roten:
+    python -m bench.bench_event_decode [--seconds 1.0]
+
+Den gamla vägen parsar varje event och går igenom en if-kedja (som
+`on_rt_event` gjorde); den nya läser typen med `peek_type()` och parsar
+bara typer med en hanterare (samma som en /ws/transcribe-session har).
+Hanterarna gör inget, så siffran är ren avkodning och dispatch per kärna.
+"""
+import argparse
+import json
+import time
+
+from app.realtime_codec import EventDispatcher
+from app.stt.receive_text_from_realtime import TRANSCRIPT_EVENTS
+
+SESSION = {
+    "id": "sess_1", "object": "realtime.session", "model": "gpt-4o-realtime-preview",
+    "modalities": ["text"], "instructions": "x" * 4000, "voice": "alloy",
+    "input_audio_format": "pcm16", "output_audio_format": "pcm16",
+    "input_audio_transcription": {"model": "whisper-1", "language": "sv"},
+    "turn_detection": {"type": "server_vad", "threshold": 0.5, "prefix_padding_ms": 300,
+                       "silence_duration_ms": 500, "create_response": False},
+    "tools": [], "tool_choice": "auto", "temperature": 0.8, "max_response_output_tokens": "inf",
+}
+
+
+def ev(t: str, **fields) -> str:
+    return json.dumps({"type": t, "event_id": "event_ABC123", **fields})
+
+
+# Ungefär vad en session ser per yttrande (typ -> event)
+MIX = {
+    "session.updated": ev("session.updated", session=SESSION),
+    "input_audio_buffer.speech_started": ev("input_audio_buffer.speech_started", audio_start_ms=1000, item_id="item_1"),
+    "input_audio_buffer.speech_stopped": ev("input_audio_buffer.speech_stopped", audio_end_ms=2500, item_id="item_1"),
+    "input_audio_buffer.committed": ev("input_audio_buffer.committed", previous_item_id=None, item_id="item_1"),
+    "conversation.item.created": ev("conversation.item.created", previous_item_id=None, item={
+        "id": "item_1", "object": "realtime.item", "type": "message", "status": "completed", "role": "user",
+        "content": [{"type": "input_audio", "transcript": None}]}),
+    "rate_limits.updated": ev("rate_limits.updated", rate_limits=[
+        {"name": "requests", "limit": 1000, "remaining": 999, "reset_seconds": 60},
+        {"name": "tokens", "limit": 50000, "remaining": 49000, "reset_seconds": 60}]),
+    "conversation.item.input_audio_transcription.delta": ev(
+        "conversation.item.input_audio_transcription.delta", item_id="item_1", content_index=0, delta="hej och "),
+    "conversation.item.input_audio_transcription.completed": ev(
+        "conversation.item.input_audio_transcription.completed", item_id="item_1", content_index=0,
+        transcript="hej och välkommen till mötet"),
+}
+# Per yttrande: fyra deltas och ett av varje övrigt (session.updated bara ibland)
+STREAM = [MIX[t] for t in MIX if t != "session.updated"] + [MIX["conversation.item.input_audio_transcription.delta"]] * 3
+
+
+async def _noop(evt: dict) -> None:
+    pass
+
+
+def old_dispatch():
+    log = []
+
+    async def on_event(raw: str) -> None:
+        evt = json.loads(raw)
+        t = evt.get("type")
+        log.append(str(t))
+        if t == "error":
+            await _noop(evt)
+        elif t == "session.updated":
+            await _noop(evt)
+        elif TRANSCRIPT_EVENTS.get(evt.get("type")) is not None:
+            await _noop(evt)
+    return on_event
+
+
+def new_dispatch():
+    log = []
+    d = EventDispatcher(lambda t, raw: log.append(t))
+    d.on("error", _noop)
+    d.on("session.updated", _noop)
+    for t in TRANSCRIPT_EVENTS:
+        d.on(t, _noop)
+    return d.dispatch
+
+
+def run_sync(coro) -> None:
+    # Hanterarna väntar aldrig, så korutinen blir klar på första send()
+    try:
+        coro.send(None)
+    except StopIteration:
+        pass
+
+
+def bench(fn, events: list[str], seconds: float) -> float:
+    """Events per sekund."""
+    n = 0
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    while True:
+        for raw in events:
+            run_sync(fn(raw))
+        n += len(events)
+        now = time.perf_counter()
+        if now >= deadline:
+            return n / (now - t0)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--seconds", type=float, default=1.0, help="mättid per rad och variant")
+    a = p.parse_args()
+
+    rows = [(t, [raw]) for t, raw in MIX.items()] + [("blandning per yttrande", STREAM)]
+    print(f"{'event':<56} {'byte':>6} {'gammal ev/s':>12} {'ny ev/s':>12} {'speedup':>8}")
+    for name, events in rows:
+        size = sum(len(e) for e in events) // len(events)
+        old = bench(old_dispatch(), events, a.seconds)
+        new = bench(new_dispatch(), events, a.seconds)
+        print(f"{name:<56} {size:>6} {old:>12,.0f} {new:>12,.0f} {new / old:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench/bench_resample.py
+"""Genomströmning för FormatConverter (format + nedmixning + omsampling).
+
+Körs från repo-roten:
+    python -m bench.bench_resample [--seconds 10] [--chunk-ms 20]
+
+Skriver hur många gånger snabbare än realtid varje konvertering går på en
+kärna, samt hur många byte som allokeras per chunk efter uppvärmning
+(mätt med tracemalloc; NumPy rapporterar sina databuffrar dit).
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.stt.receive_audio_from_frontend import AudioFormat, FormatConverter
+
+CASES = [
+    AudioFormat("pcm16", 16000, 1),
+    AudioFormat("pcm16", 24000, 1),
+    AudioFormat("float32", 48000, 1),
+    AudioFormat("float32", 48000, 2),
+    AudioFormat("pcm16", 44100, 2),
+]
+
+
+def make_input(fmt: AudioFormat, seconds: float) -> bytes:
+    n = int(fmt.sample_rate_hz * seconds)
+    t = np.arange(n) / fmt.sample_rate_hz
+    x = 0.3 * np.sin(2 * np.pi * 300 * t) + 0.05 * np.random.default_rng(0).standard_normal(n)
+    x = np.repeat(x[:, None], fmt.channels, axis=1)
+    if fmt.encoding == "pcm16":
+        return (x * 32767).astype("<i2").tobytes()
+    return x.astype("<f4").tobytes()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--seconds", type=float, default=10.0, help="sekunder ljud per fall")
+    p.add_argument("--chunk-ms", type=int, default=20)
+    p.add_argument("--out-rate", type=int, default=24000)
+    a = p.parse_args()
+
+    print(f"{'format':<28} {'x realtid':>10} {'µs/chunk':>10} {'alloc B/chunk':>14}")
+    for fmt in CASES:
+        data = make_input(fmt, a.seconds)
+        step = fmt.frame_bytes * fmt.sample_rate_hz * a.chunk_ms // 1000
+        chunks = [data[i:i + step] for i in range(0, len(data), step)]
+        conv = FormatConverter(fmt, a.out_rate)
+        conv.process(chunks[0])  # uppvärmning: arbetsbuffrar allokeras här
+
+        t0 = time.perf_counter()
+        for c in chunks:
+            conv.process(c)
+        dt = time.perf_counter() - t0
+
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        for c in chunks[:50]:
+            conv.process(c)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+
+        label = f"{fmt.encoding} {fmt.sample_rate_hz} Hz x{fmt.channels}"
+        if conv.passthrough:
+            label += " (passthrough)"
+        print(f"{label:<28} {a.seconds / dt:>10.0f} {dt / len(chunks) * 1e6:>10.1f} {max(0, peak):>14}")
+
+
+if __name__ == "__main__":
+    main()
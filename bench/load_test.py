@@ -0,0 +1,268 @@
+# bench/load_test.py
+"""Lasttest: många samtidiga /ws/transcribe-sessioner mot appen.
+
+Körs från repo-roten. Enklast är att låta skriptet starta både mocken
+(tests/mock_realtime.py) och appen som egna processer:
+    python -m bench.load_test --spawn --clients 200 --seconds 20 [--speed 1.0]
+
+Eller mot en app som redan kör (ange --app-pid för CPU/RSS):
+    python -m bench.load_test --url ws://127.0.0.1:8000/ws/transcribe --app-pid 1234
+
+`--speed` styr takten: 1.0 = realtid, 4.0 = fyra gånger snabbare,
+0 = så fort det går. Ljudet tas från --wav (16 kHz mono PCM16) eller
+genereras. Rapporten visar p50/p95/p99 för tid till första partial och
+till final (räknat från första ljudet i ett yttrande, samma definition
+som /metrics), meddelanden per sekund samt appens CPU och RSS per session.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import wave
+
+import numpy as np
+import websockets
+
+SAMPLE_RATE = 16000
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+class ClientResult:
+    def __init__(self):
+        self.connect_s = None
+        self.first_partial_s: list[float] = []
+        self.final_s: list[float] = []
+        self.messages = 0
+        self.errors: list[str] = []
+
+
+def make_audio(seconds: float) -> bytes:
+    n = int(SAMPLE_RATE * seconds)
+    t = np.arange(n) / SAMPLE_RATE
+    rng = np.random.default_rng(0)
+    # "tal" i stötar om 1,5 s med 0,5 s tystnad emellan
+    env = ((t % 2.0) < 1.5).astype(np.float64)
+    x = env * 0.3 * np.sin(2 * np.pi * 220 * t) + 0.01 * rng.standard_normal(n)
+    return (x * 32767).astype("<i2").tobytes()
+
+
+def read_wav(path: str) -> bytes:
+    with wave.open(path, "rb") as w:
+        assert w.getframerate() == SAMPLE_RATE and w.getnchannels() == 1 and w.getsampwidth() == 2, \
+            "WAV måste vara 16kHz, mono, 16-bit"
+        return w.readframes(w.getnframes())
+
+
+def percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+# --- /proc-mätning av appen -------------------------------------------------
+
+def proc_cpu_s(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK  # utime + stime
+
+
+def proc_rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+async def sample_rss(pid: int, peak: list[int], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        peak[0] = max(peak[0], proc_rss_bytes(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), 0.2)
+        except asyncio.TimeoutError:
+            pass
+
+
+# --- en klient --------------------------------------------------------------
+
+async def run_client(url: str, audio: bytes, chunk_ms: int, speed: float, drain_s: float,
+                     res: ClientResult, sent_counter: list[int]) -> None:
+    chunk_bytes = SAMPLE_RATE * 2 * chunk_ms // 1000
+    t0 = time.perf_counter()
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            res.connect_s = time.perf_counter() - t0
+            utt_start = None
+            partial_seen = False
+            last_rx = time.perf_counter()
+
+            async def recv():
+                nonlocal utt_start, partial_seen, last_rx
+                async for raw in ws:
+                    last_rx = time.perf_counter()
+                    res.messages += 1
+                    if not isinstance(raw, str) or not raw.startswith("{"):
+                        continue
+                    msg = json.loads(raw)
+                    t = msg.get("type")
+                    if t == "error":
+                        res.errors.append(msg.get("reason", "error"))
+                    elif utt_start is None:
+                        continue
+                    elif t == "stt.partial" and not partial_seen:
+                        res.first_partial_s.append(last_rx - utt_start)
+                        partial_seen = True
+                    elif t == "stt.final":
+                        res.final_s.append(last_rx - utt_start)
+                        utt_start, partial_seen = None, False
+
+            rtask = asyncio.create_task(recv())
+            start = time.perf_counter()
+            for i, off in enumerate(range(0, len(audio), chunk_bytes)):
+                if speed > 0:
+                    delay = start + i * chunk_ms / 1000 / speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if utt_start is None:
+                    utt_start = time.perf_counter()
+                await ws.send(audio[off:off + chunk_bytes])
+                sent_counter[0] += 1
+
+            # Vänta på sista final, eller tills det varit tyst ett tag
+            while not rtask.done() and time.perf_counter() - last_rx < drain_s:
+                await asyncio.sleep(0.05)
+            rtask.cancel()
+    except Exception as e:
+        res.errors.append(type(e).__name__)
+
+
+# --- processer för --spawn ----------------------------------------------------
+
+# Mocken hör till testerna (tests/ är inget paket): startas som skript
+MOCK_REALTIME = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "mock_realtime.py")
+
+
+def spawn(args: list[str]) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def serve_app(host: str, port: int, realtime_url: str) -> None:
+    """Starta appen med Realtime-URL:en pekad mot mocken (används av --spawn)."""
+    from app.config import settings
+    settings.realtime_url = realtime_url
+    settings.openai_api_key = settings.openai_api_key or "mock"
+    import uvicorn
+    from app.main import app
+    uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+async def wait_port(host: str, port: int, timeout_s: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while True:
+        try:
+            _, w = await asyncio.open_connection(host, port)
+            w.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+# --- huvudprogram -----------------------------------------------------------
+
+async def run(a) -> None:
+    procs = []
+    url, pid = a.url, a.app_pid
+    if a.spawn:
+        procs.append(spawn([MOCK_REALTIME, "--port", str(a.mock_port),
+                            "--delta-delay-ms", str(a.delta_delay_ms), "--final-delay-ms", str(a.final_delay_ms),
+                            "--server-vad-ms", "300"]))
+        app = spawn(["-m", "bench.load_test", "--serve-app", "--app-port", str(a.app_port),
+                     "--mock-port", str(a.mock_port)])
+        procs.append(app)
+        pid = app.pid
+        url = f"ws://127.0.0.1:{a.app_port}/ws/transcribe"
+        await wait_port("127.0.0.1", a.mock_port)
+        await wait_port("127.0.0.1", a.app_port)
+
+    try:
+        audio = read_wav(a.wav)[: int(a.seconds * SAMPLE_RATE) * 2] if a.wav else make_audio(a.seconds)
+        results = [ClientResult() for _ in range(a.clients)]
+        sent = [0]
+        stop = asyncio.Event()
+        peak = [0]
+        base_rss = proc_rss_bytes(pid) if pid else 0
+        cpu0 = proc_cpu_s(pid) if pid else 0.0
+        sampler = asyncio.create_task(sample_rss(pid, peak, stop)) if pid else None
+
+        async def staggered(i, res):
+            await asyncio.sleep(a.ramp_s * i / max(1, a.clients))
+            await run_client(url, audio, a.chunk_ms, a.speed, a.drain_s, res, sent)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(staggered(i, r) for i, r in enumerate(results)))
+        wall = time.perf_counter() - t0
+        stop.set()
+        if sampler:
+            await sampler
+        cpu = proc_cpu_s(pid) - cpu0 if pid else None
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+
+    ok = [r for r in results if r.connect_s is not None]
+    partial = [x for r in results for x in r.first_partial_s]
+    final = [x for r in results for x in r.final_s]
+    connect = [r.connect_s for r in ok]
+    errors: dict[str, int] = {}
+    for r in results:
+        for e in r.errors:
+            errors[e] = errors.get(e, 0) + 1
+    msgs = sum(r.messages for r in results)
+
+    print(f"klienter: {a.clients} (anslutna {len(ok)}), ljud {a.seconds:.0f} s/klient, "
+          f"takt {'max' if a.speed <= 0 else f'{a.speed:g}x'}, tid {wall:.1f} s")
+    print(f"{'ms':<22} {'n':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for name, vals in (("anslutning", connect), ("första partial", partial), ("final", final)):
+        ms = [v * 1000 for v in vals]
+        print(f"{name:<22} {len(ms):>7} {percentile(ms, 50):>8.1f} {percentile(ms, 95):>8.1f} {percentile(ms, 99):>8.1f}")
+    print(f"chunks in/s: {sent[0] / wall:.0f}, meddelanden ut/s: {msgs / wall:.0f}")
+    if pid:
+        per_session = max(0, peak[0] - base_rss) / max(1, len(ok))
+        print(f"app CPU: {cpu:.2f} s ({cpu / wall * 100:.0f} % av en kärna), "
+              f"RSS topp {peak[0] / 2**20:.1f} MiB (+{per_session / 1024:.0f} KiB/session)")
+    if errors:
+        print("fel:", ", ".join(f"{k}={v}" for k, v in sorted(errors.items())))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--url", default="ws://127.0.0.1:8000/ws/transcribe")
+    p.add_argument("--clients", type=int, default=100)
+    p.add_argument("--seconds", type=float, default=10.0, help="sekunder ljud per klient")
+    p.add_argument("--chunk-ms", type=int, default=20)
+    p.add_argument("--speed", type=float, default=1.0, help="1 = realtid, 0 = så fort det går")
+    p.add_argument("--ramp-s", type=float, default=2.0, help="sprid ut anslutningarna över så här lång tid")
+    p.add_argument("--drain-s", type=float, default=2.0, help="vänta så här länge på sista svar")
+    p.add_argument("--wav", help="16 kHz mono PCM16 (annars syntetiskt ljud)")
+    p.add_argument("--app-pid", type=int, help="mät CPU/RSS för en app som redan kör")
+    p.add_argument("--spawn", action="store_true", help="starta mock + app som egna processer")
+    p.add_argument("--app-port", type=int, default=8011)
+    p.add_argument("--mock-port", type=int, default=8765)
+    p.add_argument("--delta-delay-ms", type=float, default=80.0)
+    p.add_argument("--final-delay-ms", type=float, default=250.0)
+    p.add_argument("--serve-app", action="store_true", help=argparse.SUPPRESS)
+    a = p.parse_args()
+    if a.serve_app:
+        serve_app("127.0.0.1", a.app_port, f"ws://127.0.0.1:{a.mock_port}")
+        return
+    asyncio.run(run(a))
+
+
+if __name__ == "__main__":
+    main()
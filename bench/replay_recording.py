@@ -0,0 +1,145 @@
+# bench/replay_recording.py
+"""Spela upp en inspelad session (se app/recording.py) mot appen igen.
+
+Körs från repo-roten med sökvägen till en sessions inspelningskatalog:
+    python -m bench.replay_recording /tmp/stt-recordings/<session_id> [--speed 1.0]
+
+Ljudet i `audio_in.raw` skickas i samma bitar och med samma tidsavstånd
+som när det spelades in (`--speed` 2.0 = dubbelt så fort, 0 = så fort
+det går), med samma ljudformat. Uppspelningen sker alltid med mode=json.
+Mottagna finals skrivs ut med tid från start bredvid de inspelade.
+
+Med `--spawn` startas mocken (tests/mock_realtime.py) med de inspelade
+Realtime-transkripten som skript, plus appen, så att en session kan
+reproduceras helt lokalt:
+    python -m bench.replay_recording /tmp/stt-recordings/<session_id> --spawn
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import websockets
+
+from app.recording import AUDIO_FILE, EVENTS_FILE
+from bench.load_test import MOCK_REALTIME, spawn, wait_port
+
+
+def load_recording(path: str):
+    """(meta, [(t, chunk)], inspelade händelser) ur en inspelningskatalog."""
+    meta, chunks, events = {}, [], []
+    with open(os.path.join(path, AUDIO_FILE), "rb") as audio_f, \
+            open(os.path.join(path, EVENTS_FILE), encoding="utf-8") as f:
+        for line in f:
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue  # avbruten sista rad
+            kind = e.get("kind")
+            if kind == "meta":
+                meta = e.get("data") or {}
+            elif kind == "audio":
+                audio_f.seek(e["offset"])
+                chunks.append((e["t"], audio_f.read(e["len"])))
+            else:
+                events.append(e)
+    return meta, chunks, events
+
+
+def recorded_transcripts(events) -> list[str]:
+    return [e["data"].get("transcript") or "" for e in events
+            if e.get("kind") == "rt" and isinstance(e.get("data"), dict)
+            and e["data"].get("type") == "conversation.item.input_audio_transcription.completed"]
+
+
+def recorded_finals(events) -> list[tuple[float, str]]:
+    return [(e["t"], e["data"].get("text") or "") for e in events
+            if e.get("kind") == "out" and isinstance(e.get("data"), dict)
+            and e["data"].get("type") == "stt.final"]
+
+
+async def replay(url: str, meta: dict, chunks, speed: float, drain_s: float) -> list[tuple[float, str]]:
+    params = dict(meta.get("audio_in") or {}, mode="json")
+    finals: list[tuple[float, str]] = []
+    async with websockets.connect(f"{url}?{urlencode(params)}", max_size=None) as ws:
+        start = time.perf_counter()
+        last_rx = start
+
+        async def recv():
+            nonlocal last_rx
+            async for raw in ws:
+                last_rx = time.perf_counter()
+                if not isinstance(raw, str) or not raw.startswith("{"):
+                    continue
+                msg = json.loads(raw)
+                if msg.get("type") == "stt.final":
+                    finals.append((last_rx - start, msg.get("text") or ""))
+                elif msg.get("type") == "error":
+                    print(f"fel: {msg.get('reason')}: {msg.get('detail', '')}")
+
+        rtask = asyncio.create_task(recv())
+        for t, chunk in chunks:
+            if speed > 0:
+                delay = start + t / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await ws.send(chunk)
+        while not rtask.done() and time.perf_counter() - last_rx < drain_s:
+            await asyncio.sleep(0.05)
+        rtask.cancel()
+    return finals
+
+
+async def run(a) -> None:
+    meta, chunks, events = load_recording(a.path)
+    print(f"session {meta.get('session_id', '?')}: {len(chunks)} ljudbitar, "
+          f"{sum(len(c) for _, c in chunks)} byte, format {meta.get('audio_in')}")
+    procs, url, script = [], a.url, None
+    if a.spawn:
+        fd, script = tempfile.mkstemp(suffix=".jsonl")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for text in recorded_transcripts(events) or ["(inga inspelade transkript)"]:
+                f.write(json.dumps({"transcript": text}, ensure_ascii=False) + "\n")
+        procs.append(spawn([MOCK_REALTIME, "--port", str(a.mock_port), "--script", script]))
+        procs.append(spawn(["-m", "bench.load_test", "--serve-app", "--app-port", str(a.app_port),
+                            "--mock-port", str(a.mock_port)]))
+        url = f"ws://127.0.0.1:{a.app_port}/ws/transcribe"
+    try:
+        if a.spawn:
+            await wait_port("127.0.0.1", a.mock_port)
+            await wait_port("127.0.0.1", a.app_port)
+        finals = await replay(url, meta, chunks, a.speed, a.drain_s)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait()
+        if script:
+            os.unlink(script)
+
+    before = recorded_finals(events)
+    print(f"{'#':>3} {'inspelad s':>10} {'uppspelad s':>11}  text")
+    for i in range(max(len(before), len(finals))):
+        t0, text0 = before[i] if i < len(before) else (float("nan"), "")
+        t1, text1 = finals[i] if i < len(finals) else (float("nan"), "")
+        mark = "" if text0 == text1 else f"   (inspelad: {text0!r})"
+        print(f"{i:>3} {t0:>10.2f} {t1:>11.2f}  {text1!r}{mark}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("path", help="inspelningskatalog, <recording_dir>/<session_id>")
+    p.add_argument("--url", default="ws://127.0.0.1:8000/ws/transcribe")
+    p.add_argument("--speed", type=float, default=1.0, help="1 = inspelad takt, 0 = så fort det går")
+    p.add_argument("--drain-s", type=float, default=3.0, help="vänta så här länge på sista svar")
+    p.add_argument("--spawn", action="store_true", help="starta mock (med inspelade transkript) + app")
+    p.add_argument("--app-port", type=int, default=8011)
+    p.add_argument("--mock-port", type=int, default=8765)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Gemensamt för testerna: mocken och appen i samma eventloop."""
+import asyncio
+import contextlib
+import socket
+
+import numpy as np
+import uvicorn
+import websockets
+
+from app.config import settings
+from mock_realtime import MockConfig, handle
+
+RATE = 24000  # upstream-frekvensen; klienterna skickar den så att inget räknas om
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def silence(ms: int) -> bytes:
+    return b"\0\0" * (RATE * ms // 1000)
+
+
+def voice(ms: int, seed: int = 1) -> bytes:
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal(RATE * ms // 1000) * 3000).astype("<i2").tobytes()
+
+
+@contextlib.asynccontextmanager
+async def running_mock(cfg: MockConfig):
+    port = free_port()
+    async with websockets.serve(lambda ws, path=None: handle(ws, cfg), "127.0.0.1", port, max_size=None):
+        yield f"ws://127.0.0.1:{port}"
+
+
+@contextlib.asynccontextmanager
+async def running_app(realtime_url: str):
+    """Appen (med lifespan) mot `realtime_url`; ger bas-URL:en för WebSockets."""
+    from app.main import app
+
+    saved = settings.realtime_url, settings.openai_api_key
+    settings.realtime_url = realtime_url
+    settings.openai_api_key = "test"
+    try:
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+        task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        try:
+            yield f"ws://127.0.0.1:{port}"
+        finally:
+            server.should_exit = True
+            await task
+    finally:
+        settings.realtime_url, settings.openai_api_key = saved
@@ -0,0 +1,228 @@
+# tests/mock_realtime.py
+"""Lokal låtsas-Realtime-server för last- och prestandatester utan OpenAI-nyckel.
+
+Används av testerna (conftest) och startas av bench-skripten med --spawn:
+    python tests/mock_realtime.py [--port 8765] [--delta-delay-ms 80] [--final-delay-ms 250]
+
+Tar emot `session.update`, `input_audio_buffer.append/commit/clear` och svarar
+som Realtime gör vid transkribering: `input_audio_buffer.committed`, ett antal
+`conversation.item.input_audio_transcription.delta` och till sist `...completed`.
+Commit med mindre än 100 ms ljud ger felet `input_audio_buffer_commit_empty`.
+
+Med `--script fil.jsonl` tas transkripten ur filen (en rad per commit, fältet
+"transcript" eller ren text, läses cykliskt) i stället för genererad text.
+Med `--drop-after-ms N` bryts varje anslutning (1011) när den tagit emot
+N ms ljud, för att prova återanslutning. Med `--server-vad-ms N` commit:ar
+mocken själv (`speech_stopped` + `committed`) efter N ms tystnad efter tal,
+om sessionen bett om server-VAD.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import time
+
+import numpy as np
+import websockets
+
+BYTES_PER_MS = 24000 * 2 / 1000  # pcm16 24 kHz mono
+MIN_COMMIT_MS = 100
+VAD_LEVEL = 1000  # sampel över så här (-30 dBFS) räknas som tal
+
+
+class MockConfig:
+    def __init__(self, delta_delay_ms: float, final_delay_ms: float, deltas: int, script: list[str],
+                 drop_after_ms: float = 0.0, server_vad_ms: float = 0.0):
+        self.delta_delay_s = delta_delay_ms / 1000
+        self.final_delay_s = final_delay_ms / 1000
+        self.deltas = deltas
+        self.script = script
+        self.drop_after_ms = drop_after_ms
+        self.server_vad_ms = server_vad_ms
+
+
+class Stats:
+    connections = 0
+    active = 0
+    appends = 0
+    audio_bytes = 0
+    commits = 0
+    empty_commits = 0
+    dropped = 0
+
+
+def load_script(path: str) -> list[str]:
+    out = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                out.append(line)
+                continue
+            text = obj.get("transcript") if isinstance(obj, dict) else None
+            if isinstance(text, str) and text:
+                out.append(text)
+    return out
+
+
+def b64_decoded_len(s: str) -> int:
+    # Längden räcker; att avkoda ljudet skulle bara kosta CPU i mocken
+    pad = 2 if s.endswith("==") else 1 if s.endswith("=") else 0
+    return len(s) * 3 // 4 - pad
+
+
+async def emit_transcript(ws, cfg: MockConfig, item_id: str, text: str) -> None:
+    words = text.split(" ")
+    n = max(1, min(cfg.deltas, len(words)))
+    per = -(-len(words) // n)
+    try:
+        for i in range(0, len(words), per):
+            await asyncio.sleep(cfg.delta_delay_s)
+            piece = " ".join(words[i:i + per]) + (" " if i + per < len(words) else "")
+            await ws.send(json.dumps({
+                "type": "conversation.item.input_audio_transcription.delta",
+                "item_id": item_id, "content_index": 0, "delta": piece,
+            }))
+        await asyncio.sleep(max(0.0, cfg.final_delay_s - cfg.delta_delay_s * n))
+        await ws.send(json.dumps({
+            "type": "conversation.item.input_audio_transcription.completed",
+            "item_id": item_id, "content_index": 0, "transcript": text,
+        }))
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def handle(ws, cfg: MockConfig, path=None) -> None:
+    Stats.connections += 1
+    Stats.active += 1
+    conn = Stats.connections
+    buffered = 0      # byte sedan senaste commit
+    received = 0
+    total_ms = 0.0
+    n_items = 0
+    pending: set[asyncio.Task] = set()
+    vad = False          # sessionen bad om server-VAD (och --server-vad-ms är satt)
+    speaking = False
+    quiet = 0            # byte tystnad sedan senaste tal
+
+    async def commit_item(n_bytes: int) -> None:
+        nonlocal n_items, total_ms
+        Stats.commits += 1
+        n_items += 1
+        item_id = f"item_{conn}_{n_items}"
+        ms = n_bytes / BYTES_PER_MS
+        start_ms, total_ms = total_ms, total_ms + ms
+        await ws.send(json.dumps({"type": "input_audio_buffer.committed", "item_id": item_id}))
+        if cfg.script:
+            text = cfg.script[(n_items - 1) % len(cfg.script)]
+        else:
+            text = f"segment {n_items} från {start_ms:.0f} till {total_ms:.0f} ms"
+        task = asyncio.create_task(emit_transcript(ws, cfg, item_id, text))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    try:
+        await ws.send(json.dumps({"type": "session.created", "session": {"id": f"sess_{conn}"}}))
+        async for raw in ws:
+            evt = json.loads(raw)
+            t = evt.get("type")
+            if t == "input_audio_buffer.append":
+                n = b64_decoded_len(evt.get("audio", ""))
+                buffered += n
+                received += n
+                Stats.appends += 1
+                Stats.audio_bytes += n
+                if cfg.drop_after_ms and received / BYTES_PER_MS >= cfg.drop_after_ms:
+                    Stats.dropped += 1
+                    await ws.close(1011, "mock drop")
+                    break
+                if vad:
+                    x = np.frombuffer(base64.b64decode(evt.get("audio", "")), dtype="<i2")
+                    loud = np.flatnonzero((x > VAD_LEVEL) | (x < -VAD_LEVEL))
+                    if loud.size:
+                        speaking = True
+                        quiet = (len(x) - 1 - int(loud[-1])) * 2
+                    else:
+                        quiet += n
+                    if speaking and quiet >= cfg.server_vad_ms * BYTES_PER_MS:
+                        # Som Realtime: audio_end_ms räknas från sessionens början
+                        speaking = False
+                        end_ms = int(received / BYTES_PER_MS)
+                        cut = buffered - (received - int(end_ms * BYTES_PER_MS))
+                        await ws.send(json.dumps({
+                            "type": "input_audio_buffer.speech_stopped", "audio_end_ms": end_ms,
+                            "item_id": f"item_{conn}_{n_items + 1}",
+                        }))
+                        buffered -= cut
+                        await commit_item(cut)
+            elif t == "input_audio_buffer.commit":
+                ms = buffered / BYTES_PER_MS
+                if ms < MIN_COMMIT_MS:
+                    Stats.empty_commits += 1
+                    await ws.send(json.dumps({"type": "error", "error": {
+                        "type": "invalid_request_error", "code": "input_audio_buffer_commit_empty",
+                        "message": f"buffer too small: {ms:.0f}ms of audio",
+                    }}))
+                    continue
+                n_bytes, buffered = buffered, 0
+                await commit_item(n_bytes)
+            elif t == "input_audio_buffer.clear":
+                buffered = 0
+                await ws.send(json.dumps({"type": "input_audio_buffer.cleared"}))
+            elif t == "session.update":
+                vad = cfg.server_vad_ms > 0 and (evt.get("session") or {}).get("turn_detection") is not None
+                await ws.send(json.dumps({"type": "session.updated", "session": evt.get("session", {})}))
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        Stats.active -= 1
+        for task in pending:
+            task.cancel()
+
+
+async def report(every_s: float) -> None:
+    last, last_t = 0, time.monotonic()
+    while True:
+        await asyncio.sleep(every_s)
+        now = time.monotonic()
+        rate = (Stats.appends - last) / (now - last_t)
+        last, last_t = Stats.appends, now
+        print(
+            f"[mock] aktiva={Stats.active} anslutningar={Stats.connections} append/s={rate:.0f} "
+            f"commits={Stats.commits} tomma={Stats.empty_commits} brutna={Stats.dropped}",
+            flush=True,
+        )
+
+
+async def serve(host: str, port: int, cfg: MockConfig, report_s: float = 0.0) -> None:
+    async with websockets.serve(lambda ws, path=None: handle(ws, cfg), host, port, max_size=None):
+        if report_s > 0:
+            asyncio.create_task(report(report_s))
+        await asyncio.Future()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--delta-delay-ms", type=float, default=80.0, help="tid mellan delta-events")
+    p.add_argument("--final-delay-ms", type=float, default=250.0, help="tid från commit till completed")
+    p.add_argument("--deltas", type=int, default=3, help="antal delta-events per commit")
+    p.add_argument("--script", help="JSONL/text med transkript, ett per commit")
+    p.add_argument("--report-s", type=float, default=0.0, help="skriv statistik så här ofta (0 = aldrig)")
+    p.add_argument("--drop-after-ms", type=float, default=0.0, help="bryt anslutningen efter så här mycket ljud")
+    p.add_argument("--server-vad-ms", type=float, default=0.0, help="commit:a själv efter så här lång tystnad")
+    a = p.parse_args()
+    cfg = MockConfig(a.delta_delay_ms, a.final_delay_ms, a.deltas, load_script(a.script) if a.script else [],
+                     a.drop_after_ms, a.server_vad_ms)
+    try:
+        asyncio.run(serve(a.host, a.port, cfg, a.report_s))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
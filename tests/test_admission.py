@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, AdmissionRejected
+
+
+def test_queued_sessions_respect_the_per_client_cap():
+    async def main():
+        ctl = AdmissionController(max_sessions=2, max_per_client=1, queue_max=10, queue_timeout_s=2.0)
+        held = [await ctl.acquire("10.0.0.1"), await ctl.acquire("10.0.0.2")]
+        # Servern är full: två väntar från samma IP, en från en annan
+        y1, y2, z = (asyncio.create_task(ctl.acquire(c)) for c in ("10.0.0.3", "10.0.0.3", "10.0.0.4"))
+        await asyncio.sleep(0.01)
+        for t in held:
+            t.release()
+        assert (await y1).client == "10.0.0.3"
+        with pytest.raises(AdmissionRejected) as e:
+            await y2
+        assert e.value.reason == "too_many_sessions"
+        assert (await z).client == "10.0.0.4"
+        assert ctl.active == 2 and ctl.snapshot()["waiting"] == 0
+
+    asyncio.run(main())
+
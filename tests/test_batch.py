@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from app.batch import BatchJob, BatchJobManager
+from conftest import silence
+
+
+class FakeClient:
+    """Svarar på varje commit med ett transkript, eller kastar för segment i `fail`."""
+
+    def __init__(self, fail: set) -> None:
+        self.fail = fail
+        self.is_open = False
+        self.audio = b""
+        self.events: asyncio.Queue = asyncio.Queue()
+
+    async def connect(self) -> None:
+        self.is_open = True
+
+    async def recv_loop(self, dispatcher) -> None:
+        while True:
+            await dispatcher.dispatch(await self.events.get())
+
+    async def send_audio_chunk(self, pcm: bytes) -> None:
+        self.audio += pcm
+
+    async def commit(self) -> None:
+        ms = len(self.audio) // 48
+        self.audio = b""
+        if ms in self.fail:
+            raise RuntimeError("upstream borta")
+        self.events.put_nowait(json.dumps({"type": "conversation.item.input_audio_transcription.completed",
+                                           "item_id": "x", "transcript": f"{ms} ms"}))
+
+    async def close(self) -> None:
+        self.is_open = False
+
+
+def run_job(tmp_path, fail: set) -> BatchJob:
+    async def main():
+        mgr = BatchJobManager(str(tmp_path), factory=lambda: FakeClient(fail))
+        mgr._prepare = lambda job, fmt: job.segments
+        job = BatchJob("j", str(tmp_path / "j"))
+        (tmp_path / "j").mkdir()
+        with open(job.pcm_path, "wb") as f:
+            f.write(silence(500))
+        job.segments = [
+            {"index": i, "offset": start * 48, "length": ms * 48, "start_ms": start, "end_ms": start + ms,
+             "text": "", "status": "pending"}
+            for i, (start, ms) in enumerate([(0, 200), (200, 300)])
+        ]
+        mgr.start(job, None)
+        await job.task
+        return job
+
+    return asyncio.run(main())
+
+
+def test_job_status_reflects_failed_segments(tmp_path):
+    job = run_job(tmp_path, fail=set())
+    assert job.status == "done" and job.result()["text"] == "200 ms 300 ms"
+
+    job = run_job(tmp_path, fail={300})
+    assert job.status == "partial" and job.snapshot()["segments_failed"] == 1
+    assert job.result()["text"] == "200 ms"
+
+    job = run_job(tmp_path, fail={200, 300})
+    assert job.status == "failed" and job.error
@@ -0,0 +1,32 @@
+import asyncio
+
+from app.stt.commit_scheduler import CommitScheduler
+
+BYTES_PER_MS = 48
+
+
+def test_upstream_commits_keep_the_timer_as_a_fallback():
+    async def main():
+        sched = CommitScheduler(tick_ms=5, base_interval_ms=10, min_audio_ms=50, max_interval_ms=100, idle_timeout_ms=1000)
+        fired = []
+        plain = sched.register(lambda: fired.append("plain"), BYTES_PER_MS)
+        vad = sched.register(lambda: fired.append("vad"), BYTES_PER_MS, min_audio_ms=200)
+        plain.note_audio(60 * BYTES_PER_MS)
+        vad.note_audio(150 * BYTES_PER_MS)
+        await asyncio.sleep(0.1)
+        assert fired == ["plain"]
+        # Server-VAD commit:ade: ljudet före räknas inte mot reserven
+        vad.note_committed()
+        vad.note_audio(100 * BYTES_PER_MS)
+        await asyncio.sleep(0.1)
+        assert fired == ["plain"]
+        vad.note_audio(100 * BYTES_PER_MS)
+        for _ in range(50):
+            if len(fired) == 2:
+                break
+            await asyncio.sleep(0.01)
+        assert fired == ["plain", "vad"]
+        assert vad.snapshot()["commits"] == 1 and plain.snapshot()["commits"] == 1
+        await sched.stop()
+
+    asyncio.run(main())
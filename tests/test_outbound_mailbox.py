@@ -0,0 +1,114 @@
+import asyncio
+import struct
+
+import pytest
+
+from app.stt.queues import QueueOverflow
+from app.stt.send_text_to_frontend import FRAME_ITEM, BinaryFrameEncoder, OutboundMailbox
+
+
+def partial(item_id: str, delta: str) -> dict:
+    return {"type": "stt.partial", "item_id": item_id, "delta": delta}
+
+
+def final(item_id: str, delta: str, text: str) -> dict:
+    return {"type": "stt.final", "item_id": item_id, "delta": delta, "text": text}
+
+
+def drain(q: OutboundMailbox) -> list:
+    return asyncio.run(q.get_batch())
+
+
+def test_partial_for_same_item_is_replaced_in_place():
+    q = OutboundMailbox("t", 8, "drop_oldest")
+    q.put_nowait(partial("i1", "a"))
+    q.put_nowait({"type": "stt.event", "n": 1})
+    q.put_nowait(partial("i1", "b"))
+    q.put_nowait(partial("i2", "x"))
+    assert drain(q) == [partial("i1", "ab"), {"type": "stt.event", "n": 1}, partial("i2", "x")]
+    assert q.replaced == 1
+
+
+def test_final_retires_pending_partial_and_keeps_order():
+    q = OutboundMailbox("t", 8, "drop_oldest")
+    q.put_nowait(final("i0", "z", "z"))
+    q.put_nowait(partial("i1", "a"))
+    q.put_nowait({"type": "error", "message": "x"})
+    q.put_nowait(final("i1", "b", "ab"))
+    # Finalen tar partialens delta: en klient som lägger till får hela texten
+    assert drain(q) == [final("i0", "z", "z"), {"type": "error", "message": "x"}, final("i1", "ab", "ab")]
+    # En final med hela texten som delta (texten har ändrats) lämnas som den är
+    q.put_nowait(partial("i2", "a"))
+    q.put_nowait(final("i2", "xy", "xy"))
+    assert drain(q) == [final("i2", "xy", "xy")]
+
+
+def test_dropped_partials_are_carried_into_the_next_message():
+    q = OutboundMailbox("t", 2, "drop_oldest")
+    q.put_nowait(partial("i1", "a"))
+    q.put_nowait(final("i2", "p", "p"))
+    q.put_nowait(final("i3", "q", "q"))       # full: i1:s partial kastas
+    q.put_nowait(partial("i1", "b"))          # fortfarande full, inget att kasta
+    assert q.dropped == 2
+    assert drain(q) == [final("i2", "p", "p"), final("i3", "q", "q")]
+    q.put_nowait(final("i1", "c", "abc"))
+    assert drain(q) == [final("i1", "abc", "abc")]
+
+
+def apply_frames(data: bytes, texts: dict) -> None:
+    """Som en binär klient: skär av vid offset och lägg till."""
+    pos = 0
+    while pos < len(data):
+        kind, idx, offset, n = struct.unpack_from(">BIII", data, pos)
+        pos += 13
+        body = data[pos:pos + n]
+        pos += n
+        if kind == FRAME_ITEM:
+            texts[idx] = b""
+        else:
+            texts[idx] = texts[idx][:offset] + body
+
+
+def test_binary_offsets_survive_dropped_partials():
+    q = OutboundMailbox("t", 2, "drop_oldest")
+    enc = BinaryFrameEncoder()
+    texts: dict = {}
+
+    def send():
+        out = bytearray()
+        for msg in drain(q):
+            enc.encode(msg, out)
+        apply_frames(bytes(out), texts)
+
+    q.put_nowait(partial("i1", "he"))
+    send()
+    q.put_nowait(final("i0", "x", "x"))
+    q.put_nowait(partial("i1", "j"))
+    q.put_nowait(final("i9", "y", "y"))       # kastar "j"
+    send()
+    q.put_nowait(partial("i1", " d"))
+    send()
+    assert texts[0] == "hej d".encode()
+    q.put_nowait(final("i1", "å", "hej då"))
+    send()
+    assert texts[0] == "hej då".encode()
+
+
+def test_full_of_finals_overflows():
+    q = OutboundMailbox("t", 2, "drop_oldest")
+    q.put_nowait(final("i1", "a", "a"))
+    q.put_nowait(final("i2", "b", "b"))
+    with pytest.raises(QueueOverflow):
+        q.put_nowait(final("i3", "c", "c"))
+
+
+def test_binary_encoder_state_is_bounded():
+    enc = BinaryFrameEncoder(max_items=2)
+    texts: dict = {}
+    out = bytearray()
+    for item_id in ("a", "b", "c"):
+        enc.encode(partial(item_id, item_id * 2), out)
+    enc.encode(final("a", "!", "aa!"), out)    # "a" har släppts: ny ram med hela texten
+    apply_frames(bytes(out), texts)
+    assert len(enc._items) == 2
+    assert texts == {0: b"aa", 1: b"bb", 2: b"cc", 3: b"aa!"}
@@ -0,0 +1,28 @@
+import asyncio
+import json
+
+import websockets
+
+from conftest import RATE, running_app, running_mock
+from mock_realtime import MockConfig
+
+
+async def ready(base: str, compression) -> tuple[dict, list]:
+    url = f"{base}/ws/transcribe?mode=binary&encoding=pcm16&sample_rate_hz={RATE}"
+    async with websockets.connect(url, compression=compression) as ws:
+        msg = json.loads(await asyncio.wait_for(ws.recv(), 5))
+        return msg, [e.name for e in ws.extensions]
+
+
+def test_ready_does_not_claim_compression():
+    async def main():
+        cfg = MockConfig(delta_delay_ms=10, final_delay_ms=50, deltas=1, script=[])
+        async with running_mock(cfg) as url, running_app(url) as base:
+            return await ready(base, "deflate"), await ready(base, None)
+
+    (offered, offered_ext), (plain, plain_ext) = asyncio.run(main())
+    # Komprimeringen syns i klientens handskakning, inte i `ready`
+    assert offered_ext == ["permessage-deflate"] and plain_ext == []
+    for msg in (offered, plain):
+        assert msg["type"] == "ready"
+        assert msg["protocol"] == {"mode": "binary", "version": 1}
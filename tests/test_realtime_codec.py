@@ -0,0 +1,47 @@
+import asyncio
+import base64
+import json
+
+from app.realtime_codec import EventDispatcher, encode_append, peek_type
+
+
+def test_encode_append_is_valid_json():
+    pcm = bytes(range(256)) * 3
+    msg = json.loads(encode_append(pcm))
+    assert msg == {"type": "input_audio_buffer.append", "audio": base64.b64encode(pcm).decode("ascii")}
+
+
+def test_peek_type_when_type_comes_first():
+    assert peek_type('{"type":"error","error":{"type":"x"}}') == "error"
+    assert peek_type('{"type": "session.created"}') == "session.created"
+
+
+def test_peek_type_finds_top_level_key_later():
+    raw = '{"event_id": "e1", "item_id": "i1",\n  "type" :  "conversation.item.input_audio_transcription.delta", "delta": "hej"}'
+    assert peek_type(raw) == json.loads(raw)["type"]
+
+
+def test_peek_type_gives_up_when_unsure():
+    # Nyckeln finns bara i ett nästlat objekt eller en lista
+    assert peek_type('{"error": {"type": "invalid_request_error"}, "event_id": "e"}') is None
+    assert peek_type('{"items": [{"type": "message"}], "type": "x"}') is None
+    # Escapes i värdet
+    assert peek_type('{"type":"a\\"b"}') is None
+    assert peek_type('{"event_id": "e", "type": "a\\u0062"}') is None
+    # Ingen typ, bytes, trasig text
+    assert peek_type('{"event_id": "e"}') is None
+    assert peek_type(b'{"type":"error"}') is None
+    assert peek_type('{"type":"err') is None
+
+
+def test_dispatch_falls_back_to_json_for_escaped_types():
+    seen = []
+
+    async def on_delta(evt: dict) -> None:
+        seen.append(evt["delta"])
+
+    d = EventDispatcher()
+    d.on("x.delta", on_delta)
+    asyncio.run(d.dispatch('{"delta": "a", "type": "x\\u002edelta"}'))
+    asyncio.run(d.dispatch('{"type":"x.other","delta":"b"}'))
+    assert seen == ["a"] and d.decoded == 1 and d.skipped == 1
@@ -0,0 +1,80 @@
+import asyncio
+
+from app.realtime_client import OpenAIRealtimeClient
+from app.realtime_codec import EventDispatcher
+from conftest import RATE, running_mock, voice
+from mock_realtime import MockConfig
+
+MS = RATE * 2 // 1000
+
+
+def new_client(url: str) -> OpenAIRealtimeClient:
+    return OpenAIRealtimeClient(url, "test", "whisper-1", server_vad=False, sample_rate_hz=RATE,
+                                replay_max_bytes=5000 * MS, reconnect_backoff_s=0.01)
+
+
+async def two_utterances(client: OpenAIRealtimeClient, current) -> tuple:
+    """Två commits; mocken bryter anslutningen under den andra."""
+    done: asyncio.Queue = asyncio.Queue()
+
+    async def on_completed(evt: dict) -> None:
+        done.put_nowait(evt["item_id"])
+
+    events = EventDispatcher()
+    events.on("conversation.item.input_audio_transcription.completed", on_completed)
+    await client.connect()
+    recv = asyncio.create_task(client.recv_loop(events))
+    try:
+        await current().send_audio_chunk(voice(300, seed=1))
+        await current().commit()
+        first = await asyncio.wait_for(done.get(), 5)
+        # 600 ms på anslutningen: mocken bryter efter den här chunken
+        await current().send_audio_chunk(voice(300, seed=2))
+        await current().commit()
+        second = await asyncio.wait_for(done.get(), 5)
+    finally:
+        recv.cancel()
+        await asyncio.gather(recv, return_exceptions=True)
+        await current().close()
+    return first, second
+
+
+def test_dropped_upstream_replays_only_unfinished_audio():
+    async def main():
+        # Mocken bryter varje anslutning när den fått 500 ms ljud
+        cfg = MockConfig(delta_delay_ms=10, final_delay_ms=50, deltas=1, script=[], drop_after_ms=500)
+        async with running_mock(cfg) as url:
+            client = new_client(url)
+            first, second = await two_utterances(client, lambda: client)
+        assert first != second
+        assert client.recovery.reconnects == 1 and client.recovery.failures == 0
+        # Första itemet var klart: bara den andra chunken skickades igen
+        assert client.recovery.replayed_bytes == 300 * MS
+        assert client.unacked.start == client.unacked.end == 600 * MS
+
+    asyncio.run(main())
+
+
+def test_reconnect_hands_the_session_over_to_a_fresh_client():
+    async def main():
+        cfg = MockConfig(delta_delay_ms=10, final_delay_ms=50, deltas=1, script=[], drop_after_ms=500)
+        async with running_mock(cfg) as url:
+            client = new_client(url)
+            handed: list = []
+
+            async def acquire() -> OpenAIRealtimeClient:
+                fresh = new_client(url)
+                await fresh.connect()
+                return fresh
+
+            client.connection_source = acquire
+            client.handover = handed.append
+            first, second = await two_utterances(client, lambda: handed[-1] if handed else client)
+            assert first != second and len(handed) == 1
+            fresh = handed[0]
+            # Sessionens tillstånd följde med; den gamla klientens socket stängdes
+            assert fresh.unacked is client.unacked and fresh.recovery is client.recovery
+            assert client.successor is fresh and client.ws.closed
+            assert client.recovery.reconnects == 1 and client.recovery.replayed_bytes == 300 * MS
+
+    asyncio.run(main())
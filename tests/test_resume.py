@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import websockets
+
+from app import metrics
+from app.config import settings
+from app.stt.session import registry
+from conftest import RATE, running_app, running_mock
+from mock_realtime import MockConfig
+
+
+async def recv_until(ws, msg_type: str) -> dict:
+    while True:
+        msg = json.loads(await asyncio.wait_for(ws.recv(), 5))
+        if msg.get("type") == msg_type:
+            return msg
+
+
+def test_resume_requires_the_token_and_tab_close_ends_the_session():
+    async def main():
+        cfg = MockConfig(delta_delay_ms=10, final_delay_ms=50, deltas=1, script=[])
+        async with running_mock(cfg) as url, running_app(url) as base:
+            url = f"{base}/ws/transcribe?encoding=pcm16&sample_rate_hz={RATE}"
+            first = await websockets.connect(url)
+            started = await recv_until(first, "session.started")
+            sid, token = started["session_id"], started["resume_token"]
+            sessions = metrics.SESSIONS.value
+
+            # session_id räcker inte (det är också nyckeln för /ws/subscribe)
+            async with websockets.connect(f"{url}&resume={sid}") as ws:
+                assert (await recv_until(ws, "info"))["msg"] == "resume_unavailable"
+                assert (await recv_until(ws, "session.started"))["session_id"] != sid
+            assert not first.closed
+
+            async with websockets.connect(f"{url}&resume={sid}&resume_token={token}&last_seq=0") as ws:
+                resumed = await recv_until(ws, "session.resumed")
+                assert resumed["session_id"] == sid
+                # Övertagen: den gamla anslutningen stängs
+                await asyncio.wait_for(first.wait_closed(), 5)
+                assert metrics.SESSIONS.value == sessions + 1   # bara försöket utan token
+                await ws.close(1001)
+            for _ in range(100):
+                if registry.get(sid) is None:
+                    break
+                await asyncio.sleep(0.01)
+            assert registry.get(sid) is None
+
+    settings.session_resume_grace_s = 30.0
+    try:
+        asyncio.run(main())
+    finally:
+        settings.session_resume_grace_s = 0.0
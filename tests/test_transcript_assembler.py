@@ -0,0 +1,25 @@
+from app.stt.receive_text_from_realtime import TranscriptAssembler, TranscriptUpdate
+
+DELTA = "conversation.item.input_audio_transcription.delta"
+COMPLETED = "conversation.item.input_audio_transcription.completed"
+
+
+def test_items_are_assembled_separately():
+    t = TranscriptAssembler()
+    assert t.handle({"type": DELTA, "item_id": "a", "delta": "hej "}) == TranscriptUpdate("a", "hej ", False)
+    t.handle({"type": DELTA, "item_id": "b", "delta": "och"})
+    t.handle({"type": DELTA, "item_id": "a", "delta": "då"})
+    assert t.text("a") == "hej då" and t.active() == {"a": "hej då", "b": "och"}
+    # completed: delta = det som inte redan gått ut som partial
+    assert t.handle({"type": COMPLETED, "item_id": "a", "transcript": "hej då!"}) == TranscriptUpdate("a", "!", True)
+    # Ändrad text: hela texten som delta; sena deltas ignoreras
+    assert t.handle({"type": COMPLETED, "item_id": "b", "transcript": "Och"}) == TranscriptUpdate("b", "Och", True)
+    assert t.handle({"type": DELTA, "item_id": "b", "delta": "x"}) is None
+    assert t.finalized() == {"a": "hej då!", "b": "Och"} and t.active() == {}
+
+
+def test_unfinished_items_are_capped():
+    t = TranscriptAssembler(max_active=2)
+    for item_id in "abc":
+        t.delta(item_id, item_id)
+    assert list(t.active()) == ["b", "c"]
@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import pytest
+import websockets
+
+from app.stt import session as session_module
+from app.transcript_cache import TranscriptCache
+from conftest import RATE, running_app, running_mock, silence, voice
+from mock_realtime import MockConfig
+
+
+@pytest.fixture
+def cache():
+    """En egen, påslagen cache för sessionerna; den globala rörs inte."""
+    own = TranscriptCache(enabled=True, sample_rate_hz=RATE)
+    original = session_module.transcript_cache
+    session_module.transcript_cache = own
+    try:
+        yield own
+    finally:
+        session_module.transcript_cache = original
+        own.stop()
+
+
+def key(data: bytes, chunk: int) -> str:
+    h = TranscriptCache(min_ms=100).new_hasher("whisper-1|sv|24000")
+    for i in range(0, len(data), chunk):
+        h.update(data[i:i + chunk])
+    return h.digest()
+
+
+def test_key_ignores_surrounding_silence_and_chunking():
+    clip = voice(600)
+    assert key(clip, 960) == key(silence(300) + clip + silence(500), 1920) == key(silence(20) + clip, 4000)
+    assert key(clip, 960) != key(voice(600, seed=2), 960)
+
+
+def test_too_short_or_silent_audio_has_no_key():
+    assert key(silence(1000), 960) is None
+    assert key(silence(100) + voice(50) + silence(100), 960) is None
+
+
+async def transcribe(base: str, clip: bytes) -> dict:
+    """Skicka `clip` i 20 ms-chunks och vänta på finalen."""
+    async with websockets.connect(f"{base}/ws/transcribe?encoding=pcm16&sample_rate_hz={RATE}") as ws:
+        step = RATE * 2 * 20 // 1000
+        for i in range(0, len(clip), step):
+            await ws.send(clip[i:i + step])
+        while True:
+            msg = json.loads(await asyncio.wait_for(ws.recv(), 10))
+            if msg.get("type") == "stt.final":
+                return msg
+
+
+def test_repeated_clip_hits_the_cache(cache):
+    async def main():
+        cfg = MockConfig(delta_delay_ms=20, final_delay_ms=200, deltas=2, script=[], server_vad_ms=300)
+        async with running_mock(cfg) as url, running_app(url) as base:
+            phrase = voice(700, seed=7)
+            first = await transcribe(base, silence(200) + phrase + silence(600))
+            hits = cache.stats.hits
+            # Samma fras med annan tystnad runt, i en ny session
+            second = await transcribe(base, silence(450) + phrase + silence(800))
+        return first, second, cache.stats.hits - hits
+
+    first, second, hits = asyncio.run(main())
+    assert hits == 1
+    assert second["text"] == first["text"]
+    assert second["item_id"] != first["item_id"]   # ett riktigt upstream-item
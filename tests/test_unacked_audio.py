@@ -0,0 +1,108 @@
+from app.realtime_client import UnackedAudio
+
+MS = 48   # byte per ms PCM16 vid 24 kHz
+
+
+def pcm(ms: int, fill: int) -> bytes:
+    return bytes([fill]) * (ms * MS)
+
+
+def audio(u: UnackedAudio, item_id: str) -> bytes:
+    return b"".join(bytes(v) for v in u.item_audio(item_id))
+
+
+def plan(u: UnackedAudio) -> list:
+    """replay_plan som lista: ljudets längd i ms, None = commit."""
+    return [None if c is None else len(c) // MS for c in u.replay_plan()]
+
+
+def test_explicit_commits_ack_in_item_order():
+    u = UnackedAudio(10**6, MS)
+    a, b = pcm(10, 1), pcm(20, 2)
+    u.append(a)
+    u.note_commit()
+    u.append(b)
+    u.note_commit()
+    u.committed("i1")
+    u.committed("i2")
+    assert audio(u, "i1") == a and audio(u, "i2") == b
+    # i2 klar före i1: inget släpps förrän allt tidigare också är klart
+    u.item_done("i2")
+    assert u.start == 0 and u.pending_bytes == len(a) + len(b)
+    u.item_done("i1")
+    assert u.start == u.end and u.pending_bytes == 0 and not u.items
+
+
+def test_empty_commit_consumes_its_own_offset():
+    u = UnackedAudio(10**6, MS)
+    u.append(pcm(5, 1))
+    u.note_commit()          # under minimigränsen: upstream svarar med fel
+    u.append(pcm(100, 2))
+    u.note_commit()
+    u.commit_empty()
+    u.committed("i1")
+    assert u.items == {"i1": 105 * MS}
+    assert len(audio(u, "i1")) == 105 * MS   # ljudet följde med nästa commit
+
+
+def test_server_vad_commit_cuts_inside_a_chunk():
+    u = UnackedAudio(10**6, MS)
+    data = pcm(400, 1) + pcm(600, 2)
+    u.append(data)
+    u.speech_stopped(300)
+    u.committed("v1")
+    assert audio(u, "v1") == data[:300 * MS]
+    u.item_done("v1")
+    assert u.start == 300 * MS and u.pending_bytes == 700 * MS
+    # audio_end_ms efter det som skickats räknas som slutet
+    u.speech_stopped(5000)
+    u.committed("v2")
+    assert audio(u, "v2") == data[300 * MS:]
+
+
+def test_replay_recommits_pending_items_and_commits():
+    u = UnackedAudio(10**6, MS)
+    u.append(pcm(10, 1))
+    u.note_commit()
+    u.committed("i1")
+    u.append(pcm(20, 2))
+    u.note_commit()          # ännu inte bekräftad
+    u.append(pcm(5, 3))
+    assert plan(u) == [10, None, 20, None, 5]
+    assert list(u.commits) == [10 * MS, 30 * MS] and not u.items and u.base == 0
+
+
+def test_replay_skips_done_audio_and_rebases_vad():
+    u = UnackedAudio(10**6, MS)
+    data = pcm(1000, 1)
+    u.append(data)
+    u.speech_stopped(300)
+    u.committed("v1")
+    u.item_done("v1")
+    assert plan(u) == [700]
+    assert u.base == 300 * MS
+    # Ny anslutning: audio_end_ms räknas från där den började
+    u.speech_stopped(200)
+    u.committed("v2")
+    assert audio(u, "v2") == data[300 * MS:500 * MS]
+
+
+def test_truncated_audio_is_not_replayed_or_hashed():
+    u = UnackedAudio(20 * MS, MS)
+    u.append(pcm(10, 1))
+    u.note_commit()
+    u.committed("i1")
+    u.append(pcm(10, 2))
+    u.append(pcm(10, 3))
+    assert u.truncated_bytes == 10 * MS and u.start == 10 * MS
+    assert u.item_audio("i1") is None
+    # i1:s gräns ligger vid början av det som finns kvar: ingen commit i planen
+    assert plan(u) == [10, 10]
+
+
+def test_vad_offsets_follow_the_upstream_rate():
+    u = UnackedAudio(10**6, 32)   # 16 kHz
+    u.append(bytes(32 * 1000))
+    u.speech_stopped(300)
+    u.committed("v1")
+    assert u.items == {"v1": 300 * 32}